@@ -1,5 +1,8 @@
 import argparse
-import itertools
+import contextlib
+import csv
+import json
+import string
 import sys
 import traceback
 
@@ -16,7 +19,10 @@ log = vlogging.getLogger(__name__, 'ycdl_cli')
 # HELPERS ##########################################################################################
 
 def closest_db():
-    return ycdl.ycdldb.YCDLDB.closest_ycdldb()
+    # All of the helpers get the same instance, so a command that gathers
+    # videos from several places only opens the database once and shares
+    # the object cache.
+    return ycdl.ycdldb.YCDLDB.closest_ycdldb(shared=True)
 
 def get_channels_from_args(args):
     '''
@@ -35,22 +41,166 @@ def get_channels_from_args(args):
 
     return channels
 
-def get_videos_from_args(args):
+def get_video_ids_from_args(args):
     '''
     This function unifies video IDs that are part of the command's argparser
-    and videos that come from --video_list listargs into a single stream
-    of Video objects.
+    and videos that come from --video_list listargs into a single list of IDs.
+    The --video_list IDs are read straight from the database without making
+    Video objects.
     '''
     ycdldb = closest_db()
-    videos = []
+    video_ids = []
 
     if args.video_list_args:
-        videos.extend(_video_list_argparse(args.video_list_args))
+        list_args = args.video_list_args
+        rows = ycdldb.get_video_rows(
+            ['id'],
+            channel_id=list_args.channel_id,
+            limit=list_args.limit,
+            orderby=list_args.orderby,
+            state=list_args.state,
+        )
+        video_ids.extend(video_id for (video_id,) in rows)
 
     if args.video_ids:
-        videos.extend(ycdldb.get_videos_by_id(pipeable.input_many(args.video_ids)))
+        video_ids.extend(pipeable.input_many(args.video_ids))
+
+    return video_ids
+
+VIDEO_FORMAT_FIELDS = {
+    'author_id',
+    'duration',
+    'id',
+    'live_broadcast',
+    'published',
+    'published_string',
+    'state',
+    'thumbnail',
+    'title',
+    'views',
+}
+
+CHANNEL_FORMAT_FIELDS = [
+    'id',
+    'name',
+    'automark',
+    'autorefresh',
+    'uploads_playlist',
+    'queuefile_extension',
+]
+
+# Instead of a format string, --format can name one of these to get every
+# row with the --columns as machine-readable records.
+STRUCTURED_FORMATS = {'json', 'jsonl', 'csv', 'tsv'}
+
+OUTPUT_BUFFER_SIZE = 2 ** 20
+
+def _format_fields(format):
+    '''
+    Return the video attributes that are used by the {fields} of the format
+    string, so we don't select any columns that won't be printed.
+    '''
+    fields = {field for (text, field, spec, conversion) in string.Formatter().parse(format) if field}
+    return fields.intersection(VIDEO_FORMAT_FIELDS)
 
-    return videos
+def _positional_format(format, fields):
+    '''
+    Rewrite the {named} fields of the format string as {positional} ones, by
+    their index in `fields`, so that each row tuple can be printed with
+    format(*row) instead of building a dict of keyword arguments.
+    '''
+    indices = {field: index for (index, field) in enumerate(fields)}
+    parts = []
+    for (text, field, spec, conversion) in string.Formatter().parse(format):
+        parts.append(text.replace('{', '{{').replace('}', '}}'))
+        if field is None:
+            continue
+        parts.append('{' + str(indices[field]))
+        if conversion:
+            parts.append('!' + conversion)
+        if spec:
+            parts.append(':' + spec)
+        parts.append('}')
+    return ''.join(parts)
+
+@contextlib.contextmanager
+def _buffered_stdout():
+    '''
+    Write to stdout through a large buffer. pipeable.stdout writes each line
+    separately, which is the bottleneck when listing millions of rows.
+    '''
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, OSError):
+        # Replaced by something that isn't a file, like in a test.
+        yield sys.stdout
+        return
+
+    sys.stdout.flush()
+    # Terminals still get their output line by line.
+    buffering = 1 if sys.stdout.isatty() else OUTPUT_BUFFER_SIZE
+    handle = open(
+        fileno,
+        'w',
+        buffering=buffering,
+        closefd=False,
+        encoding='utf-8',
+        newline='',
+    )
+    try:
+        yield handle
+    finally:
+        handle.flush()
+
+def write_rows(format, fields, rows):
+    '''
+    Write the rows, which are tuples of the fields, to stdout. The format is
+    either one of the STRUCTURED_FORMATS or a format string using the fields.
+    '''
+    # In pythonw, stdout is None.
+    if sys.stdout is None:
+        return
+
+    with _buffered_stdout() as handle:
+        if format == 'jsonl':
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            handle.writelines(encode(dict(zip(fields, row))) + '\n' for row in rows)
+
+        elif format == 'json':
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            handle.write('[')
+            separator = '\n'
+            for row in rows:
+                handle.write(separator)
+                handle.write(encode(dict(zip(fields, row))))
+                separator = ',\n'
+            handle.write('\n]\n')
+
+        elif format in {'csv', 'tsv'}:
+            dialect = 'excel' if format == 'csv' else 'excel-tab'
+            writer = csv.writer(handle, dialect=dialect, lineterminator='\n')
+            writer.writerow(fields)
+            writer.writerows(rows)
+
+        else:
+            format = _positional_format(format, fields)
+            handle.writelines(format.format(*row) + '\n' for row in rows)
+
+def profile_sql_decorator(function):
+    '''
+    Wrap the argparse function so that it runs inside a sqlprofiler.Profile
+    and the report is printed or logged afterwards.
+    '''
+    def wrapped(args):
+        ycdl.sqlprofiler.enable()
+        with ycdl.sqlprofiler.profile(' '.join(sys.argv[1:])) as profile:
+            status = function(args)
+        if args.profile_sql_log:
+            profile.write_report(args.profile_sql_log)
+        else:
+            pipeable.stderr(profile.report())
+        return status
+    return wrapped
 
 # ARGPARSE #########################################################################################
 
@@ -81,17 +231,19 @@ def _channel_list_argparse(args):
     yield from channels
 
 def channel_list_argparse(args):
-    for channel in _channel_list_argparse(args):
-        line = args.format.format(
-            automark=channel.automark,
-            autorefresh=channel.autorefresh,
-            id=channel.id,
-            name=channel.name,
-            queuefile_extension=channel.queuefile_extension,
-            uploads_playlist=channel.uploads_playlist,
-        )
-        pipeable.stdout(line)
-
+    if args.format in STRUCTURED_FORMATS:
+        fields = args.columns or CHANNEL_FORMAT_FIELDS
+    else:
+        fields = CHANNEL_FORMAT_FIELDS
+
+    for field in fields:
+        if field not in CHANNEL_FORMAT_FIELDS:
+            pipeable.stderr(f'{field} is not a channel attribute.')
+            return 1
+
+    channels = _channel_list_argparse(args)
+    rows = (tuple(getattr(channel, field) for field in fields) for channel in channels)
+    write_rows(args.format, fields, rows)
     return 0
 
 def delete_channel_argparse(args):
@@ -113,20 +265,24 @@ def delete_channel_argparse(args):
 
 def download_video_argparse(args):
     ycdldb = closest_db()
-    needs_commit = False
 
     with ycdldb.transaction:
-        for video in get_videos_from_args(args):
-            queuefile = ycdldb.download_video(
-                video,
+        video_ids = get_video_ids_from_args(args)
+        try:
+            counts = ycdldb.download_videos(
+                video_ids,
                 download_directory=args.download_directory,
                 force=args.force,
                 queuefile_extension=args.queuefile_extension,
             )
-            if queuefile is not None:
-                needs_commit = True
+        except ycdl.exceptions.NoSuchVideo as exc:
+            pipeable.stderr(exc.error_message)
+            return 1
 
-        if not needs_commit:
+        for (directory, count) in counts.items():
+            pipeable.stderr(f'{directory}: {count} videos.')
+
+        if not counts:
             return 0
 
         if not (args.autoyes or interactive.getpermission('Commit?')):
@@ -134,11 +290,28 @@ def download_video_argparse(args):
 
     return 0
 
+def download_worker_argparse(args):
+    if args.server:
+        queue = ycdl.downloadqueue.RemoteQueue(args.server)
+    else:
+        queue = ycdl.downloadqueue.LocalQueue(closest_db())
+
+    worker = ycdl.downloadqueue.DownloadWorker(
+        queue,
+        command=args.command,
+        count=args.count,
+        download_directory=args.download_directory,
+        lease=args.lease,
+        name=args.name,
+    )
+    worker.run(only_once=args.once)
+    return 0
+
 def ignore_shorts_argparse(args):
     ycdldb = closest_db()
 
     videos = ycdldb.get_videos_by_sql('''
-    SELECT * FROM videos
+    SELECT videos.id, videos.state FROM videos
     LEFT JOIN channels ON channels.id = videos.author_id
     WHERE is_shorts IS NULL AND duration < 62 AND state = "pending" AND channels.ignore_shorts = 1
     ORDER BY published DESC
@@ -179,58 +352,129 @@ def init_argparse(args):
     pipeable.stdout(ycdldb.data_directory.absolute_path)
     return 0
 
-def refresh_channels_argparse(args):
-    needs_commit = False
-    status = 0
-
+def mark_state_argparse(args):
     ycdldb = closest_db()
-    with ycdldb.transaction:
-        if args.channels:
-            channels = [ycdldb.get_channel(c) for c in args.channels]
-            for channel in channels:
-                try:
-                    channel.refresh(force=args.force)
-                    needs_commit = True
-                except Exception as exc:
-                    log.warning(traceback.format_exc())
-                    status = 1
-        else:
-            excs = ycdldb.refresh_all_channels(force=args.force, skip_failures=True)
-            needs_commit = True
 
-        if not needs_commit:
-            return status
+    with ycdldb.transaction:
+        video_ids = get_video_ids_from_args(args)
+        try:
+            changed = ycdldb.mark_videos_state(video_ids, args.state)
+        except (ycdl.exceptions.InvalidVideoState, ycdl.exceptions.NoSuchVideo) as exc:
+            pipeable.stderr(exc.error_message)
+            return 1
+        pipeable.stderr(f'Marked {changed} of {len(video_ids)} videos as {args.state}.')
+
+        if not changed:
+            return 0
 
         if not (args.autoyes or interactive.getpermission('Commit?')):
             ycdldb.rollback()
 
-    return status
+    return 0
+
+def merge_argparse(args):
+    ycdldb = closest_db()
+    results = ycdl.merge.merge_databases(
+        ycdldb.database_filepath,
+        args.source_paths,
+        batch_size=args.batch_size,
+        channel_ids=args.channel_ids,
+    )
+    for (source_path, stats) in results.items():
+        for (table, counts) in stats.items():
+            pipeable.stdout(f'{source_path} {table}: {counts["inserted"]} inserted, {counts["updated"]} updated.')
+    return 0
+
+def refresh_channels_argparse(args):
+    status = 0
 
-def _video_list_argparse(args):
     ycdldb = closest_db()
-    videos = ycdldb.get_videos(channel_id=args.channel_id, state=args.state, orderby=args.orderby)
 
-    if args.limit is not None:
-        videos = itertools.islice(videos, args.limit)
+    if args.channels:
+        channels = [ycdldb.get_channel(c) for c in args.channels]
+    else:
+        channels = None
 
-    yield from videos
+    def refresh():
+        nonlocal status
+        if channels is None:
+            ycdldb.refresh_all_channels(
+                commit_every=args.commit_every,
+                force=args.force,
+                skip_failures=True,
+            )
+            return
+
+        # Channel.refresh is atomic, so inside the --dry_run transaction each
+        # channel only makes a savepoint.
+        if ycdldb.in_transaction():
+            transaction = contextlib.nullcontext()
+        else:
+            transaction = ycdldb.transaction
+
+        for channel in channels:
+            try:
+                with transaction:
+                    channel.refresh(force=args.force)
+            except Exception as exc:
+                log.warning(traceback.format_exc())
+                status = 1
+
+    # With --dry_run, everything happens inside one transaction which is
+    # rolled back at the end. Otherwise, there is no outer transaction and the
+    # work is committed as it goes, so a crash or ctrl+c keeps the channels
+    # that were already done.
+    if args.dry_run:
+        with ycdldb.transaction:
+            refresh()
+            ycdldb.rollback()
+    else:
+        refresh()
+
+    if args.metrics_file:
+        ycdl.metrics.write_file(args.metrics_file)
+
+    return status
 
 def video_list_argparse(args):
-    for video in _video_list_argparse(args):
-        line = args.format.format(
-            author_id=video.author_id,
-            duration=video.duration,
-            id=video.id,
-            live_broadcast=video.live_broadcast,
-            published=video.published,
-            published_string=video.published_string,
-            state=video.state,
-            thumbnail=video.thumbnail,
-            title=video.title,
-            views=video.views,
+    all_columns = ycdl.constants.SQL_COLUMNS['videos']
+    if args.format in STRUCTURED_FORMATS:
+        if args.columns:
+            columns = args.columns
+        else:
+            columns = [c for c in all_columns if c not in ycdl.objects.Video.deferred_columns]
+    else:
+        fields = _format_fields(args.format)
+        columns = fields.union({'published'} if 'published_string' in fields else set())
+        # The format might not use any fields, but we still need a row for
+        # each video.
+        columns = [column for column in all_columns if column in columns] or ['id']
+
+    ycdldb = closest_db()
+    try:
+        rows = ycdldb.get_video_rows(
+            columns,
+            channel_id=args.channel_id,
+            limit=args.limit,
+            orderby=args.orderby,
+            state=args.state,
+        )
+    except ValueError as exc:
+        pipeable.stderr(str(exc))
+        return 1
+
+    # published_string is the only field that isn't a column, so it's added
+    # to the end of each row.
+    if args.format not in STRUCTURED_FORMATS and 'published_string' in fields:
+        published = columns.index('published')
+        to_string = ycdl.helpers.timestamp_to_date_string
+        rows = (
+            row + (None if row[published] is None else to_string(row[published]),)
+            for row in rows
         )
-        pipeable.stdout(line)
+        columns = columns + ['published_string']
 
+    write_rows(args.format, columns, rows)
     return 0
 
 @operatornotify.main_decorator(subject='ycdl_cli')
@@ -242,6 +486,24 @@ def main(argv):
         database and integrate it into other scripts.
         ''',
     )
+    parser.add_argument(
+        '--profile_sql',
+        '--profile-sql',
+        action='store_true',
+        help='''
+        Record every SQL statement the command runs and print a report with the
+        slow statements and repeated (N+1) statements to stderr. Must come
+        before the command name.
+        ''',
+    )
+    parser.add_argument(
+        '--profile_sql_log',
+        '--profile-sql-log',
+        default=None,
+        help='''
+        Like --profile_sql, but append the report to this file.
+        ''',
+    )
     subparsers = parser.add_subparsers()
 
     ################################################################################################
@@ -332,6 +594,7 @@ def main(argv):
         '',
         ['--format', '{id} automark={automark}'],
         '--automark downloaded',
+        '--format csv',
     ]
     p_channel_list.add_argument(
         '--format',
@@ -341,10 +604,22 @@ def main(argv):
         The available attributes are id, name, automark, autorefresh,
         uploads_playlist, queuefile_extension.
 
+        Or one of json, jsonl, csv, tsv to print the --columns of every
+        channel in that format.
+
         If you are using --channel_list as listargs for another command, then
         this argument is not relevant.
         ''',
     )
+    p_channel_list.add_argument(
+        '--columns',
+        nargs='+',
+        default=None,
+        help='''
+        The attributes to include with --format json, jsonl, csv or tsv.
+        By default, all of them.
+        ''',
+    )
     p_channel_list.add_argument(
         '--automark',
         help='''
@@ -405,7 +680,8 @@ def main(argv):
         description='''
         Create the queuefiles for one or more videos.
 
-        The video will have its state set to "downloaded".
+        The video will have its state set to "downloaded". The number of
+        videos queued into each directory is printed to stderr.
         ''',
     )
     p_download_video.examples = [
@@ -473,6 +749,82 @@ def main(argv):
 
     ################################################################################################
 
+    p_download_worker = subparsers.add_parser(
+        'download_worker',
+        aliases=['download-worker'],
+        description='''
+        Claim videos from the download queue and run the downloader on them.
+
+        Videos are only added to the download queue if use_download_queue is
+        enabled in the ycdl.json config file. Several workers, on this machine
+        or others, can run at the same time without downloading the same video.
+        ''',
+    )
+    p_download_worker.examples = [
+        '--command youtube-dlw --count 4',
+        {'args': '--server http://192.168.1.10:5000 --download_directory D:\\youtube', 'comment': 'Work for a YCDL server on another machine'},
+    ]
+    p_download_worker.add_argument(
+        '--command',
+        default='youtube-dl',
+        help='''
+        The downloader command. The video URL will be appended to the end.
+        ''',
+    )
+    p_download_worker.add_argument(
+        '--count',
+        type=int,
+        default=1,
+        help='''
+        Download this many videos at the same time.
+        ''',
+    )
+    p_download_worker.add_argument(
+        '--download_directory',
+        '--download-directory',
+        default=None,
+        help='''
+        By default, videos are downloaded into the directory that was chosen
+        when they were queued. You can pass this argument to use a specific
+        directory instead.
+        ''',
+    )
+    p_download_worker.add_argument(
+        '--lease',
+        type=int,
+        default=ycdl.constants.DEFAULT_DOWNLOAD_LEASE,
+        help='''
+        Number of seconds that a claimed video is reserved for this worker
+        between heartbeats. If the worker dies, the video will become available
+        to other workers after this long.
+        ''',
+    )
+    p_download_worker.add_argument(
+        '--name',
+        default=None,
+        help='''
+        A name to identify this worker. Defaults to hostname:pid.
+        ''',
+    )
+    p_download_worker.add_argument(
+        '--once',
+        action='store_true',
+        help='''
+        Exit when the queue is empty instead of waiting for more videos.
+        ''',
+    )
+    p_download_worker.add_argument(
+        '--server',
+        default=None,
+        help='''
+        The URL of a ycdl_flask server. By default, the worker uses the nearest
+        database on this machine.
+        ''',
+    )
+    p_download_worker.set_defaults(func=download_worker_argparse)
+
+    ################################################################################################
+
     p_ignore_shorts = subparsers.add_parser(
         'ignore_shorts',
         aliases=['ignore-shorts'],
@@ -495,6 +847,105 @@ def main(argv):
 
     ################################################################################################
 
+    p_mark_state = subparsers.add_parser(
+        'mark_state',
+        aliases=['mark-state'],
+        description='''
+        Set the state of one or more videos to pending, downloaded, or ignored.
+
+        This only changes the database. Use download_video if you want the
+        queuefiles too.
+        ''',
+    )
+    p_mark_state.examples = [
+        {'args': 'thOifuHs6eY --state ignored', 'comment': 'Ignore one video'},
+        {'args': '--state downloaded --video_list --channel UCvBv3PCvD9v-IKKTkd94XPg --state pending', 'comment': 'Mark all pending videos from this channel as downloaded'},
+        {'args': '!i --state pending --yes', 'comment': 'Mark the IDs from stdin as pending'},
+    ]
+    p_mark_state.add_argument(
+        'video_ids',
+        nargs='*',
+        help='''
+        Uses pipeable to support !c clipboard, !i stdin lines of IDs.
+        ''',
+    )
+    p_mark_state.add_argument(
+        '--state',
+        required=True,
+        help='''
+        The new state, pending, downloaded, or ignored.
+        ''',
+    )
+    p_mark_state.add_argument(
+        '--yes',
+        dest='autoyes',
+        action='store_true',
+        help='''
+        Commit the database without prompting.
+        ''',
+    )
+    p_mark_state.add_argument(
+        '--video_list',
+        '--video-list',
+        dest='video_list_args',
+        nargs='...',
+        help='''
+        All remaining arguments will go to the video_list command to generate the
+        list of videos to mark. Do not worry about --format.
+        See video_list --help for help.
+        ''',
+    )
+    p_mark_state.set_defaults(func=mark_state_argparse)
+
+    ################################################################################################
+
+    p_merge = subparsers.add_parser(
+        'merge',
+        description='''
+        Merge the channels, videos and view count history of other YCDL
+        databases into this one.
+
+        Rows that are missing here are added. For rows that exist in both, the
+        metadata is taken from the copy that was fetched more recently, and the
+        video state is taken by priority, downloaded > ignored > pending, so
+        nothing goes back to pending. Your channel settings are kept.
+
+        The sources must be at the same database version as this one.
+        ''',
+    )
+    p_merge.examples = [
+        'other/_ycdl/ycdl.db',
+        'laptop.db desktop.db --channels UC1_uAIS3r8Vu6JjXWvastJg',
+    ]
+    p_merge.add_argument(
+        'source_paths',
+        nargs='+',
+        help='''
+        Any number of ycdl.db files, which are merged in order.
+        ''',
+    )
+    p_merge.add_argument(
+        '--channels',
+        dest='channel_ids',
+        nargs='+',
+        default=None,
+        help='''
+        Only merge these channels and their videos.
+        ''',
+    )
+    p_merge.add_argument(
+        '--batch_size',
+        '--batch-size',
+        type=int,
+        default=ycdl.merge.DEFAULT_BATCH_SIZE,
+        help='''
+        Number of rows from each source table to merge per transaction.
+        ''',
+    )
+    p_merge.set_defaults(func=merge_argparse)
+
+    ################################################################################################
+
     p_refresh_channels = subparsers.add_parser(
         'refresh_channels',
         aliases=['refresh-channels'],
@@ -503,10 +954,15 @@ def main(argv):
 
         New videos will have their state marked with the channel's automark value,
         and queuefiles will be created for channels with automark=downloaded.
+
+        The work is committed as it goes, so if the refresh is interrupted, the
+        channels that were already refreshed are kept. Use --dry_run to see
+        what would happen without saving anything.
         ''',
     )
     p_refresh_channels.examples = [
         '--force',
+        '--dry_run',
         '--channels UC1_uAIS3r8Vu6JjXWvastJg',
     ]
     p_refresh_channels.add_argument(
@@ -526,12 +982,41 @@ def main(argv):
         cost a lot of API calls.
         ''',
     )
+    p_refresh_channels.add_argument(
+        '--metrics_file',
+        '--metrics-file',
+        default=None,
+        help='''
+        Write Prometheus metrics about the refresh to this file when finished,
+        for example into the directory of node_exporter's textfile collector.
+        ''',
+    )
+    p_refresh_channels.add_argument(
+        '--commit_every',
+        '--commit-every',
+        type=int,
+        default=ycdl.constants.DEFAULT_REFRESH_COMMIT_EVERY,
+        help='''
+        When refreshing all channels, commit after every this many channels.
+        Each channel given with --channels is committed on its own.
+        ''',
+    )
+    p_refresh_channels.add_argument(
+        '--dry_run',
+        '--dry-run',
+        action='store_true',
+        help='''
+        Do the whole refresh in one transaction and roll it back at the end,
+        so nothing is saved. This still costs API calls.
+        ''',
+    )
     p_refresh_channels.add_argument(
         '--yes',
         dest='autoyes',
         action='store_true',
         help='''
-        Commit the database without prompting.
+        Has no effect. The refresh used to ask before committing, and this
+        flag skipped the question. It is accepted so existing scripts work.
         ''',
     )
     p_refresh_channels.set_defaults(func=refresh_channels_argparse)
@@ -551,7 +1036,8 @@ def main(argv):
     p_video_list.examples = [
         '--state pending --limit 100',
         '--channel UCzIiTeduaanyEboRfwJJznA --orderby views',
-        '--channel UC6nSFpj9HTCZ5t-N3Rm3-HA --format "{thumbnail} {id}.jpg" | threaded_dl !i 1 {basename}'
+        '--channel UC6nSFpj9HTCZ5t-N3Rm3-HA --format "{thumbnail} {id}.jpg" | threaded_dl !i 1 {basename}',
+        '--format jsonl --columns id author_id published views > videos.jsonl',
     ]
     p_video_list.add_argument(
         '--channel',
@@ -569,6 +1055,19 @@ def main(argv):
         attributes of the video. The available attributes are author_id,
         duration, id, live_broadcast, published, published_string, state,
         title, views, thumbnail.
+
+        Or one of json, jsonl, csv, tsv to print the --columns of every video
+        in that format. The rows are streamed straight from the database, so
+        this is the fastest way to export videos into another program.
+        ''',
+    )
+    p_video_list.add_argument(
+        '--columns',
+        nargs='+',
+        default=None,
+        help='''
+        The database columns to include with --format json, jsonl, csv or tsv.
+        By default, all of them except the description.
         ''',
     )
     p_video_list.add_argument(
@@ -598,10 +1097,14 @@ def main(argv):
     ##
 
     def postprocessor(args):
-        if hasattr(args, 'video_list_args'):
+        # When the listargs weren't given they are None, and parse_args(None)
+        # would parse sys.argv instead.
+        if getattr(args, 'video_list_args', None) is not None:
             args.video_list_args = p_video_list.parse_args(args.video_list_args)
-        if hasattr(args, 'channel_list_args'):
+        if getattr(args, 'channel_list_args', None) is not None:
             args.channel_list_args = p_channel_list.parse_args(args.channel_list_args)
+        if hasattr(args, 'func') and (args.profile_sql or args.profile_sql_log):
+            args.func = profile_sql_decorator(args.func)
         return args
 
     try:
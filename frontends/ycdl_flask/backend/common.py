@@ -4,6 +4,7 @@ Use ycdl_flask_dev.py or ycdl_flask_prod.py.
 '''
 import flask; from flask import request
 import functools
+import html
 import threading
 import time
 import traceback
@@ -54,17 +55,60 @@ site.localhost_only = False
 # network requests and/or burning API calls every time.
 last_refresh = time.time()
 
+# When ycdl.sqlprofiler is enabled by the launcher, every request is profiled.
+# The report can be appended to the bottom of html pages and / or written to
+# a log file.
+sql_profile_footer = False
+sql_profile_log = None
+
 # Request decorators ###############################################################################
 
 @site.before_request
 def before_request():
+    request.start_time = time.perf_counter()
+    request.sql_profile_token = None
+    if ycdl.sqlprofiler.is_enabled():
+        request.sql_profile_token = ycdl.sqlprofiler.start(f'{request.method} {request.full_path}')
     request.is_localhost = (request.remote_addr == '127.0.0.1')
     if site.localhost_only and not request.is_localhost:
         flask.abort(403)
 
+def finish_sql_profile(response):
+    profile = ycdl.sqlprofiler.stop(request.sql_profile_token)
+    report = profile.report()
+    if sql_profile_log:
+        profile.write_report(sql_profile_log)
+    else:
+        log.debug(report)
+
+    html_page = (
+        sql_profile_footer and
+        response.mimetype == 'text/html' and
+        not response.direct_passthrough and
+        not response.is_streamed
+    )
+    if html_page:
+        footer = f'<pre class="sql_profile">{html.escape(report)}</pre>\n</body>'
+        body = response.get_data(as_text=True)
+        response.set_data(body.replace('</body>', footer, 1))
+    return response
+
 @site.after_request
 def after_request(response):
-    response = flasktools.gzip_response(request, response)
+    if getattr(request, 'sql_profile_token', None) is not None:
+        response = finish_sql_profile(response)
+    # Streamed responses like /events must not be read into memory for gzip.
+    if not response.is_streamed:
+        response = flasktools.gzip_response(request, response)
+    # Label by the rule, not the path, so that every channel page counts as
+    # one route.
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    ycdl.metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - request.start_time,
+        method=request.method,
+        route=route,
+        status=response.status_code,
+    )
     return response
 
 site.route = flasktools.decorate_and_route(
@@ -94,13 +138,23 @@ def render_template(request, template_name, **kwargs):
 
 # These functions will be called by the launcher, flask_dev, flask_prod.
 
+# Only the leader process runs the job runner and the background threads.
+# The other processes just add jobs to the queue.
+job_runner = None
+leader_election = None
+
 def init_ycdldb(*args, **kwargs):
     global ycdldb
     ycdldb = ycdl.ycdldb.YCDLDB.closest_ycdldb(*args, **kwargs)
 
-def refresh_all_channels():
+def enqueue_job(kind, arguments=None, *, priority=ycdl.constants.JOB_PRIORITY_USER):
     with ycdldb.transaction:
-        ycdldb.refresh_all_channels(force=False, skip_failures=True)
+        job = ycdldb.enqueue_job(kind, arguments, priority=priority)
+    # Wake the runner after the commit so it can see the job. If the leader is
+    # another process, its runner will find the job on its next poll.
+    if job_runner is not None:
+        job_runner.notify()
+    return job
 
 def refresher_thread(rate):
     global last_refresh
@@ -114,12 +168,14 @@ def refresher_thread(rate):
                 break
             time.sleep(wait)
 
-        log.info('Starting refresh job.')
-        refresh_job = threading.Thread(
-            target=refresh_all_channels,
-            daemon=True,
+        # If the previous refresh is still queued or running, this returns
+        # that job instead of starting another one.
+        log.info('Queueing refresh job.')
+        enqueue_job(
+            'refresh_all_channels',
+            {'force': False},
+            priority=ycdl.constants.JOB_PRIORITY_BACKGROUND,
         )
-        refresh_job.start()
         last_refresh = time.time()
 
 def ignore_shorts_thread(rate):
@@ -134,7 +190,7 @@ def ignore_shorts_thread(rate):
 
         log.info('Starting shorts job.')
         videos = ycdldb.get_videos_by_sql('''
-        SELECT * FROM videos
+        SELECT videos.id, videos.state FROM videos
         LEFT JOIN channels ON channels.id = videos.author_id
         WHERE is_shorts IS NULL AND duration < 182 AND state = "pending" AND channels.ignore_shorts = 1
         ORDER BY published DESC
@@ -164,3 +220,31 @@ def start_refresher_thread(rate):
 
     shorts_killer = threading.Thread(target=ignore_shorts_thread, args=[60], daemon=True)
     shorts_killer.start()
+
+def become_leader(refresh_rate):
+    global job_runner
+    # Jobs added by the other processes are only noticed by polling.
+    job_runner = ycdl.jobs.JobRunner(ycdldb, poll_rate=5).start()
+    if refresh_rate is None:
+        log.info('No background refresher thread because there is no refresh rate.')
+    else:
+        start_refresher_thread(refresh_rate)
+
+def start_background_work(refresh_rate=None):
+    '''
+    Call this in every process after init_ycdldb. When the server runs several
+    processes on the same data directory, one of them is elected to run the
+    job runner, the refresher, and the shorts thread. If that process dies,
+    another one takes over. The events of the leader's jobs are relayed to
+    the other processes, so that /events works no matter which one serves it.
+    '''
+    global leader_election
+    relay_filepath = ycdldb.data_directory.with_child(ycdl.constants.DEFAULT_EVENTS_RELAYNAME)
+    ycdl.events.start_relay(relay_filepath)
+
+    lock_filepath = ycdldb.data_directory.with_child(ycdl.constants.DEFAULT_LEADER_LOCKNAME)
+    leader_election = ycdl.leader.LeaderElection(
+        lock_filepath,
+        on_elected=functools.partial(become_leader, refresh_rate),
+    )
+    leader_election.start()
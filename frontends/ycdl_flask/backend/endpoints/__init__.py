@@ -1,9 +1,15 @@
 from . import basic_endpoints
 from . import channel_endpoints
+from . import event_endpoints
+from . import job_endpoints
+from . import queue_endpoints
 from . import video_endpoints
 
 __all__ = [
     'basic_endpoints',
     'channel_endpoints',
+    'event_endpoints',
+    'job_endpoints',
+    'queue_endpoints',
     'video_endpoints',
 ]
@@ -1,5 +1,7 @@
 import flask; from flask import request
 
+import ycdl
+
 from .. import common
 
 site = common.site
@@ -12,3 +14,9 @@ def root():
 @site.route('/favicon.png')
 def favicon():
     return flask.send_file(common.FAVICON_PATH.absolute_path)
+
+@site.route('/metrics')
+def metrics():
+    response = flask.Response(ycdl.metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
@@ -14,6 +14,20 @@ from .. import common
 
 site = common.site
 
+# These are the columns that channel.html renders for each video card. Asking
+# for only these saves us from reading the descriptions.
+LISTING_COLUMNS = [
+    'id',
+    'published',
+    'author_id',
+    'title',
+    'duration',
+    'views',
+    'live_broadcast',
+    'state',
+    'is_shorts',
+]
+
 def _get_or_insert_video(video_id):
     try:
         video = common.ycdldb.get_video(video_id)
@@ -53,15 +67,28 @@ def _render_videos_listing(videos, channel, state, orderby):
     if not isinstance(videos, list):
         videos = list(videos)
 
+    # The display fields are prepared for all cards at once so that rendering
+    # the template doesn't need to do any database work per video.
+    published_strings = {
+        video.id: ycdl.helpers.timestamp_to_date_string(video.published)
+        for video in videos
+    }
+    if channel is None:
+        author_names = common.ycdldb.get_channel_names(video.author_id for video in videos)
+    else:
+        author_names = {channel.id: channel.name}
+
     all_states = common.ycdldb.get_all_states()
 
     return common.render_template(
         request,
         'channel.html',
         all_states=all_states,
+        author_names=author_names,
         channel=channel,
         state=state,
         orderby=orderby,
+        published_strings=published_strings,
         videos=videos,
     )
 
@@ -81,6 +108,7 @@ def get_channel(channel_id, state=None):
 
     videos = common.ycdldb.get_videos(
         channel_id=channel.id,
+        columns=LISTING_COLUMNS,
         orderby=orderby,
         state=state,
     )
@@ -92,6 +120,7 @@ def get_videos(state=None):
     orderby = request.args.get('orderby', None)
 
     videos = common.ycdldb.get_videos(
+        columns=LISTING_COLUMNS,
         orderby=orderby,
         state=state,
     )
@@ -114,17 +143,10 @@ def get_watch():
 @flasktools.required_fields(['channel_id'], forbid_whitespace=True)
 @site.route('/add_channel', methods=['POST'])
 def post_add_channel():
+    # The channel_id may also be a username, which the job will resolve.
     channel_id = request.form['channel_id']
-    if not (len(channel_id) == 24 and channel_id.startswith('UC')):
-        # It seems they have given us a username instead.
-        try:
-            channel_id = common.ycdldb.youtube.get_user_id(username=channel_id)
-        except ycdl.ytapi.ChannelNotFound:
-            return flasktools.json_response({}, status=404)
-
-    with common.ycdldb.transaction:
-        channel = common.ycdldb.add_channel(channel_id, get_videos=True)
-    return flasktools.json_response(channel.jsonify())
+    job = common.enqueue_job('add_channel', {'channel': channel_id, 'get_videos': True})
+    return flasktools.json_response(job, status=202)
 
 @site.route('/channel/<channel_id>/delete', methods=['POST'])
 def post_delete_channel(channel_id):
@@ -147,18 +169,16 @@ def post_refresh_channel(channel_id):
     except ycdl.exceptions.NoSuchChannel as exc:
         return flasktools.json_response(exc.jsonify(), status=404)
 
-    with common.ycdldb.transaction:
-        channel.refresh(force=force)
-    return flasktools.json_response(channel.jsonify())
+    job = common.enqueue_job('refresh_channel', {'channel_id': channel.id, 'force': force})
+    return flasktools.json_response(job, status=202)
 
 @site.route('/refresh_all_channels', methods=['POST'])
 def post_refresh_all_channels():
     force = request.form.get('force', False)
     force = stringtools.truthystring(force, False)
-    with common.ycdldb.transaction:
-        common.ycdldb.refresh_all_channels(force=force, skip_failures=True)
+    job = common.enqueue_job('refresh_all_channels', {'force': force})
     common.last_refresh = time.time()
-    return flasktools.json_response({})
+    return flasktools.json_response(job, status=202)
 
 @flasktools.required_fields(['state'], forbid_whitespace=True)
 @site.route('/channel/<channel_id>/set_automark', methods=['POST'])
@@ -0,0 +1,52 @@
+'''
+The pages subscribe to /events with an EventSource to see refresh progress and
+new videos as they happen, instead of waiting for the refresh job to finish
+and reloading.
+'''
+import flask; from flask import request
+import json
+
+import ycdl
+
+from .. import common
+
+site = common.site
+
+# Seconds. Proxies tend to close connections that have been quiet for a minute.
+KEEPALIVE_INTERVAL = 15
+
+def format_event(event_type, data, event_id=None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+def stream_events(subscription):
+    try:
+        # If the connection drops, the browser reconnects after this many ms.
+        yield 'retry: 5000\n\n'
+        dropped = 0
+        while True:
+            event = subscription.get(timeout=KEEPALIVE_INTERVAL)
+            if subscription.dropped != dropped:
+                # The page can't be sure it's up to date anymore.
+                dropped = subscription.dropped
+                yield format_event('dropped', {'dropped': dropped})
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event['type'], event['data'], event['id'])
+    finally:
+        # Runs when the client disconnects and the server closes the generator.
+        ycdl.events.unsubscribe(subscription)
+
+@site.route('/events')
+def get_events():
+    subscription = ycdl.events.subscribe()
+    response = flask.Response(stream_events(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,29 @@
+'''
+Slow actions like refreshes return a job instead of making the browser wait.
+The page polls these endpoints until the job is done or failed.
+'''
+import flask; from flask import request
+
+from voussoirkit import flasktools
+
+import ycdl
+
+from .. import common
+
+site = common.site
+
+@site.route('/job/<job_id>.json')
+def get_job(job_id):
+    try:
+        job = common.ycdldb.get_job(job_id)
+    except ycdl.exceptions.NoSuchJob as exc:
+        return flasktools.json_response(exc.jsonify(), status=404)
+    return flasktools.json_response(job)
+
+@site.route('/jobs.json')
+def get_jobs():
+    status = request.args.get('status', None)
+    if status is not None and status not in ycdl.constants.JOB_STATES:
+        flask.abort(400)
+    jobs = common.ycdldb.get_jobs(status=status)
+    return flasktools.json_response({'jobs': jobs})
@@ -0,0 +1,72 @@
+'''
+These endpoints let download workers on other machines share the download
+queue. See ycdl.downloadqueue.RemoteQueue.
+'''
+import flask; from flask import request
+
+from voussoirkit import flasktools
+from voussoirkit import stringtools
+
+import ycdl
+
+from .. import common
+
+site = common.site
+
+def _int_field(name, default):
+    try:
+        return int(request.form.get(name, default))
+    except ValueError:
+        flask.abort(400)
+
+@site.route('/download_queue.json')
+def get_download_queue():
+    items = common.ycdldb.get_download_queue()
+    return flasktools.json_response({'items': items})
+
+@flasktools.required_fields(['worker'], forbid_whitespace=True)
+@site.route('/download_queue/claim', methods=['POST'])
+def post_download_queue_claim():
+    worker = request.form['worker']
+    count = _int_field('count', 1)
+    lease = _int_field('lease', ycdl.constants.DEFAULT_DOWNLOAD_LEASE)
+
+    with common.ycdldb.transaction:
+        items = common.ycdldb.claim_downloads(worker, count=count, lease=lease)
+
+    return flasktools.json_response({'items': items})
+
+@flasktools.required_fields(['worker', 'video_id'], forbid_whitespace=True)
+@site.route('/download_queue/complete', methods=['POST'])
+def post_download_queue_complete():
+    worker = request.form['worker']
+    video_id = request.form['video_id']
+
+    with common.ycdldb.transaction:
+        common.ycdldb.complete_download(worker, video_id)
+
+    return flasktools.json_response({'video_id': video_id})
+
+@flasktools.required_fields(['worker', 'video_id'], forbid_whitespace=True)
+@site.route('/download_queue/fail', methods=['POST'])
+def post_download_queue_fail():
+    worker = request.form['worker']
+    video_id = request.form['video_id']
+    error = request.form.get('error', None)
+
+    with common.ycdldb.transaction:
+        common.ycdldb.fail_download(worker, video_id, error)
+
+    return flasktools.json_response({'video_id': video_id})
+
+@flasktools.required_fields(['worker', 'video_ids'], forbid_whitespace=True)
+@site.route('/download_queue/heartbeat', methods=['POST'])
+def post_download_queue_heartbeat():
+    worker = request.form['worker']
+    video_ids = stringtools.comma_space_split(request.form['video_ids'])
+    lease = _int_field('lease', ycdl.constants.DEFAULT_DOWNLOAD_LEASE)
+
+    with common.ycdldb.transaction:
+        held = common.ycdldb.heartbeat_downloads(worker, video_ids, lease=lease)
+
+    return flasktools.json_response({'video_ids': held})
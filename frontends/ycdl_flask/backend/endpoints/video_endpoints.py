@@ -17,16 +17,11 @@ def post_mark_video_state():
     state = request.form['state']
 
     try:
-        videos = [common.ycdldb.get_video(id) for id in video_ids]
+        with common.ycdldb.transaction:
+            common.ycdldb.mark_videos_state(video_ids, state)
     except ycdl.exceptions.NoSuchVideo as exc:
         return flasktools.json_response(exc.jsonify(), status=404)
-
-    try:
-        with common.ycdldb.transaction:
-            for video in videos:
-                video.mark_state(state)
     except ycdl.exceptions.InvalidVideoState as exc:
-        common.ycdldb.rollback()
         return flasktools.json_response(exc.jsonify(), status=400)
 
     return flasktools.json_response({'video_ids': video_ids, 'state': state})
@@ -38,12 +33,9 @@ def post_start_download():
     video_ids = stringtools.comma_space_split(video_ids)
 
     try:
-        videos = [common.ycdldb.get_video(id) for id in video_ids]
+        with common.ycdldb.transaction:
+            common.ycdldb.download_videos(video_ids)
     except ycdl.exceptions.NoSuchVideo as exc:
         return flasktools.json_response(exc.jsonify(), status=404)
 
-    with common.ycdldb.transaction:
-        for video in videos:
-            common.ycdldb.download_video(video)
-
     return flasktools.json_response({'video_ids': video_ids, 'state': 'downloaded'})
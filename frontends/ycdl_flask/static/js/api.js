@@ -125,6 +125,73 @@ function callback_go_to_channels(response)
     }
 }
 
+/**************************************************************************************************/
+api.events = {};
+
+api.events.subscribe =
+function subscribe(handlers)
+{
+    /*
+    Open the server-sent event stream and call handlers[event_type] with the
+    parsed data of each event. The browser reconnects on its own if the
+    connection drops.
+    */
+    const source = new EventSource("/events");
+    for (const [event_type, handler] of Object.entries(handlers))
+    {
+        source.addEventListener(event_type, event => handler(JSON.parse(event.data)));
+    }
+    return source;
+}
+
+/**************************************************************************************************/
+api.jobs = {};
+
+api.jobs.get_job =
+function get_job(job_id, callback)
+{
+    return http.get({
+        url: `/job/${job_id}.json`,
+        callback: callback,
+    });
+}
+
+api.jobs.wait_for_job =
+function wait_for_job(response, callback, interval)
+{
+    /*
+    Given the response from an endpoint that started a job, poll the job until
+    it is done or failed, then call the callback with the job's response.
+    If the endpoint did not return a job, the callback gets that response.
+    */
+    interval = interval || 2000;
+    if (response.meta.status !== 202)
+    {
+        callback(response);
+        return;
+    }
+
+    function poll()
+    {
+        api.jobs.get_job(response.data.id, function(job_response)
+        {
+            if (job_response.meta.status !== 200)
+            {
+                callback(job_response);
+                return;
+            }
+            const status = job_response.data.status;
+            if (status === "done" || status === "failed")
+            {
+                callback(job_response);
+                return;
+            }
+            setTimeout(poll, interval);
+        });
+    }
+    setTimeout(poll, interval);
+}
+
 /**************************************************************************************************/
 api.videos = {};
 
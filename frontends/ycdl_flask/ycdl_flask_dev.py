@@ -33,6 +33,8 @@ def ycdl_flask_launch(
         *,
         localhost_only,
         port,
+        profile_sql,
+        profile_sql_log,
         refresh_rate,
         use_https,
     ):
@@ -56,6 +58,12 @@ def ycdl_flask_launch(
         log.info('Setting localhost_only=True')
         site.localhost_only = True
 
+    if profile_sql or profile_sql_log:
+        log.info('Profiling SQL for every request.')
+        ycdl.sqlprofiler.enable()
+        backend.common.sql_profile_footer = profile_sql
+        backend.common.sql_profile_log = profile_sql_log
+
     try:
         backend.common.init_ycdldb()
     except ycdl.exceptions.NoClosestYCDLDB as exc:
@@ -68,10 +76,7 @@ def ycdl_flask_launch(
         message += ' (https)'
     log.info(message)
 
-    if refresh_rate is None:
-        log.info('No background refresher thread because --refresh-rate was not passed.')
-    else:
-        backend.common.start_refresher_thread(refresh_rate)
+    backend.common.start_background_work(refresh_rate)
 
     try:
         http.serve_forever()
@@ -83,6 +88,8 @@ def ycdl_flask_launch_argparse(args):
     return ycdl_flask_launch(
         localhost_only=args.localhost_only,
         port=args.port,
+        profile_sql=args.profile_sql,
+        profile_sql_log=args.profile_sql_log,
         refresh_rate=args.refresh_rate,
         use_https=args.use_https,
     )
@@ -123,6 +130,24 @@ def main(argv):
         Other users on the LAN will be blocked.
         ''',
     )
+    parser.add_argument(
+        '--profile_sql',
+        '--profile-sql',
+        action='store_true',
+        help='''
+        Record every SQL statement of each request and show a report with the
+        slow statements and repeated (N+1) statements at the bottom of each page.
+        ''',
+    )
+    parser.add_argument(
+        '--profile_sql_log',
+        '--profile-sql-log',
+        default=None,
+        help='''
+        Profile every request like --profile_sql, but append the reports to
+        this file instead of the pages.
+        ''',
+    )
     parser.add_argument(
         '--refresh_rate',
         '--refresh-rate',
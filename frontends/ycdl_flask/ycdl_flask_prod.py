@@ -5,6 +5,13 @@ another kind of access control is probably a bad idea!
 
 If you are using Gunicorn, for example:
 gunicorn ycdl_flask_prod:site --bind "0.0.0.0:PORT" --access-logfile "-"
+
+You can run several workers. One of them is elected to run the refresher and
+the job runner, and another takes over if it dies. The refresh progress and new
+videos are relayed from it to the other workers through a file in the data
+directory, so the /events stream works from any worker, about a second behind.
+Don't use --preload, because then the election would happen in the master
+process before forking.
 '''
 import werkzeug.middleware.proxy_fix
 
@@ -19,4 +26,4 @@ site.debug = False
 
 # NOTE: Consider adding a local .json config file.
 backend.common.init_ycdldb()
-backend.common.start_refresher_thread(86400)
+backend.common.start_background_work(86400)
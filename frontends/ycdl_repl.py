@@ -12,7 +12,7 @@ def yrepl_argparse(args):
     global Y
 
     try:
-        Y = ycdl.ycdldb.YCDLDB.closest_ycdldb()
+        Y = ycdl.ycdldb.YCDLDB.closest_ycdldb(shared=True)
     except ycdl.exceptions.NoClosestYCDLDB as exc:
         pipeable.stderr(exc.error_message)
         pipeable.stderr('Try `ycdl_cli.py init` to create the database.')
@@ -0,0 +1,96 @@
+'''
+Runs ycdl_cli refresh_channels --dry_run against utilities/fake_youtube.py and
+checks that nothing is written to the database.
+
+Run from the repository root with:
+
+    python -m unittest discover tests
+'''
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'frontends'))
+sys.path.insert(0, os.path.join(ROOT, 'utilities'))
+
+import ycdl
+import ycdl_cli
+import benchmark
+import fake_youtube
+import generate_synthetic_db
+
+class RefreshDryRunTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        source = os.path.join(cls.tempdir, 'source')
+        cls.source = generate_synthetic_db.generate_synthetic_db(source, channel_count=5, video_count=200)
+
+        cls.fake = fake_youtube.FakeYoutube(cls.source)
+        cls.fake.start()
+        cls.feed_url = ycdl.ytrss.FEED_URL
+        cls.shorts_url = ycdl.ytapi.SHORTS_URL
+        ycdl.ytrss.FEED_URL = cls.fake.url + '/feeds/videos.xml?channel_id={channel_id}'
+        ycdl.ytapi.SHORTS_URL = cls.fake.url + '/shorts/{video_id}'
+
+    @classmethod
+    def tearDownClass(cls):
+        ycdl.ytrss.FEED_URL = cls.feed_url
+        ycdl.ytapi.SHORTS_URL = cls.shorts_url
+        cls.fake.stop()
+        shutil.rmtree(cls.tempdir)
+
+    def setUp(self):
+        # Each test gets a copy that is missing the newest videos, so that a
+        # real refresh would have something to insert.
+        self.directory = tempfile.mkdtemp(dir=self.tempdir)
+        data_directory = os.path.join(self.directory, ycdl.constants.DEFAULT_DATADIR)
+        os.mkdir(data_directory)
+        ycdldb = benchmark.prepare_refresh_copy(self.source, data_directory, missing=2)
+        ycdldb.close()
+
+        self.database_filepath = os.path.join(data_directory, ycdl.constants.DEFAULT_DBNAME)
+        self.youtube = ycdl.ytapi.RestYoutube('fake', api_endpoint=self.fake.url + '/')
+        self.ycdldb = ycdl.ycdldb.YCDLDB.get_shared(data_directory, youtube=self.youtube)
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.ycdldb.close()
+        ycdl.ycdldb._shared_instances.clear()
+
+    def snapshot(self):
+        sql = sqlite3.connect(self.database_filepath)
+        try:
+            videos = sql.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+            refreshes = sql.execute('SELECT id, last_refresh FROM channels ORDER BY id').fetchall()
+        finally:
+            sql.close()
+        return (videos, refreshes)
+
+    def test_dry_run_all_channels(self):
+        before = self.snapshot()
+        status = ycdl_cli.main(['refresh_channels', '--dry_run', '--commit_every', '2'])
+        self.assertEqual(status, 0)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_dry_run_some_channels(self):
+        before = self.snapshot()
+        channel_ids = [channel_id for (channel_id, last_refresh) in before[1][:2]]
+        status = ycdl_cli.main(['refresh_channels', '--dry_run', '--channels', *channel_ids])
+        self.assertEqual(status, 0)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_refresh_without_dry_run_commits(self):
+        (videos, refreshes) = self.snapshot()
+        status = ycdl_cli.main(['refresh_channels', '--commit_every', '2'])
+        self.assertEqual(status, 0)
+        self.assertGreater(self.snapshot()[0], videos)
+
+if __name__ == '__main__':
+    unittest.main()
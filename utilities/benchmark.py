@@ -0,0 +1,841 @@
+'''
+Benchmark the YCDL library against a database, usually one made by
+generate_synthetic_db.py, and save the results as JSON so that commits can be
+compared with each other.
+
+All writes happen inside a transaction that is rolled back, so the database is
+left as it was and no queuefiles are created.
+
+    benchmark.py run path/to/synthetic --output before.json
+    benchmark.py run path/to/synthetic --output after.json
+    benchmark.py compare before.json after.json
+
+The refresh subcommand times refresh_all_channels end to end against
+fake_youtube.py instead of the real Youtube. Each run works on a fresh copy of
+the database with the newest videos of every channel removed, so the refresh
+has something to find.
+
+    benchmark.py refresh path/to/synthetic --output refresh.json
+
+The imports subcommand times `import ycdl` in fresh interpreters, which is
+what every ycdl_cli invocation pays, and fails if the modules that should
+only be imported when going online have been imported.
+
+    benchmark.py imports --max_seconds 0.3
+
+The api subcommand compares the Youtube clients in ytapi.CLIENTS against
+fake_youtube.py: how long each takes to import, the overhead of one call, and
+the throughput of many threads calling at once.
+
+    benchmark.py api path/to/synthetic --output api.json
+
+The view_history subcommand generates view count samples and compares the
+size of video_stats_history with a plain table of one row per sample, and
+times recording samples and querying the history.
+
+    benchmark.py view_history --samples 1000000 --output view_history.json
+'''
+import argparse
+import concurrent.futures
+import fnmatch
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+import ycdl
+
+import fake_youtube
+
+log = vlogging.getLogger(__name__, 'benchmark')
+
+FRONTENDS_DIR = pathclass.Path(__file__).parent.parent.with_child('frontends')
+
+ORDERBYS = ['published', 'views', 'duration', 'random']
+STATES = [None, *ycdl.constants.VIDEO_STATES]
+
+# Each case is registered here with its name. The function receives the
+# Benchmark and should return a function that performs one timed run.
+CASES = {}
+
+def case(name):
+    def wrapper(function):
+        CASES[name] = function
+        return function
+    return wrapper
+
+def git_commit():
+    try:
+        command = ['git', 'rev-parse', 'HEAD']
+        return subprocess.check_output(command, cwd=FRONTENDS_DIR.parent.absolute_path, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fake_api_video(video_id, author_id, *, rand):
+    '''
+    Return a ytapi.Video as if it came from the videos endpoint.
+    '''
+    data = {
+        'id': video_id,
+        'snippet': {
+            'title': f'Benchmark video {video_id}',
+            'description': 'benchmark ' * rand.randint(10, 200),
+            'channelId': author_id,
+            'channelTitle': author_id,
+            'publishedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - rand.randint(0, 10**8))),
+            'liveBroadcastContent': 'none',
+            'thumbnails': {
+                'default': {'url': f'https://i.ytimg.com/vi/{video_id}/default.jpg', 'width': 120, 'height': 90},
+            },
+        },
+        'contentDetails': {'duration': f'PT{rand.randint(1, 59)}M{rand.randint(0, 59)}S'},
+        'statistics': {'viewCount': str(rand.randint(0, 10**7))},
+    }
+    return ycdl.ytapi.Video(data)
+
+class Benchmark:
+    def __init__(self, data_directory, *, repeat, sample_size, seed=0):
+        # We pass a placeholder for the Youtube client because none of the
+        # cases are allowed to make network requests.
+        self.ycdldb = ycdl.ycdldb.YCDLDB(youtube=NotImplemented, data_directory=data_directory)
+        self.repeat = repeat
+        self.sample_size = sample_size
+        self.rand = random.Random(seed)
+
+        self.channel_ids = list(self.ycdldb.select_column('SELECT id FROM channels'))
+        query = 'SELECT id FROM videos ORDER BY random() LIMIT ?'
+        self.sample_video_ids = list(self.ycdldb.select_column(query, [sample_size]))
+        query = 'SELECT id FROM videos WHERE state == "pending" ORDER BY random() LIMIT ?'
+        self.pending_video_ids = list(self.ycdldb.select_column(query, [sample_size]))
+
+    def counts(self):
+        return {
+            'channels': self.ycdldb.select_one_value('SELECT COUNT(*) FROM channels'),
+            'videos': self.ycdldb.select_one_value('SELECT COUNT(*) FROM videos'),
+        }
+
+    def biggest_channel(self):
+        query = 'SELECT author_id FROM videos GROUP BY author_id ORDER BY COUNT(*) DESC LIMIT 1'
+        return self.ycdldb.select_one_value(query)
+
+    def cold(self):
+        '''
+        Empty the object caches so every run starts from the same state.
+        '''
+        self.ycdldb._init_caches()
+
+    def rolled_back(self, function):
+        '''
+        Wrap the function so it runs inside a transaction that is rolled back.
+        '''
+        def run():
+            with self.ycdldb.transaction:
+                function()
+                self.ycdldb.rollback()
+        return run
+
+    def time_case(self, name, setup):
+        run = setup(self)
+        timings = []
+        for x in range(self.repeat):
+            self.cold()
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        log.info('%s: median %.4f s.', name, statistics.median(timings))
+        return {
+            'runs': timings,
+            'median': statistics.median(timings),
+            'min': min(timings),
+        }
+
+# CASES ############################################################################################
+
+def _get_videos_case(orderby, state):
+    def setup(bench):
+        def run():
+            for video in bench.ycdldb.get_videos(orderby=orderby, state=state):
+                pass
+        return run
+    return setup
+
+for orderby in ORDERBYS:
+    for state in STATES:
+        case(f'get_videos.{orderby}.{state or "all"}')(_get_videos_case(orderby, state))
+
+@case('get_channels')
+def _(bench):
+    def run():
+        for channel in bench.ycdldb.get_channels():
+            pass
+    return run
+
+@case('insert_video.new')
+def _(bench):
+    videos = [
+        fake_api_video(f'bench{index:06d}', bench.rand.choice(bench.channel_ids), rand=bench.rand)
+        for index in range(bench.sample_size)
+    ]
+    def run():
+        for video in videos:
+            bench.ycdldb.insert_video(video)
+    return bench.rolled_back(run)
+
+@case('insert_video.existing')
+def _(bench):
+    query = 'SELECT id, author_id FROM videos ORDER BY random() LIMIT ?'
+    rows = bench.ycdldb.select(query, [bench.sample_size])
+    videos = [fake_api_video(video_id, author_id, rand=bench.rand) for (video_id, author_id) in rows]
+    def run():
+        for video in videos:
+            bench.ycdldb.insert_video(video)
+    return bench.rolled_back(run)
+
+@case('ingest_video.new')
+def _(bench):
+    # Only use channels with automark=pending so that ingest does not try to
+    # check for shorts over the network.
+    query = 'SELECT id FROM channels WHERE automark == "pending" OR automark IS NULL'
+    channel_ids = list(bench.ycdldb.select_column(query)) or bench.channel_ids
+    videos = [
+        fake_api_video(f'bench{index:06d}', bench.rand.choice(channel_ids), rand=bench.rand)
+        for index in range(bench.sample_size)
+    ]
+    def run():
+        for video in videos:
+            bench.ycdldb.ingest_video(video)
+    return bench.rolled_back(run)
+
+@case('mark_state')
+def _(bench):
+    def run():
+        for video in bench.ycdldb.get_videos_by_id(bench.sample_video_ids):
+            video.mark_state(bench.rand.choice(ycdl.constants.VIDEO_STATES))
+    return bench.rolled_back(run)
+
+@case('download_video')
+def _(bench):
+    def run():
+        for video_id in bench.pending_video_ids:
+            bench.ycdldb.download_video(video_id)
+    return bench.rolled_back(run)
+
+def _render_case(path):
+    def setup(bench):
+        sys.path.insert(0, FRONTENDS_DIR.with_child('ycdl_flask').absolute_path)
+        import backend
+        backend.common.ycdldb = bench.ycdldb
+        client = backend.site.test_client()
+        url = path.format(channel_id=bench.biggest_channel())
+        def run():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise Exception(f'{url} returned {response.status_code}.')
+        return run
+    return setup
+
+case('render.videos_pending')(_render_case('/videos/pending'))
+case('render.videos_all_limit_1000')(_render_case('/videos?limit=1000'))
+case('render.biggest_channel')(_render_case('/channel/{channel_id}'))
+case('render.channels')(_render_case('/channels'))
+
+# REFRESH ##########################################################################################
+
+REFRESH_MODES = {
+    'refresh.rss_assisted': {'force': False, 'rss_assisted': True},
+    'refresh.traditional': {'force': False, 'rss_assisted': False},
+    'refresh.force': {'force': True, 'rss_assisted': False},
+}
+
+def prepare_refresh_copy(data_directory, destination, *, missing):
+    '''
+    Copy the database into destination and delete the newest `missing` videos
+    of each channel from the copy. Queuefiles go into a subfolder of
+    destination.
+    '''
+    data_directory = pathclass.Path(data_directory)
+    destination = pathclass.Path(destination)
+    shutil.copy(
+        data_directory.with_child(ycdl.constants.DEFAULT_DBNAME).absolute_path,
+        destination.with_child(ycdl.constants.DEFAULT_DBNAME).absolute_path,
+    )
+
+    config = dict(ycdl.constants.DEFAULT_CONFIGURATION)
+    config['download_directory'] = destination.with_child('queue').absolute_path
+    with open(destination.with_child(ycdl.constants.DEFAULT_CONFIGNAME).absolute_path, 'w', encoding='utf-8') as handle:
+        handle.write(json.dumps(config, indent=4, sort_keys=True))
+
+    ycdldb = ycdl.ycdldb.YCDLDB(youtube=NotImplemented, data_directory=destination)
+    query = '''
+    DELETE FROM videos WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY published DESC) AS rank
+            FROM videos
+        ) WHERE rank <= ?
+    )
+    '''
+    with ycdldb.transaction:
+        ycdldb.execute(query, [missing])
+    return ycdldb
+
+def check_shorts(fake) -> bool:
+    '''
+    Return True if ytapi.video_is_shorts gets the right answer from the fake
+    server for a short, which answers 200, and a regular video, which answers
+    303 and must not be followed to the watch page.
+    '''
+    ok = True
+    for is_shorts in (True, False):
+        query = 'SELECT id FROM videos WHERE COALESCE(is_shorts, 0) == ? LIMIT 1'
+        row = fake.sql.execute(query, [int(is_shorts)]).fetchone()
+        if row is None:
+            continue
+        answer = ycdl.ytapi.video_is_shorts(row['id'])
+        if answer != is_shorts:
+            log.error('video_is_shorts(%s) returned %s, expected %s.', row['id'], answer, is_shorts)
+            ok = False
+    return ok
+
+def refresh_argparse(args):
+    fake = fake_youtube.FakeYoutube(
+        args.data_directory,
+        error_rate=args.error_rate,
+        latency=args.latency,
+        quota=args.quota,
+    )
+    fake.start()
+    ycdl.ytrss.FEED_URL = fake.url + '/feeds/videos.xml?channel_id={channel_id}'
+    ycdl.ytapi.SHORTS_URL = fake.url + '/shorts/{video_id}'
+    youtube = ycdl.ytapi.Youtube('fake', api_endpoint=fake.url + '/')
+
+    if not check_shorts(fake):
+        fake.stop()
+        return 1
+
+    names = list(REFRESH_MODES)
+    if args.only:
+        names = [name for name in names if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)]
+
+    results = {}
+    counts = None
+    for name in names:
+        timings = []
+        before_stats = fake.stats()
+        for x in range(args.repeat):
+            with tempfile.TemporaryDirectory() as tempdir:
+                ycdldb = prepare_refresh_copy(args.data_directory, tempdir, missing=args.missing)
+                if counts is None:
+                    counts = {
+                        'channels': ycdldb.select_one_value('SELECT COUNT(*) FROM channels'),
+                        'videos': ycdldb.select_one_value('SELECT COUNT(*) FROM videos'),
+                    }
+                ycdldb.youtube = youtube
+                start = time.perf_counter()
+                ycdldb.refresh_all_channels(skip_failures=True, **REFRESH_MODES[name])
+                timings.append(time.perf_counter() - start)
+                ycdldb.close()
+
+        after_stats = fake.stats()
+        log.info('%s: median %.4f s.', name, statistics.median(timings))
+        results[name] = {
+            'runs': timings,
+            'median': statistics.median(timings),
+            'min': min(timings),
+            'units_per_run': (after_stats['units_used'] - before_stats['units_used']) / args.repeat,
+        }
+
+    fake.stop()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version,
+        'data_directory': pathclass.Path(args.data_directory).absolute_path,
+        'counts': counts,
+        'repeat': args.repeat,
+        'missing': args.missing,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'results': results,
+    }
+    return write_report(report, args.output)
+
+# These are only needed to talk to Youtube, so importing ycdl must not import
+# them.
+LAZY_MODULES = ['bs4', 'googleapiclient', 'isodate', 'lxml', 'requests', 'youtube_credentials']
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import ycdl
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in sys.argv[1:] if m in sys.modules]}))
+'''
+
+def imports_argparse(args):
+    env = dict(os.environ)
+    package_root = pathclass.Path(ycdl.__file__).parent.parent.absolute_path
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+
+    timings = []
+    loaded = set()
+    for x in range(args.repeat):
+        command = [sys.executable, '-c', IMPORT_SCRIPT, *LAZY_MODULES]
+        output = subprocess.run(command, capture_output=True, check=True, env=env, text=True).stdout
+        result = json.loads(output)
+        timings.append(result['elapsed'])
+        loaded.update(result['loaded'])
+
+    median = statistics.median(timings)
+    log.info('import ycdl: median %.4f s.', median)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version,
+        'repeat': args.repeat,
+        'results': {
+            'import.ycdl': {'runs': timings, 'median': median, 'min': min(timings)},
+        },
+        'eagerly_loaded': sorted(loaded),
+    }
+    write_report(report, args.output)
+
+    status = 0
+    if loaded:
+        log.error('import ycdl loaded %s, which should wait until they are needed.', sorted(loaded))
+        status = 1
+    if args.max_seconds is not None and median > args.max_seconds:
+        log.error('import ycdl took %.4f s, more than %.4f s.', median, args.max_seconds)
+        status = 1
+    return status
+
+# The modules each client needs before it can make its first call.
+CLIENT_IMPORTS = {
+    'googleapiclient': 'import googleapiclient.discovery',
+    'rest': 'import requests, requests.adapters',
+}
+
+def _time_import(statement, repeat):
+    script = f'import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)'
+    timings = []
+    for x in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, check=True, text=True)
+        timings.append(float(output.stdout))
+    return statistics.median(timings)
+
+def api_argparse(args):
+    fake = fake_youtube.FakeYoutube(args.data_directory, latency=args.latency)
+    fake.start()
+    ycdldb = ycdl.ycdldb.YCDLDB(youtube=NotImplemented, data_directory=args.data_directory)
+    channel_id = ycdldb.select_one_value('SELECT id FROM channels LIMIT 1')
+    ycdldb.close()
+
+    def make_client(name):
+        return ycdl.ytapi.CLIENTS[name]('fake', api_endpoint=fake.url + '/')
+
+    results = {}
+    for name in ycdl.ytapi.CLIENTS:
+        try:
+            import_seconds = _time_import(CLIENT_IMPORTS[name], args.repeat)
+            client = make_client(name)
+        except (ImportError, subprocess.CalledProcessError) as exc:
+            log.warning('Skipping %s because %s.', name, exc)
+            continue
+
+        start = time.perf_counter()
+        for x in range(args.calls):
+            client.get_user_name(channel_id)
+        per_call = (time.perf_counter() - start) / args.calls
+
+        # googleapiclient's connections can't be shared between threads, so
+        # each thread gets its own client. The others share one.
+        if name == 'googleapiclient':
+            clients = [make_client(name) for x in range(args.threads)]
+        else:
+            clients = [client] * args.threads
+
+        def work(client):
+            for x in range(args.calls):
+                client.get_user_name(channel_id)
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(work, clients))
+        elapsed = time.perf_counter() - start
+
+        results[name] = {
+            'import_seconds': import_seconds,
+            'seconds_per_call': per_call,
+            'concurrent_calls_per_second': (args.threads * args.calls) / elapsed,
+        }
+        log.info('%s: %s', name, results[name])
+
+    fake.stop()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version,
+        'calls': args.calls,
+        'threads': args.threads,
+        'latency': args.latency,
+        'results': results,
+    }
+    return write_report(report, args.output)
+
+def generate_view_samples(rand, *, videos, samples, start):
+    '''
+    Yield (video_id, [(timestamp, views), ...]) spread over a year, with views
+    that grow quickly at first and slowly later, like real videos.
+    '''
+    per_video = max(1, samples // videos)
+    for index in range(videos):
+        video_id = f'v{index:010d}'
+        timestamp = start + rand.randint(0, 86400 * 30)
+        views = rand.randint(0, 1000)
+        rate = rand.paretovariate(1.5) * 10
+        history = []
+        for x in range(per_video):
+            gap = int(rand.expovariate(1 / (86400 * 365 / per_video))) + 1
+            timestamp += gap
+            views += int(rate * gap / (1 + len(history)))
+            history.append((timestamp, views))
+        yield (video_id, history)
+
+def _database_size(sql):
+    sql.execute('VACUUM')
+    page_count = sql.execute('PRAGMA page_count').fetchone()[0]
+    page_size = sql.execute('PRAGMA page_size').fetchone()[0]
+    return page_count * page_size
+
+def view_history_argparse(args):
+    rand = random.Random(args.seed)
+    start = int(time.time()) - (86400 * 400)
+    histories = list(generate_view_samples(rand, videos=args.videos, samples=args.samples, start=start))
+    total = sum(len(history) for (video_id, history) in histories)
+    log.info('Generated %d samples for %d videos.', total, len(histories))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tempdir:
+        tempdir = pathclass.Path(tempdir)
+
+        # Compact: one blob per video per month.
+        sql = sqlite3.connect(tempdir.with_child('compact.db').absolute_path)
+        sql.executescript(ycdl.constants.DB_INIT)
+        encode_start = time.perf_counter()
+        rows = []
+        for (video_id, history) in histories:
+            months = {}
+            for sample in history:
+                months.setdefault(ycdl.viewhistory.month_of(sample[0]), []).append(sample)
+            for (month, samples) in months.items():
+                rows.append((video_id, month, ycdl.viewhistory.encode(samples, month)))
+        encode_seconds = time.perf_counter() - encode_start
+        sql.executemany('INSERT INTO video_stats_history VALUES(?, ?, ?)', rows)
+        sql.commit()
+        compact_bytes = _database_size(sql) - _empty_size(tempdir, 'compact_empty.db', ycdl.constants.DB_INIT)
+
+        decode_start = time.perf_counter()
+        decoded = 0
+        for (month, blob) in sql.execute('SELECT month, samples FROM video_stats_history'):
+            decoded += len(ycdl.viewhistory.decode(blob, month))
+        decode_seconds = time.perf_counter() - decode_start
+        sql.close()
+        if decoded != total:
+            raise AssertionError(f'Decoded {decoded} samples, expected {total}.')
+
+        # Plain: one row per sample, with the index needed to read a video's
+        # history in order.
+        plain_schema = '''
+        CREATE TABLE samples(video_id TEXT NOT NULL, timestamp INT NOT NULL, views INT NOT NULL);
+        CREATE INDEX index_samples_video_timestamp on samples(video_id, timestamp);
+        '''
+        sql = sqlite3.connect(tempdir.with_child('plain.db').absolute_path)
+        sql.executescript(plain_schema)
+        sql.executemany(
+            'INSERT INTO samples VALUES(?, ?, ?)',
+            ((video_id, timestamp, views) for (video_id, history) in histories for (timestamp, views) in history),
+        )
+        sql.commit()
+        plain_bytes = _database_size(sql) - _empty_size(tempdir, 'plain_empty.db', plain_schema)
+        sql.close()
+
+        results['storage'] = {
+            'samples': total,
+            'video_months': len(rows),
+            'compact_bytes': compact_bytes,
+            'plain_bytes': plain_bytes,
+            'compact_bytes_per_million_samples': compact_bytes * 1_000_000 / total,
+            'plain_bytes_per_million_samples': plain_bytes * 1_000_000 / total,
+            'ratio': plain_bytes / compact_bytes,
+            'encode_samples_per_second': total / encode_seconds,
+            'decode_samples_per_second': total / decode_seconds,
+        }
+        log.info('Storage: %s', results['storage'])
+
+        # Going through YCDLDB the way insert_video does.
+        data_directory = tempdir.with_child('ycdl')
+        data_directory.makedirs()
+        sql = sqlite3.connect(data_directory.with_child(ycdl.constants.DEFAULT_DBNAME).absolute_path)
+        sql.execute(f'PRAGMA user_version = {ycdl.constants.DATABASE_VERSION}')
+        sql.executescript(ycdl.constants.DB_INIT)
+        sql.close()
+        ycdldb = ycdl.ycdldb.YCDLDB(youtube=NotImplemented, data_directory=data_directory)
+        recorded = histories[:max(1, args.record_samples // max(1, total // len(histories)))]
+        count = 0
+        record_start = time.perf_counter()
+        with ycdldb.transaction:
+            for (video_id, history) in recorded:
+                for (timestamp, views) in history:
+                    ycdldb.record_video_views(video_id, views, timestamp)
+                    count += 1
+        record_seconds = time.perf_counter() - record_start
+
+        query_start = time.perf_counter()
+        for (video_id, history) in recorded:
+            ycdldb.get_view_history(video_id)
+        history_seconds = (time.perf_counter() - query_start) / len(recorded)
+
+        movers_start = time.perf_counter()
+        ycdldb.get_top_movers(since=start + 86400 * 180, until=start + 86400 * 210)
+        movers_seconds = time.perf_counter() - movers_start
+        ycdldb.close()
+
+        results['queries'] = {
+            'record_seconds_per_sample': record_seconds / count,
+            'get_view_history_seconds': history_seconds,
+            'get_top_movers_seconds': movers_seconds,
+            'videos': len(recorded),
+        }
+        log.info('Queries: %s', results['queries'])
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version,
+        'seed': args.seed,
+        'results': results,
+    }
+    return write_report(report, args.output)
+
+def _empty_size(tempdir, name, schema):
+    sql = sqlite3.connect(tempdir.with_child(name).absolute_path)
+    sql.executescript(schema)
+    size = _database_size(sql)
+    sql.close()
+    return size
+
+####################################################################################################
+
+def write_report(report, output):
+    output_text = json.dumps(report, indent=4, sort_keys=True)
+    if output:
+        with open(output, 'w', encoding='utf-8') as handle:
+            handle.write(output_text)
+    else:
+        print(output_text)
+    return 0
+
+def run_argparse(args):
+    bench = Benchmark(
+        args.data_directory,
+        repeat=args.repeat,
+        sample_size=args.sample_size,
+    )
+
+    names = list(CASES)
+    if args.only:
+        names = [name for name in names if any(fnmatch.fnmatch(name, pattern) for pattern in args.only)]
+
+    results = {}
+    for name in names:
+        try:
+            results[name] = bench.time_case(name, CASES[name])
+        except ImportError as exc:
+            log.warning('Skipping %s because %s.', name, exc)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': sys.version,
+        'data_directory': bench.ycdldb.data_directory.absolute_path,
+        'counts': bench.counts(),
+        'repeat': args.repeat,
+        'sample_size': args.sample_size,
+        'results': results,
+    }
+    return write_report(report, args.output)
+
+def compare_argparse(args):
+    with open(args.before, 'r', encoding='utf-8') as handle:
+        before = json.load(handle)
+    with open(args.after, 'r', encoding='utf-8') as handle:
+        after = json.load(handle)
+
+    print(f'before: {before["commit"]} {before["counts"]}')
+    print(f'after:  {after["commit"]} {after["counts"]}')
+
+    regressions = 0
+    names = sorted(set(before['results']).intersection(after['results']))
+    width = max((len(name) for name in names), default=0)
+    for name in names:
+        old = before['results'][name]['median']
+        new = after['results'][name]['median']
+        ratio = new / old if old else float('inf')
+        marker = ''
+        if ratio > 1 + args.threshold:
+            marker = '  REGRESSION'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            marker = '  improved'
+        print(f'{name:<{width}}  {old:9.4f}s -> {new:9.4f}s  x{ratio:.2f}{marker}')
+
+    return 1 if regressions else 0
+
+@vlogging.main_decorator
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers()
+
+    p_run = subparsers.add_parser('run')
+    p_run.add_argument(
+        'data_directory',
+        help='''
+        The _ycdl data directory to benchmark against.
+        ''',
+    )
+    p_run.add_argument('--output', default=None)
+    p_run.add_argument('--repeat', type=int, default=5)
+    p_run.add_argument(
+        '--sample_size',
+        '--sample-size',
+        type=int,
+        default=500,
+        help='''
+        Number of videos used by the write benchmarks.
+        ''',
+    )
+    p_run.add_argument(
+        '--only',
+        nargs='+',
+        default=None,
+        help='''
+        Only run the cases matching these patterns, like "get_videos.*".
+        ''',
+    )
+    p_run.set_defaults(func=run_argparse)
+
+    p_refresh = subparsers.add_parser('refresh')
+    p_refresh.add_argument(
+        'data_directory',
+        help='''
+        The _ycdl data directory that fake_youtube will serve. It is copied
+        for each run and never modified.
+        ''',
+    )
+    p_refresh.add_argument('--output', default=None)
+    p_refresh.add_argument('--repeat', type=int, default=3)
+    p_refresh.add_argument(
+        '--missing',
+        type=int,
+        default=3,
+        help='''
+        Number of newest videos to delete from each channel before refreshing.
+        Use more than 14 to make the RSS-assisted refresh fall back to the
+        traditional refresh.
+        ''',
+    )
+    p_refresh.add_argument('--latency', type=float, default=0)
+    p_refresh.add_argument('--error_rate', '--error-rate', type=float, default=0)
+    p_refresh.add_argument('--quota', type=int, default=None)
+    p_refresh.add_argument(
+        '--only',
+        nargs='+',
+        default=None,
+        help='''
+        Only run the modes matching these patterns, like "refresh.rss*".
+        ''',
+    )
+    p_refresh.set_defaults(func=refresh_argparse)
+
+    p_imports = subparsers.add_parser('imports')
+    p_imports.add_argument('--output', default=None)
+    p_imports.add_argument('--repeat', type=int, default=10)
+    p_imports.add_argument(
+        '--max_seconds',
+        '--max-seconds',
+        type=float,
+        default=None,
+        help='''
+        Exit with status 1 if the median import takes longer than this.
+        ''',
+    )
+    p_imports.set_defaults(func=imports_argparse)
+
+    p_api = subparsers.add_parser('api')
+    p_api.add_argument(
+        'data_directory',
+        help='''
+        The _ycdl data directory that fake_youtube will serve.
+        ''',
+    )
+    p_api.add_argument('--output', default=None)
+    p_api.add_argument('--repeat', type=int, default=5)
+    p_api.add_argument('--calls', type=int, default=200)
+    p_api.add_argument('--threads', type=int, default=8)
+    p_api.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='''
+        Seconds that fake_youtube waits before each response. With some latency
+        the concurrent throughput shows how well the client overlaps requests.
+        ''',
+    )
+    p_api.set_defaults(func=api_argparse)
+
+    p_view_history = subparsers.add_parser('view_history', aliases=['view-history'])
+    p_view_history.add_argument('--output', default=None)
+    p_view_history.add_argument('--samples', type=int, default=1_000_000)
+    p_view_history.add_argument('--videos', type=int, default=20_000)
+    p_view_history.add_argument(
+        '--record_samples',
+        '--record-samples',
+        type=int,
+        default=20_000,
+        help='''
+        How many of the samples to also write through YCDLDB.record_video_views,
+        which is slower than building the blobs directly.
+        ''',
+    )
+    p_view_history.add_argument('--seed', type=int, default=0)
+    p_view_history.set_defaults(func=view_history_argparse)
+
+    p_compare = subparsers.add_parser('compare')
+    p_compare.add_argument('before')
+    p_compare.add_argument('after')
+    p_compare.add_argument(
+        '--threshold',
+        type=float,
+        default=0.10,
+        help='''
+        Relative change that counts as a regression or improvement.
+        The exit status is 1 if there are any regressions.
+        ''',
+    )
+    p_compare.set_defaults(func=compare_argparse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
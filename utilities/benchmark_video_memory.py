@@ -0,0 +1,104 @@
+'''
+Measure how many bytes each cached Video object costs, comparing the current
+objects.Video against the old style of plain attribute object which kept the
+full description.
+
+This creates a throwaway database in a temporary directory, so it does not
+touch your real database.
+'''
+import argparse
+import gc
+import random
+import string
+import sys
+import tempfile
+import tracemalloc
+
+from voussoirkit import vlogging
+
+import ycdl
+
+class LegacyVideo:
+    '''
+    The way objects.Video used to look, kept here for comparison.
+    '''
+    def __init__(self, ycdldb, db_row):
+        self._worms_database = ycdldb
+        self.deleted = False
+        self.ycdldb = ycdldb
+        self.id = db_row['id']
+        self.published = db_row['published']
+        self.author_id = db_row['author_id']
+        self.title = db_row['title']
+        self.description = db_row['description']
+        self.duration = db_row['duration']
+        self.views = db_row['views']
+        self.thumbnail = db_row['thumbnail']
+        self.live_broadcast = db_row['live_broadcast']
+        self.state = db_row['state']
+        self.is_shorts = None if db_row['is_shorts'] is None else bool(db_row['is_shorts'])
+
+def random_text(length):
+    words = (''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for x in range(length))
+    return ' '.join(words)[:length]
+
+def fill_database(ycdldb, count, description_length):
+    authors = [f'UC{random_text(22).replace(" ", "x")}' for x in range(max(1, count // 500))]
+    with ycdldb.transaction:
+        for index in range(count):
+            video_id = f'{index:011d}'
+            data = {
+                'id': video_id,
+                'published': 1_500_000_000 + index,
+                'author_id': random.choice(authors),
+                'title': random_text(random.randint(20, 90)),
+                'description': random_text(random.randint(description_length // 2, description_length * 2)),
+                'duration': random.randint(10, 7200),
+                'views': random.randint(0, 10_000_000),
+                'thumbnail': f'https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg',
+                'live_broadcast': None,
+                'state': random.choice(ycdl.constants.VIDEO_STATES),
+                'is_shorts': None,
+            }
+            ycdldb.insert(table='videos', pairs=data)
+
+def measure(ycdldb, video_class):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    videos = [video_class(ycdldb, row) for row in ycdldb.select('SELECT * FROM videos')]
+    gc.collect()
+    end = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (end - start) / len(videos)
+
+def benchmark_video_memory_argparse(args):
+    with tempfile.TemporaryDirectory() as tempdir:
+        # We pass a placeholder for the Youtube client because nothing here
+        # makes network requests.
+        ycdldb = ycdl.ycdldb.YCDLDB(youtube=NotImplemented, create=True, data_directory=tempdir)
+        fill_database(ycdldb, count=args.count, description_length=args.description_length)
+
+        before = measure(ycdldb, LegacyVideo)
+        after = measure(ycdldb, ycdl.objects.Video)
+        ycdldb.close()
+
+    print(f'{args.count} videos, descriptions averaging ~{args.description_length} characters.')
+    print(f'Before: {before:,.0f} bytes per video.')
+    print(f'After:  {after:,.0f} bytes per video.')
+    print(f'500,000 cached videos: {before * 500_000 / 2**20:,.0f} MiB before, {after * 500_000 / 2**20:,.0f} MiB after.')
+    return 0
+
+@vlogging.main_decorator
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('--count', type=int, default=20_000)
+    parser.add_argument('--description_length', '--description-length', type=int, default=1500)
+    parser.set_defaults(func=benchmark_video_memory_argparse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
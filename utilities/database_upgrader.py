@@ -1,33 +1,63 @@
 import argparse
+import re
+import shutil
+import sqlite3
 import sys
 
 import ycdl
 
+# Number of rows copied per statement when a table is rebuilt.
+DEFAULT_BATCH_SIZE = 50_000
+
+TRANSFER_PATTERN = re.compile(
+    r'^\s*INSERT INTO (?P<new>\w+) SELECT(?P<select>.*?)FROM (?P<old>\w+)_old\s*;?\s*$',
+    re.DOTALL | re.IGNORECASE,
+)
+
+WITHOUT_ROWID_PATTERN = re.compile(r'\)\s*WITHOUT\s+ROWID\s*;?\s*$', re.IGNORECASE)
+
+class NotEnoughSpace(Exception):
+    pass
+
 class Migrator:
     '''
     Many of the upgraders involve adding columns. ALTER TABLE ADD COLUMN only
     allows adding at the end, which I usually don't prefer. In order to add a
     column in the middle, you must rename the table, create a new one, transfer
-    the data, and drop the old one. But, foreign keys and indices will still
-    point to the old table, which causes broken foreign keys and dropped
-    indices. So, the only way to prevent all that is to regenerate all affected
-    tables and indices. Rather than parsing relationships to determine the
-    affected tables, this implementation just regenerates everything.
+    the data, and drop the old one. The indices go away with the old table, so
+    they have to be created again afterwards.
 
     It's kind of horrible but it allows me to have the columns in the order I
     want instead of just always appending. Besides, modifying collations cannot
     be done in-place either.
 
+    Only the tables whose create or transfer statements were changed by the
+    upgrader are rebuilt, along with any tables that have a foreign key to
+    them, so that their references don't end up pointing at the _old table.
+    Everything else is left alone. Transfers of the usual form
+    INSERT INTO x SELECT ... FROM x_old are copied in batches of rowids with
+    progress, except for WITHOUT ROWID tables which are copied in one
+    statement, and the free disk space is checked before starting.
+
     If you want to truly remove a table or index and not have it get
     regenerated, just do that before instantiating the Migrator.
     '''
-    def __init__(self, ycdldb):
+    def __init__(self, ycdldb, *, batch_size=DEFAULT_BATCH_SIZE):
         self.ycdldb = ycdldb
+        self.batch_size = batch_size
 
-        query = 'SELECT name, sql FROM sqlite_master WHERE type == "table"'
+        query = 'SELECT name, sql FROM sqlite_master WHERE type == "table" AND name NOT LIKE "sqlite_%"'
         self.tables = {
             name: {'create': sql, 'transfer': f'INSERT INTO {name} SELECT * FROM {name}_old'}
-            for (name, sql) in self.ycdldb.select(query)
+            for (name, sql) in self.ycdldb.execute(query).fetchall()
+        }
+        # We compare against these to see which tables the upgrader changed.
+        self.original_tables = {name: dict(table) for (name, table) in self.tables.items()}
+
+        # These have no rowid to batch the transfer on.
+        self.without_rowid = {
+            name for (name, table) in self.tables.items()
+            if WITHOUT_ROWID_PATTERN.search(table['create'])
         }
 
         # The user may be adding entirely new tables derived from the data of
@@ -35,34 +65,102 @@ class Migrator:
         # steps. So we track which tables already existed at the beginning.
         self.existing_tables = set(self.tables)
 
-        query = 'SELECT name, sql FROM sqlite_master WHERE type == "index" AND name NOT LIKE "sqlite_%"'
-        self.indices = list(self.ycdldb.select(query))
+        query = '''
+        SELECT name, tbl_name, sql FROM sqlite_master
+        WHERE type == "index" AND name NOT LIKE "sqlite_%" AND sql IS NOT NULL
+        '''
+        self.indices = self.ycdldb.execute(query).fetchall()
+
+    def _affected_tables(self) -> set:
+        affected = {
+            name for (name, table) in self.tables.items()
+            if table != self.original_tables.get(name)
+        }
+
+        # Tables referencing a rebuilt table must be rebuilt too.
+        while True:
+            more = set()
+            for name in self.existing_tables.difference(affected):
+                foreign_keys = self.ycdldb.execute(f'PRAGMA foreign_key_list({name})').fetchall()
+                if any(row[2] in affected for row in foreign_keys):
+                    more.add(name)
+            if not more:
+                return affected
+            affected.update(more)
+
+    def _estimate_bytes(self, names) -> int:
+        try:
+            query = f'SELECT SUM(pgsize) FROM dbstat WHERE name IN ({", ".join("?" for name in names)})'
+            return self.ycdldb.execute(query, list(names)).fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            # SQLite was built without the dbstat table. Assume the worst.
+            return self.ycdldb.database_filepath.size
+
+    def check_free_space(self, names):
+        '''
+        The rebuilt tables exist twice until the old ones are dropped, and the
+        rollback journal may hold another copy of the pages, so we want twice
+        their size to be free.
+        '''
+        needed = 2 * self._estimate_bytes(names)
+        free = shutil.disk_usage(self.ycdldb.data_directory.absolute_path).free
+        if free < needed:
+            raise NotEnoughSpace(f'Need about {needed} bytes free for {sorted(names)}, but have {free}.')
+
+    def _transfer(self, name, transfer):
+        match = TRANSFER_PATTERN.match(transfer)
+        if not match or match.group('new') != name or match.group('old') != name:
+            self.ycdldb.execute(transfer)
+            return
+
+        if name in self.without_rowid:
+            print(f'Copying {name}.')
+            self.ycdldb.execute(transfer)
+            return
+
+        select = match.group('select')
+        query = f'SELECT MIN(rowid), MAX(rowid) FROM {name}_old'
+        (low, high) = self.ycdldb.execute(query).fetchone()
+        if low is None:
+            return
+
+        batch = f'INSERT INTO {name} SELECT {select} FROM {name}_old WHERE rowid > ? AND rowid <= ?'
+        start = low - 1
+        while start < high:
+            end = start + self.batch_size
+            self.ycdldb.execute(batch, [start, end])
+            start = end
+            print(f'Copying {name}: {min(end, high) - low + 1} / {high - low + 1} rows.')
 
     def go(self):
+        affected = self._affected_tables()
+        if not affected:
+            return
+        rebuilt = affected.intersection(self.existing_tables)
+        if rebuilt:
+            self.check_free_space(rebuilt)
+
         # This loop is split in many parts, because otherwise if table A
         # references table B and table A is completely reconstructed, it will
         # be pointing to the version of B which has not been reconstructed yet,
         # which is about to get renamed to B_old and then A's reference will be
         # broken.
         self.ycdldb.pragma_write('foreign_keys', 'OFF')
-        for (name, table) in self.tables.items():
-            if name not in self.existing_tables:
-                continue
+        for name in rebuilt:
             self.ycdldb.execute(f'ALTER TABLE {name} RENAME TO {name}_old')
 
-        for (name, table) in self.tables.items():
-            self.ycdldb.execute(table['create'])
+        for name in affected:
+            self.ycdldb.execute(self.tables[name]['create'])
 
-        for (name, table) in self.tables.items():
-            self.ycdldb.execute(table['transfer'])
+        for name in affected:
+            self._transfer(name, self.tables[name]['transfer'])
 
-        for (name, query) in self.tables.items():
-            if name not in self.existing_tables:
-                continue
+        for name in rebuilt:
             self.ycdldb.execute(f'DROP TABLE {name}_old')
 
-        for (name, query) in self.indices:
-            self.ycdldb.execute(query)
+        for (name, table_name, query) in self.indices:
+            if table_name in rebuilt:
+                self.ycdldb.execute(query)
         self.ycdldb.pragma_write('foreign_keys', 'ON')
 
 def upgrade_1_to_2(ycdldb):
@@ -413,12 +511,168 @@ def upgrade_11_to_12(ycdldb):
 
     m.go()
 
+def upgrade_12_to_13(ycdldb):
+    '''
+    In this version, the `download_queue` table was added so that download
+    workers on several machines can share the queue without racing on the
+    same queuefiles.
+    '''
+    ycdldb.execute('''
+    CREATE TABLE IF NOT EXISTS download_queue(
+        video_id TEXT PRIMARY KEY NOT NULL,
+        download_directory TEXT,
+        queued INT NOT NULL,
+        worker TEXT,
+        claim TEXT,
+        lease_expires INT,
+        attempts INT NOT NULL,
+        last_error TEXT
+    );
+    ''')
+    ycdldb.execute('CREATE INDEX IF NOT EXISTS index_download_queue_claim on download_queue(claim)')
+    ycdldb.execute('CREATE INDEX IF NOT EXISTS index_download_queue_queued on download_queue(queued)')
+
+def upgrade_13_to_14(ycdldb):
+    '''
+    In this version, the `jobs` table was added so that the web interface can
+    hand slow work like refreshes to a background runner and poll for the
+    result.
+    '''
+    ycdldb.execute('''
+    CREATE TABLE IF NOT EXISTS jobs(
+        id TEXT PRIMARY KEY NOT NULL,
+        kind TEXT NOT NULL,
+        arguments TEXT NOT NULL,
+        dedupe_key TEXT NOT NULL,
+        priority INT NOT NULL,
+        status TEXT NOT NULL,
+        runner TEXT,
+        created INT NOT NULL,
+        started INT,
+        finished INT,
+        result TEXT,
+        error TEXT
+    );
+    ''')
+    ycdldb.execute('CREATE INDEX IF NOT EXISTS index_jobs_dedupe_key on jobs(dedupe_key)')
+    ycdldb.execute('CREATE INDEX IF NOT EXISTS index_jobs_status_priority on jobs(status, priority, created)')
+
+def upgrade_14_to_15(ycdldb):
+    '''
+    In this version, the `live_scheduled`, `live_next_check` and `live_checks`
+    columns were added to the videos table, with a partial index, so that
+    premieres and live streams are re-checked near their scheduled start with
+    backoff instead of on every refresh.
+    '''
+    m = Migrator(ycdldb)
+
+    m.tables['videos']['create'] = '''
+    CREATE TABLE IF NOT EXISTS videos(
+        id TEXT,
+        published INT,
+        author_id TEXT,
+        title TEXT,
+        description TEXT,
+        duration INT,
+        views INT,
+        thumbnail TEXT,
+        live_broadcast TEXT,
+        live_scheduled INT,
+        live_next_check INT,
+        live_checks INT,
+        state TEXT,
+        is_shorts INT
+    );
+    '''
+    # The existing live videos are due right away, which gives them their
+    # schedule on the next refresh.
+    m.tables['videos']['transfer'] = '''
+    INSERT INTO videos SELECT
+        id,
+        published,
+        author_id,
+        title,
+        description,
+        duration,
+        views,
+        thumbnail,
+        live_broadcast,
+        NULL,
+        CASE WHEN live_broadcast IS NULL THEN NULL ELSE 0 END,
+        CASE WHEN live_broadcast IS NULL THEN NULL ELSE 0 END,
+        state,
+        is_shorts
+    FROM videos_old;
+    '''
+
+    m.go()
+
+    ycdldb.execute('''
+    CREATE INDEX IF NOT EXISTS index_video_live_next_check
+    on videos(live_next_check) WHERE live_broadcast IS NOT NULL
+    ''')
+
+def upgrade_15_to_16(ycdldb):
+    '''
+    In this version, the `rss_failures` and `quarantined` columns were added
+    to the channels table, so that channels whose RSS feed keeps returning 404
+    are taken out of the automatic refresh.
+    '''
+    m = Migrator(ycdldb)
+
+    m.tables['channels']['create'] = '''
+    CREATE TABLE IF NOT EXISTS channels(
+        id TEXT,
+        name TEXT,
+        uploads_playlist TEXT,
+        download_directory TEXT COLLATE NOCASE,
+        queuefile_extension TEXT COLLATE NOCASE,
+        automark TEXT,
+        autorefresh INT,
+        last_refresh INT,
+        rss_failures INT,
+        quarantined INT,
+        ignore_shorts INT NOT NULL
+    );
+    '''
+    m.tables['channels']['transfer'] = '''
+    INSERT INTO channels SELECT
+        id,
+        name,
+        uploads_playlist,
+        download_directory,
+        queuefile_extension,
+        automark,
+        autorefresh,
+        last_refresh,
+        0,
+        NULL,
+        ignore_shorts
+    FROM channels_old;
+    '''
+
+    m.go()
+
+def upgrade_16_to_17(ycdldb):
+    '''
+    In this version, the `video_stats_history` table was added to keep the
+    view counts of videos over time. See ycdl/viewhistory.py.
+    '''
+    ycdldb.execute('''
+    CREATE TABLE IF NOT EXISTS video_stats_history(
+        video_id TEXT NOT NULL,
+        month INT NOT NULL,
+        samples BLOB NOT NULL,
+        PRIMARY KEY(video_id, month)
+    ) WITHOUT ROWID;
+    ''')
+
 def upgrade_all(data_directory):
     '''
     Given the directory containing a ycdl database, apply all of the
     needed upgrade_x_to_y functions in order.
     '''
-    ycdldb = ycdl.ycdldb.YCDLDB(data_directory, skip_version_check=True)
+    ycdldb = ycdl.ycdldb.YCDLDB(data_directory=data_directory, skip_version_check=True)
 
     current_version = ycdldb.pragma_read('user_version')
     needed_version = ycdl.constants.DATABASE_VERSION
@@ -438,6 +692,12 @@ def upgrade_all(data_directory):
             ycdldb.pragma_write('user_version', version_number)
 
         current_version = version_number
+
+    # The rebuilt tables and indices have no statistics yet, so the query
+    # planner would be guessing until the next ANALYZE.
+    print('Analyzing.')
+    with ycdldb.transaction:
+        ycdldb.execute('ANALYZE')
     print('Upgrades finished.')
 
 def upgrade_all_argparse(args):
@@ -9,7 +9,7 @@ ycdldb = ycdl.ycdldb.YCDLDB()
 
 DIRECTORY = '.\\youtube thumbnails'
 
-videos = ycdldb.get_videos()
+videos = ycdldb.get_videos(columns=['id', 'thumbnail'])
 for video in videos:
     try:
         thumbnail_path = os.path.join(DIRECTORY, video.id) + '.jpg'
@@ -0,0 +1,437 @@
+'''
+A local stand-in for Youtube, so that refreshes can be exercised and
+benchmarked without the network and without spending API quota.
+
+The channels and videos are read from a YCDL database, usually one made by
+generate_synthetic_db.py. The server provides:
+
+- /feeds/videos.xml?channel_id=X, the RSS feed used by ycdl.ytrss.
+- /youtube/v3/videos, /youtube/v3/playlistItems and /youtube/v3/channels,
+  the Data API endpoints used by ycdl.ytapi.Youtube. Depending on the version
+  of googleapiclient the prefix may differ, so any path ending in one of these
+  names is accepted.
+- HEAD /shorts/X, which answers 200 for shorts and 303 for regular videos.
+  Like the real one, the 303 points at a /watch page that answers 200.
+
+To point YCDL at it:
+
+    ycdl.ytrss.FEED_URL = server.url + '/feeds/videos.xml?channel_id={channel_id}'
+    ycdl.ytapi.SHORTS_URL = server.url + '/shorts/{video_id}'
+    youtube = ycdl.ytapi.Youtube('fake', api_endpoint=server.url)
+
+You can add latency, random server errors, and a quota limit after which the
+API answers 403 quotaExceeded like the real one.
+'''
+import argparse
+import datetime
+import http.server
+import json
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import xml.sax.saxutils
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+import ycdl
+
+log = vlogging.getLogger(__name__, 'fake_youtube')
+
+RSS_LENGTH = 15
+PAGE_SIZE = 50
+
+# The real API charges one unit for each of these list calls.
+UNIT_COSTS = {
+    'videos': 1,
+    'playlistItems': 1,
+    'channels': 1,
+}
+
+def isoformat(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def iso_duration(seconds):
+    (minutes, seconds) = divmod(seconds or 0, 60)
+    (hours, minutes) = divmod(minutes, 60)
+    return f'PT{hours}H{minutes}M{seconds}S'
+
+def uploads_playlist_id(channel_id):
+    # Youtube's uploads playlist is the channel ID with UC replaced by UU.
+    return 'UU' + channel_id[2:]
+
+def video_item(row):
+    item = {
+        'kind': 'youtube#video',
+        'id': row['id'],
+        'snippet': {
+            'publishedAt': isoformat(row['published']),
+            'channelId': row['author_id'],
+            'title': row['title'],
+            'description': row['description'] or '',
+            'channelTitle': row['channel_name'] or row['author_id'],
+            'liveBroadcastContent': row['live_broadcast'] or 'none',
+            'thumbnails': {
+                'default': {
+                    'url': f'https://i.ytimg.com/vi/{row["id"]}/default.jpg',
+                    'width': 120,
+                    'height': 90,
+                },
+                'maxres': {
+                    'url': row['thumbnail'],
+                    'width': 1280,
+                    'height': 720,
+                },
+            },
+        },
+        'contentDetails': {'duration': iso_duration(row['duration'])},
+        'statistics': {'viewCount': str(row['views'] or 0)},
+    }
+    if row['live_scheduled'] is not None:
+        item['liveStreamingDetails'] = {'scheduledStartTime': isoformat(row['live_scheduled'])}
+    return item
+
+class FakeYoutube:
+    def __init__(
+            self,
+            data_directory,
+            *,
+            error_rate=0,
+            latency=0,
+            port=0,
+            quota=None,
+            seed=0,
+        ):
+        '''
+        error_rate:
+            Fraction of requests, 0 to 1, that fail with a 500 error.
+
+        latency:
+            Average number of seconds to wait before answering each request.
+
+        port:
+            0 lets the operating system choose a free port.
+
+        quota:
+            Number of API units to allow before answering every API call with
+            quotaExceeded. None for unlimited.
+        '''
+        data_directory = pathclass.Path(data_directory)
+        self.database_filepath = data_directory.with_child(ycdl.constants.DEFAULT_DBNAME)
+        if not self.database_filepath.is_file:
+            raise FileNotFoundError(self.database_filepath.absolute_path)
+
+        self.error_rate = error_rate
+        self.latency = latency
+        self.quota = quota
+        self.rand = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.units_used = 0
+        self.request_counts = {}
+
+        handler = type('Handler', (FakeYoutubeHandler,), {'fake': self})
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        (host, port) = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def sql(self):
+        # sqlite connections can't be shared between the request threads.
+        try:
+            return self.local.sql
+        except AttributeError:
+            uri = f'file:{self.database_filepath.absolute_path}?mode=ro'
+            self.local.sql = sqlite3.connect(uri, uri=True)
+            self.local.sql.row_factory = sqlite3.Row
+            return self.local.sql
+
+    def count(self, endpoint):
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def spend_units(self, endpoint):
+        '''
+        Return False if the quota has run out.
+        '''
+        with self.lock:
+            if self.quota is not None and self.units_used >= self.quota:
+                return False
+            self.units_used += UNIT_COSTS.get(endpoint, 1)
+            return True
+
+    def should_fail(self):
+        with self.lock:
+            return self.rand.random() < self.error_rate
+
+    def wait(self):
+        if self.latency:
+            with self.lock:
+                delay = self.rand.uniform(self.latency * 0.5, self.latency * 1.5)
+            time.sleep(delay)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        log.info('Fake Youtube serving %s at %s.', self.database_filepath.absolute_path, self.url)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'units_used': self.units_used, 'requests': dict(self.request_counts)}
+
+    # DATA #########################################################################################
+
+    def channels(self, params):
+        channel_id = params.get('id')
+        if channel_id is None:
+            # forUsername lookups can match a channel's name.
+            query = 'SELECT * FROM channels WHERE name == ?'
+            rows = self.sql.execute(query, [params.get('forUsername')]).fetchall()
+        else:
+            rows = self.sql.execute('SELECT * FROM channels WHERE id == ?', [channel_id]).fetchall()
+
+        items = []
+        for row in rows:
+            items.append({
+                'kind': 'youtube#channel',
+                'id': row['id'],
+                'snippet': {'title': row['name'] or row['id']},
+                'contentDetails': {'relatedPlaylists': {'uploads': uploads_playlist_id(row['id'])}},
+            })
+        return {'kind': 'youtube#channelListResponse', 'items': items}
+
+    def playlist_items(self, params):
+        playlist_id = params.get('playlistId', '')
+        channel_id = 'UC' + playlist_id[2:]
+        offset = int(params.get('pageToken') or 0)
+        limit = min(int(params.get('maxResults') or 5), PAGE_SIZE)
+
+        query = '''
+        SELECT id FROM videos WHERE author_id == ?
+        ORDER BY published DESC LIMIT ? OFFSET ?
+        '''
+        # Fetch one extra to know whether there's another page.
+        rows = self.sql.execute(query, [channel_id, limit + 1, offset]).fetchall()
+        items = [{'contentDetails': {'videoId': row['id']}} for row in rows[:limit]]
+        response = {'kind': 'youtube#playlistItemListResponse', 'items': items}
+        if len(rows) > limit:
+            response['nextPageToken'] = str(offset + limit)
+        return response
+
+    def videos(self, params):
+        video_ids = [video_id for video_id in params.get('id', '').split(',') if video_id]
+        video_ids = video_ids[:PAGE_SIZE]
+        if not video_ids:
+            return {'kind': 'youtube#videoListResponse', 'items': []}
+
+        qmarks = ', '.join('?' * len(video_ids))
+        query = f'''
+        SELECT videos.*, channels.name AS channel_name FROM videos
+        LEFT JOIN channels ON channels.id == videos.author_id
+        WHERE videos.id IN ({qmarks})
+        '''
+        rows = {row['id']: row for row in self.sql.execute(query, video_ids)}
+        # Like the real API, unknown IDs are silently left out.
+        items = [video_item(rows[video_id]) for video_id in video_ids if video_id in rows]
+        return {'kind': 'youtube#videoListResponse', 'items': items}
+
+    def feed(self, channel_id):
+        channel = self.sql.execute('SELECT * FROM channels WHERE id == ?', [channel_id]).fetchone()
+        if channel is None:
+            return None
+
+        query = 'SELECT * FROM videos WHERE author_id == ? ORDER BY published DESC LIMIT ?'
+        rows = self.sql.execute(query, [channel_id, RSS_LENGTH]).fetchall()
+
+        escape = xml.sax.saxutils.escape
+        entries = []
+        for row in rows:
+            entries.append(f'''
+            <entry>
+                <id>yt:video:{row["id"]}</id>
+                <yt:videoId>{row["id"]}</yt:videoId>
+                <yt:channelId>{channel_id}</yt:channelId>
+                <title>{escape(row["title"] or "")}</title>
+                <published>{isoformat(row["published"])}</published>
+            </entry>
+            ''')
+
+        return f'''<?xml version="1.0" encoding="UTF-8"?>
+        <feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+            <yt:channelId>{channel_id}</yt:channelId>
+            <title>{escape(channel["name"] or channel_id)}</title>
+            {"".join(entries)}
+        </feed>
+        '''
+
+    def is_shorts(self, video_id):
+        query = 'SELECT is_shorts FROM videos WHERE id == ?'
+        row = self.sql.execute(query, [video_id]).fetchone()
+        if row is None:
+            return None
+        return bool(row['is_shorts'])
+
+class FakeYoutubeHandler(http.server.BaseHTTPRequestHandler):
+    # Set by FakeYoutube when creating the handler subclass.
+    fake = None
+    protocol_version = 'HTTP/1.1'
+    # With keep-alive, Nagle's algorithm holds back each response until the
+    # client's delayed ACK, about 40 ms, which would dwarf everything else.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        log.loud(format, *args)
+
+    def send(self, status, body=b'', content_type='text/plain', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (key, value) in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send(status, json.dumps(data), content_type='application/json; charset=UTF-8')
+
+    def send_api_error(self, status, reason, message):
+        # This is the error format that googleapiclient understands.
+        error = {
+            'error': {
+                'code': status,
+                'message': message,
+                'errors': [{'domain': 'youtube.quota', 'reason': reason, 'message': message}],
+            },
+        }
+        self.send_json(status, error)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        path = url.path.rstrip('/')
+
+        self.fake.wait()
+
+        if path == '/feeds/videos.xml':
+            self.fake.count('rss')
+            if self.fake.should_fail():
+                return self.send(500, 'Internal Server Error')
+            feed = self.fake.feed(params.get('channel_id'))
+            if feed is None:
+                return self.send(404, 'Not Found')
+            return self.send(200, feed, content_type='text/xml; charset=UTF-8')
+
+        if path.startswith('/shorts/'):
+            self.fake.count('shorts')
+            if self.fake.should_fail():
+                return self.send(500, 'Internal Server Error')
+            video_id = path.rsplit('/', 1)[-1]
+            is_shorts = self.fake.is_shorts(video_id)
+            if is_shorts is None:
+                return self.send(404, 'Not Found')
+            if is_shorts:
+                return self.send(200)
+            return self.send(303, headers={'Location': f'/watch?v={video_id}'})
+
+        if path == '/watch':
+            return self.send(200, content_type='text/html; charset=UTF-8')
+
+        return self.api(path.rsplit('/', 1)[-1], params)
+
+    def api(self, endpoint, params):
+        handlers = {
+            'channels': self.fake.channels,
+            'playlistItems': self.fake.playlist_items,
+            'videos': self.fake.videos,
+        }
+        if endpoint not in handlers:
+            return self.send_api_error(404, 'notFound', f'Unknown endpoint {endpoint}.')
+
+        self.fake.count(endpoint)
+        if self.fake.should_fail():
+            return self.send_api_error(500, 'backendError', 'Backend Error')
+
+        if not self.fake.spend_units(endpoint):
+            return self.send_api_error(403, 'quotaExceeded', 'The request cannot be completed because you have exceeded your quota.')
+
+        return self.send_json(200, handlers[endpoint](params))
+
+def fake_youtube_argparse(args):
+    fake = FakeYoutube(
+        args.data_directory,
+        error_rate=args.error_rate,
+        latency=args.latency,
+        port=args.port,
+        quota=args.quota,
+    )
+    print(f'Serving on {fake.url}')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(fake.stats(), indent=4))
+    return 0
+
+@vlogging.main_decorator
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument(
+        'data_directory',
+        help='''
+        The _ycdl data directory whose channels and videos will be served.
+        ''',
+    )
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='''
+        Average seconds of delay before each response.
+        ''',
+    )
+    parser.add_argument(
+        '--error_rate',
+        '--error-rate',
+        type=float,
+        default=0,
+        help='''
+        Fraction of requests, 0 to 1, that fail with a 500 error.
+        ''',
+    )
+    parser.add_argument(
+        '--quota',
+        type=int,
+        default=None,
+        help='''
+        Number of API units to allow before answering quotaExceeded.
+        ''',
+    )
+    parser.set_defaults(func=fake_youtube_argparse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,265 @@
+'''
+Generate a YCDL data directory full of synthetic channels and videos, so that
+performance can be measured without a real database or any API calls.
+
+The distributions try to resemble a real database: a few channels have
+thousands of videos while most have a few dozen, most videos were published in
+the last few years, and recent videos are more likely to still be pending.
+
+All of the timestamps are relative to --now instead of the current time, so
+the same seed and --now always produce the same database.
+'''
+import argparse
+import json
+import math
+import random
+import sqlite3
+import string
+import sys
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+import ycdl
+
+log = vlogging.getLogger(__name__, 'generate_synthetic_db')
+
+# 2026-01-01 00:00:00 UTC.
+DEFAULT_NOW = 1767225600
+
+ID_CHARACTERS = string.ascii_letters + string.digits + '-_'
+WORDS = '''
+about after again all also and another any around back because before best
+build can change come could day different down each even every first from game
+get good great guide have here home how into just know last life like little
+live look make many more most music must new news next night now off old only
+other our out over part people play project quick real review right same see
+series should show some something story take than that the their them then
+there these thing think this those through time today together too top try two
+under update very video want watch way well what when where which while why
+will with without work world would year you your
+'''.split()
+
+def random_id(rand, length):
+    return ''.join(rand.choices(ID_CHARACTERS, k=length))
+
+def random_words(rand, count):
+    return ' '.join(rand.choices(WORDS, k=count))
+
+def random_description(rand, average_length):
+    # Descriptions vary a lot. Many are a single line, some are full essays
+    # with links and timestamps.
+    length = int(rand.expovariate(1 / average_length))
+    words = []
+    total = 0
+    while total < length:
+        word = rand.choice(WORDS)
+        words.append(word)
+        total += len(word) + 1
+    return ' '.join(words)
+
+def choose_state(rand, age_days, automark):
+    if automark == 'downloaded':
+        return rand.choices(['downloaded', 'ignored', 'pending'], weights=[90, 8, 2])[0]
+    if automark == 'ignored':
+        return rand.choices(['ignored', 'downloaded', 'pending'], weights=[95, 3, 2])[0]
+    # Older videos have usually been dealt with by now.
+    pending_weight = 60 * math.exp(-age_days / 90) + 5
+    return rand.choices(
+        ['pending', 'ignored', 'downloaded'],
+        weights=[pending_weight, 60, 25],
+    )[0]
+
+def generate_channels(rand, count, now):
+    for index in range(count):
+        automark = rand.choices(['pending', 'downloaded', 'ignored'], weights=[80, 12, 8])[0]
+        yield {
+            'id': 'UC' + random_id(rand, 22),
+            'name': random_words(rand, rand.randint(1, 3)).title(),
+            'uploads_playlist': None,
+            'download_directory': None,
+            'queuefile_extension': None,
+            'automark': automark,
+            'autorefresh': int(rand.random() < 0.95),
+            'last_refresh': int(now - rand.uniform(0, 86400 * 3)),
+            'rss_failures': 0,
+            'quarantined': None,
+            'ignore_shorts': int(rand.random() < 0.9),
+        }
+
+def video_counts(rand, channel_count, video_count):
+    '''
+    Split video_count among the channels with a heavy-tailed distribution.
+    '''
+    weights = [rand.paretovariate(1.2) for x in range(channel_count)]
+    total = sum(weights)
+    counts = [int(video_count * weight / total) for weight in weights]
+    # Hand out the rounding remainder.
+    for index in rand.choices(range(channel_count), k=video_count - sum(counts)):
+        counts[index] += 1
+    return counts
+
+def generate_videos(rand, channel, count, now, description_length):
+    # Channels start uploading at different times, and most of their uploads
+    # are recent.
+    lifetime = rand.uniform(86400 * 30, 86400 * 365 * 15)
+    for index in range(count):
+        age = lifetime * (rand.random() ** 2)
+        published = int(now - age)
+        duration = int(rand.lognormvariate(math.log(600), 1.0))
+        is_shorts = None
+        if duration < 62:
+            is_shorts = int(rand.random() < 0.7)
+
+        live_broadcast = None
+        live_scheduled = None
+        live_next_check = None
+        live_checks = None
+        if age < 86400 * 30 and rand.random() < 0.005:
+            live_broadcast = rand.choice(['upcoming', 'live'])
+            if live_broadcast == 'upcoming':
+                live_scheduled = int(now + rand.uniform(0, 86400 * 14))
+            # The same as insert_video does for a video it sees for the
+            # first time.
+            live_next_check = ycdl.helpers.next_live_check(
+                live_broadcast=live_broadcast,
+                scheduled_start=live_scheduled,
+                checks=0,
+                now=now,
+            )
+            waiting_for_schedule = (
+                live_scheduled is not None and
+                live_scheduled - ycdl.constants.LIVE_CHECK_LEAD > now
+            )
+            live_checks = 0 if waiting_for_schedule else 1
+
+        video_id = random_id(rand, 11)
+        yield {
+            'id': video_id,
+            'published': published,
+            'author_id': channel['id'],
+            'title': random_words(rand, rand.randint(3, 12)).capitalize(),
+            'description': random_description(rand, description_length),
+            'duration': duration,
+            'views': int(rand.lognormvariate(math.log(5000), 2.0)),
+            'thumbnail': f'https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg',
+            'live_broadcast': live_broadcast,
+            'live_scheduled': live_scheduled,
+            'live_next_check': live_next_check,
+            'live_checks': live_checks,
+            'state': choose_state(rand, age / 86400, channel['automark']),
+            'is_shorts': is_shorts,
+        }
+
+def insert_many(sql, table, rows):
+    rows = list(rows)
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    qmarks = ', '.join('?' * len(columns))
+    query = f'INSERT INTO {table}({", ".join(columns)}) VALUES({qmarks})'
+    sql.executemany(query, ([row[column] for column in columns] for row in rows))
+
+def generate_synthetic_db(
+        directory,
+        *,
+        channel_count,
+        video_count,
+        description_length=800,
+        now=DEFAULT_NOW,
+        seed=0,
+    ):
+    directory = pathclass.Path(directory)
+    data_directory = directory.with_child(ycdl.constants.DEFAULT_DATADIR)
+    database_filepath = data_directory.with_child(ycdl.constants.DEFAULT_DBNAME)
+    if database_filepath.exists:
+        raise FileExistsError(database_filepath.absolute_path)
+
+    data_directory.makedirs(exist_ok=True)
+    rand = random.Random(seed)
+
+    sql = sqlite3.connect(database_filepath.absolute_path)
+    # The database is disposable until it's finished, so we don't need to pay
+    # for durability.
+    sql.execute('PRAGMA journal_mode = OFF')
+    sql.execute('PRAGMA synchronous = OFF')
+    sql.execute(f'PRAGMA user_version = {ycdl.constants.DATABASE_VERSION}')
+    sql.executescript(ycdl.constants.DB_INIT)
+
+    channels = list(generate_channels(rand, channel_count, now))
+    insert_many(sql, 'channels', channels)
+
+    counts = video_counts(rand, channel_count, video_count)
+    done = 0
+    batch = []
+    for (channel, count) in zip(channels, counts):
+        batch.extend(generate_videos(rand, channel, count, now, description_length))
+        if len(batch) >= 50_000:
+            insert_many(sql, 'videos', batch)
+            sql.commit()
+            done += len(batch)
+            batch.clear()
+            log.info('Inserted %d / %d videos.', done, video_count)
+    insert_many(sql, 'videos', batch)
+    sql.commit()
+
+    sql.execute('ANALYZE')
+    sql.commit()
+    sql.close()
+
+    config_filepath = data_directory.with_child(ycdl.constants.DEFAULT_CONFIGNAME)
+    with config_filepath.open('w', encoding='utf-8') as handle:
+        handle.write(json.dumps(ycdl.constants.DEFAULT_CONFIGURATION, indent=4, sort_keys=True))
+
+    log.info('Generated %d channels and %d videos in %s.', channel_count, video_count, data_directory.absolute_path)
+    return data_directory
+
+def generate_synthetic_db_argparse(args):
+    generate_synthetic_db(
+        args.directory,
+        channel_count=args.channel_count,
+        description_length=args.description_length,
+        now=args.now,
+        seed=args.seed,
+        video_count=args.video_count,
+    )
+    return 0
+
+@vlogging.main_decorator
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument(
+        'directory',
+        help='''
+        The _ycdl data directory will be created inside this directory.
+        ''',
+    )
+    parser.add_argument('--channels', dest='channel_count', type=int, default=1000)
+    parser.add_argument('--videos', dest='video_count', type=int, default=200_000)
+    parser.add_argument(
+        '--description_length',
+        '--description-length',
+        type=int,
+        default=800,
+        help='''
+        The average length of the video descriptions.
+        ''',
+    )
+    parser.add_argument(
+        '--now',
+        type=int,
+        default=DEFAULT_NOW,
+        help='''
+        The unix timestamp that the videos' ages and the channels' last
+        refreshes are measured back from.
+        ''',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.set_defaults(func=generate_synthetic_db_argparse)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
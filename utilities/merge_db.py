@@ -1,52 +1,41 @@
-import argparse
-import sqlite3
-import sys
-
-MIGRATE_QUERY = '''
-INSERT INTO {tablename}
-SELECT othertable.* FROM other.{tablename} othertable
-LEFT JOIN {tablename} mytable ON mytable.id == othertable.id
-WHERE mytable.id IS NULL AND {where_clause};
 '''
+Merge the channels and videos of other YCDL databases into this one.
+See ycdl/merge.py for how rows that exist in both are merged.
 
-def _migrate_helper(sql, tablename, where_clause='1==1'):
-    query = MIGRATE_QUERY.format(tablename=tablename, where_clause=where_clause)
-    print(query)
-
-    oldcount = sql.execute('SELECT count(*) FROM %s' % tablename).fetchone()[0]
-    sql.execute(query)
-    sql.commit()
-
-    newcount = sql.execute('SELECT count(*) FROM %s' % tablename).fetchone()[0]
-    print('Gained %d items.' % (newcount - oldcount))
-
-def merge_db(from_db_path, to_db_path, channel):
-    to_db = sqlite3.connect(to_db_path)
-    from_db = sqlite3.connect(from_db_path)
+This is the same as `ycdl_cli.py merge`, but lets you name the target database
+instead of using the one closest to the current directory.
+'''
+import argparse
+import sys
 
-    to_version = to_db.pragma_read('user_version')
-    from_version = from_db.pragma_read('user_version')
+from voussoirkit import vlogging
 
-    if to_version != from_version:
-        raise Exception(f'Databases have different versions: to={to_version}, from={from_version}.')
+import ycdl
 
-    to_db.execute('ATTACH DATABASE "%s" AS other' % from_db_path)
-    if channel == '*':
-        _migrate_helper(to_db, 'channels')
-        _migrate_helper(to_db, 'videos')
-    else:
-        _migrate_helper(to_db, 'channels', where_clause=f'othertable.id == "{channel}"')
-        _migrate_helper(to_db, 'videos', where_clause=f'othertable.author_id == "{channel}"')
+log = vlogging.getLogger(__name__, 'merge_db')
 
 def merge_db_argparse(args):
-    return merge_db(args.from_db_path, args.to_db_path, args.channel)
-
+    channel_ids = args.channel_ids
+    # --channel * used to be required to merge everything.
+    if channel_ids == ['*']:
+        channel_ids = None
+
+    ycdl.merge.merge_databases(
+        args.to_db_path,
+        args.from_db_paths,
+        batch_size=args.batch_size,
+        channel_ids=channel_ids,
+    )
+    return 0
+
+@vlogging.main_decorator
 def main(argv):
     parser = argparse.ArgumentParser(description=__doc__)
 
-    parser.add_argument('--from', dest='from_db_path', required=True)
+    parser.add_argument('--from', dest='from_db_paths', nargs='+', required=True)
     parser.add_argument('--to', dest='to_db_path', required=True)
-    parser.add_argument('--channel', dest='channel', required=True)
+    parser.add_argument('--channel', '--channels', dest='channel_ids', nargs='+', default=None)
+    parser.add_argument('--batch_size', '--batch-size', type=int, default=ycdl.merge.DEFAULT_BATCH_SIZE)
     parser.set_defaults(func=merge_db_argparse)
 
     args = parser.parse_args(argv)
@@ -6,35 +6,446 @@ export ytqueue files, which this script will download as a separate process.
 Rather than maintaining a text file or database of IDs to be downloaded,
 I'm fine with creating each ID as a file and letting the filesystem act
 as the to-do list.
+
+On Linux, the directories are watched with inotify so new queuefiles are
+picked up immediately. On other platforms we fall back to polling.
+
+Several downloader processes can run at the same time, and each process can
+receive several IDs at once so that we don't pay the downloader's startup
+cost for every single video.
 '''
 
 import argparse
+import collections
+import ctypes
+import ctypes.util
 import os
+import select
+import struct
+import subprocess
 import sys
 import time
 
-YOUTUBE_DL = 'youtube-dlw https://www.youtube.com/watch?v={id}'
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__, 'ytqueue')
+
+YOUTUBE_DL = 'youtube-dlw'
+VIDEO_URL = 'https://www.youtube.com/watch?v={id}'
+DEFAULT_EXTENSION = 'ytqueue'
+
+# WATCHERS #########################################################################################
+
+class PollingWatcher:
+    '''
+    Finds queuefiles by listing the directories every `rate` seconds.
+    '''
+    def __init__(self, directories, extensions, rate=10):
+        self.directories = directories
+        self.extensions = extensions
+        self.rate = rate
+
+    def close(self):
+        pass
+
+    def is_queuefile(self, name):
+        return any(name.endswith('.' + extension) for extension in self.extensions)
+
+    def scan(self):
+        '''
+        Return every queuefile currently present in the directories.
+        '''
+        queuefiles = []
+        for directory in self.directories:
+            try:
+                names = os.listdir(directory.absolute_path)
+            except FileNotFoundError:
+                log.warning('%s does not exist.', directory.absolute_path)
+                continue
+            names = sorted(name for name in names if self.is_queuefile(name))
+            queuefiles.extend(directory.with_child(name) for name in names)
+        return queuefiles
+
+    def wait(self, timeout):
+        '''
+        Return the queuefiles that have appeared, waiting no longer than
+        `timeout` seconds.
+        '''
+        time.sleep(min(timeout, self.rate))
+        return self.scan()
+
+class InotifyWatcher(PollingWatcher):
+    '''
+    Finds queuefiles by listening for inotify events, so we don't have to
+    keep listing directories that contain thousands of files.
+    '''
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directories, extensions):
+        super().__init__(directories, extensions)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.watches = {}
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        for directory in directories:
+            directory.makedirs(exist_ok=True)
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory.absolute_path), mask)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), directory.absolute_path)
+            self.watches[wd] = directory
+
+    def close(self):
+        os.close(self.fd)
+
+    def wait(self, timeout):
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        queuefiles = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                log.warning('Inotify queue overflowed, rescanning.')
+                return self.scan()
+
+            name = os.fsdecode(name)
+            if wd in self.watches and self.is_queuefile(name):
+                queuefiles.append(self.watches[wd].with_child(name))
+
+        return queuefiles
+
+def make_watcher(directories, extensions):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directories, extensions)
+        except OSError as exc:
+            log.warning('Could not start inotify (%s), falling back to polling.', exc)
+    return PollingWatcher(directories, extensions)
+
+# DOWNLOADER #######################################################################################
+
+class Batch:
+    def __init__(self, directory, queuefiles, process):
+        self.directory = directory
+        self.queuefiles = queuefiles
+        self.process = process
+        self.started = time.monotonic()
+
+class Downloader:
+    '''
+    Keeps up to `workers` downloader processes running at once. Queuefiles in
+    the same directory are grouped into batches of up to `batch_size` IDs per
+    process. When a batch fails, its members are retried one at a time so we
+    can tell which ones are actually broken.
+    '''
+    def __init__(self, command, workers, batch_size):
+        self.command = command
+        self.workers = workers
+        self.batch_size = batch_size
+
+        # {directory: deque([queuefile, ...])}
+        self.pending = collections.OrderedDict()
+        self.retry_singly = set()
+        self.failed = set()
+        self.known = set()
+        self.running = []
+
+        self.started = time.monotonic()
+        self.done_count = 0
+        self.fail_count = 0
+
+    @property
+    def queue_depth(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+    def add(self, queuefile):
+        if queuefile in self.known or queuefile in self.failed:
+            return
+        self.known.add(queuefile)
+        self.pending.setdefault(queuefile.parent, collections.deque()).append(queuefile)
+
+    def forget_failures(self):
+        '''
+        Failed queuefiles are not tried again until the next full rescan,
+        otherwise a permanently broken video would be downloaded in a loop.
+        '''
+        self.failed.clear()
+
+    def _next_batch(self):
+        (directory, queue) = next(iter(self.pending.items()))
+        # Rotate directories so one big backlog doesn't starve the others.
+        self.pending.move_to_end(directory)
+
+        queuefiles = []
+        while queue and len(queuefiles) < self.batch_size:
+            queuefile = queue.popleft()
+            if not queuefile.exists:
+                self.known.discard(queuefile)
+                continue
+            if queuefile in self.retry_singly and queuefiles:
+                queue.appendleft(queuefile)
+                break
+            queuefiles.append(queuefile)
+            if queuefile in self.retry_singly:
+                break
+
+        if not queue:
+            self.pending.pop(directory)
+
+        return (directory, queuefiles)
+
+    def launch(self):
+        while len(self.running) < self.workers and self.pending:
+            (directory, queuefiles) = self._next_batch()
+            if not queuefiles:
+                continue
+
+            ids = [queuefile.basename.split('.')[0] for queuefile in queuefiles]
+            urls = [VIDEO_URL.format(id=video_id) for video_id in ids]
+            command = ' '.join([self.command, *urls])
+            log.info('Downloading %d in %s: %s', len(ids), directory.absolute_path, ' '.join(ids))
+            process = subprocess.Popen(command, shell=True, cwd=directory.absolute_path)
+            self.running.append(Batch(directory, queuefiles, process))
+
+    def reap(self):
+        still_running = []
+        for batch in self.running:
+            exit_code = batch.process.poll()
+            if exit_code is None:
+                still_running.append(batch)
+                continue
 
-def ytqueue(only_once=False):
-    while True:
-        print(time.strftime('%H:%M:%S'), 'Looking for files.')
-        queue = [f for f in os.listdir() if f.endswith('.ytqueue')]
-        for filename in queue:
-            yt_id = filename.split('.')[0]
-            command = YOUTUBE_DL.format(id=yt_id)
-            exit_code = os.system(command)
             if exit_code == 0:
-                os.remove(filename)
-        if only_once:
-            break
-        time.sleep(10)
+                for queuefile in batch.queuefiles:
+                    os.remove(queuefile.absolute_path)
+                    self.known.discard(queuefile)
+                    self.retry_singly.discard(queuefile)
+                    self.done_count += 1
+            elif len(batch.queuefiles) > 1:
+                log.warning('Batch of %d failed, retrying individually.', len(batch.queuefiles))
+                queue = self.pending.setdefault(batch.directory, collections.deque())
+                for queuefile in reversed(batch.queuefiles):
+                    self.retry_singly.add(queuefile)
+                    queue.appendleft(queuefile)
+                self.pending.move_to_end(batch.directory, last=False)
+            else:
+                (queuefile,) = batch.queuefiles
+                log.warning('%s failed with exit code %s.', queuefile.absolute_path, exit_code)
+                self.known.discard(queuefile)
+                self.retry_singly.discard(queuefile)
+                self.failed.add(queuefile)
+                self.fail_count += 1
+        self.running = still_running
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.done_count / (elapsed / 60) if elapsed else 0
+        log.info(
+            '%d queued, %d running, %d done (%.1f/min), %d failed.',
+            self.queue_depth,
+            sum(len(batch.queuefiles) for batch in self.running),
+            self.done_count,
+            rate,
+            self.fail_count,
+        )
+
+####################################################################################################
+
+def ycdl_locations():
+    '''
+    Return the directories and extensions that the nearest YCDL database will
+    write queuefiles to.
+    '''
+    import ycdl
+    ycdldb = ycdl.ycdldb.YCDLDB.closest_ycdldb()
+
+    directories = {ycdldb.config['download_directory']}
+    query = 'SELECT DISTINCT download_directory FROM channels WHERE download_directory IS NOT NULL'
+    directories.update(ycdldb.select_column(query))
+
+    extensions = {ycdldb.config['queuefile_extension']}
+    query = 'SELECT DISTINCT queuefile_extension FROM channels WHERE queuefile_extension IS NOT NULL'
+    extensions.update(ycdldb.select_column(query))
+
+    return (directories, extensions)
+
+def ytqueue(
+        directories,
+        *,
+        batch_size=1,
+        command=YOUTUBE_DL,
+        extensions=None,
+        only_once=False,
+        report_rate=60,
+        rescan_rate=600,
+        workers=1,
+    ):
+    directories = {pathclass.Path(directory) for directory in directories}
+    directories = sorted(directories, key=lambda directory: directory.absolute_path)
+    extensions = extensions or [DEFAULT_EXTENSION]
+
+    watcher = make_watcher(directories, extensions)
+    downloader = Downloader(command=command, workers=workers, batch_size=batch_size)
+
+    log.info(
+        'Watching %d directories with %s for %s.',
+        len(directories),
+        type(watcher).__name__,
+        ', '.join(extensions),
+    )
+    for directory in directories:
+        log.debug('Watching %s.', directory.absolute_path)
+
+    for queuefile in watcher.scan():
+        downloader.add(queuefile)
+
+    last_rescan = time.monotonic()
+    last_report = time.monotonic()
+    try:
+        while True:
+            downloader.reap()
+            downloader.launch()
+
+            if only_once and not downloader.pending and not downloader.running:
+                break
+
+            now = time.monotonic()
+            if now - last_report >= report_rate:
+                downloader.report()
+                last_report = now
+
+            if now - last_rescan >= rescan_rate:
+                # This catches anything the watcher missed and gives failed
+                # queuefiles another chance.
+                downloader.forget_failures()
+                for queuefile in watcher.scan():
+                    downloader.add(queuefile)
+                last_rescan = now
+
+            # While downloads are running we wake up frequently to reap them.
+            timeout = 1 if downloader.running else report_rate
+            if only_once:
+                time.sleep(timeout)
+                continue
+
+            for queuefile in watcher.wait(timeout):
+                downloader.add(queuefile)
+    finally:
+        watcher.close()
+
+    downloader.report()
+    return 0
 
 def ytqueue_argparse(args):
-    return ytqueue(only_once=args.once)
+    directories = list(args.directories)
+    extensions = list(args.extensions or [])
+
+    if args.use_ycdl:
+        (ycdl_directories, ycdl_extensions) = ycdl_locations()
+        directories.extend(ycdl_directories)
+        extensions.extend(ycdl_extensions)
+
+    if not directories:
+        directories = ['.']
+
+    return ytqueue(
+        directories,
+        batch_size=args.batch_size,
+        command=args.command,
+        extensions=sorted(set(extensions)),
+        only_once=args.once,
+        report_rate=args.report_rate,
+        rescan_rate=args.rescan_rate,
+        workers=args.workers,
+    )
 
+@vlogging.main_decorator
 def main(argv):
     parser = argparse.ArgumentParser()
 
+    parser.add_argument(
+        'directories',
+        nargs='*',
+        help='''
+        Directories to watch for queuefiles. Defaults to the current directory
+        unless --ycdl is used.
+        ''',
+    )
+    parser.add_argument(
+        '--ycdl',
+        dest='use_ycdl',
+        action='store_true',
+        help='''
+        Also watch every download directory configured in the nearest YCDL
+        database, including the channels' own directories and extensions.
+        ''',
+    )
+    parser.add_argument(
+        '--extension',
+        dest='extensions',
+        action='append',
+        help='''
+        Queuefile extension to look for. Can be passed more than once.
+        ''',
+    )
+    parser.add_argument(
+        '--command',
+        default=YOUTUBE_DL,
+        help='''
+        The downloader command. Video URLs are appended to the end.
+        ''',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='''
+        Number of downloader processes to run at the same time.
+        ''',
+    )
+    parser.add_argument(
+        '--batch_size',
+        '--batch-size',
+        type=int,
+        default=1,
+        help='''
+        Number of IDs to hand to each downloader process.
+        ''',
+    )
+    parser.add_argument(
+        '--report_rate',
+        '--report-rate',
+        type=int,
+        default=60,
+        help='''
+        Log the queue depth and throughput every X seconds.
+        ''',
+    )
+    parser.add_argument(
+        '--rescan_rate',
+        '--rescan-rate',
+        type=int,
+        default=600,
+        help='''
+        Fully rescan the directories every X seconds, retrying failed videos.
+        ''',
+    )
     parser.add_argument('--once', dest='once', action='store_true')
     parser.set_defaults(func=ytqueue_argparse)
 
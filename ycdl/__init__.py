@@ -1,11 +1,29 @@
+from . import downloadqueue
+from . import events
 from . import exceptions
 from . import helpers
+from . import jobs
+from . import leader
+from . import merge
+from . import metrics
+from . import resilience
+from . import sqlprofiler
+from . import viewhistory
 from . import ycdldb
 from . import ytapi
 
 __all__ = [
+    'downloadqueue',
+    'events',
     'exceptions',
     'helpers',
+    'jobs',
+    'leader',
+    'merge',
+    'metrics',
+    'resilience',
+    'sqlprofiler',
+    'viewhistory',
     'ycdldb',
     'ytapi',
 ]
@@ -1,6 +1,6 @@
 from voussoirkit import sqlhelpers
 
-DATABASE_VERSION = 12
+DATABASE_VERSION = 17
 
 DB_INIT = f'''
 CREATE TABLE IF NOT EXISTS channels(
@@ -12,10 +12,49 @@ CREATE TABLE IF NOT EXISTS channels(
     automark TEXT,
     autorefresh INT,
     last_refresh INT,
+    rss_failures INT,
+    quarantined INT,
     ignore_shorts INT NOT NULL
 );
 CREATE INDEX IF NOT EXISTS index_channel_id on channels(id);
 ----------------------------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS download_queue(
+    video_id TEXT PRIMARY KEY NOT NULL,
+    download_directory TEXT,
+    queued INT NOT NULL,
+    worker TEXT,
+    claim TEXT,
+    lease_expires INT,
+    attempts INT NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS index_download_queue_claim on download_queue(claim);
+CREATE INDEX IF NOT EXISTS index_download_queue_queued on download_queue(queued);
+----------------------------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS jobs(
+    id TEXT PRIMARY KEY NOT NULL,
+    kind TEXT NOT NULL,
+    arguments TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    priority INT NOT NULL,
+    status TEXT NOT NULL,
+    runner TEXT,
+    created INT NOT NULL,
+    started INT,
+    finished INT,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS index_jobs_dedupe_key on jobs(dedupe_key);
+CREATE INDEX IF NOT EXISTS index_jobs_status_priority on jobs(status, priority, created);
+----------------------------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS video_stats_history(
+    video_id TEXT NOT NULL,
+    month INT NOT NULL,
+    samples BLOB NOT NULL,
+    PRIMARY KEY(video_id, month)
+) WITHOUT ROWID;
+----------------------------------------------------------------------------------------------------
 CREATE TABLE IF NOT EXISTS videos(
     id TEXT,
     published INT,
@@ -26,12 +65,16 @@ CREATE TABLE IF NOT EXISTS videos(
     views INT,
     thumbnail TEXT,
     live_broadcast TEXT,
+    live_scheduled INT,
+    live_next_check INT,
+    live_checks INT,
     state TEXT,
     is_shorts INT
 );
 CREATE INDEX IF NOT EXISTS index_video_author_published on videos(author_id, published);
 CREATE INDEX IF NOT EXISTS index_video_author_state_published on videos(author_id, state, published);
 CREATE INDEX IF NOT EXISTS index_video_id on videos(id);
+CREATE INDEX IF NOT EXISTS index_video_live_next_check on videos(live_next_check) WHERE live_broadcast IS NOT NULL;
 CREATE INDEX IF NOT EXISTS index_video_published on videos(published);
 CREATE INDEX IF NOT EXISTS index_video_state_published on videos(state, published);
 '''
@@ -42,10 +85,57 @@ SQL_INDEX = sqlhelpers.reverse_table_column_map(SQL_COLUMNS)
 DEFAULT_DATADIR = '_ycdl'
 DEFAULT_DBNAME = 'ycdl.db'
 DEFAULT_CONFIGNAME = 'ycdl.json'
+DEFAULT_LEADER_LOCKNAME = 'leader.lock'
+DEFAULT_EVENTS_RELAYNAME = 'events.db'
 
 VIDEO_STATES = ['ignored', 'pending', 'downloaded']
 
+# Seconds that a download worker may hold a claimed video before it must send
+# a heartbeat, otherwise the video is given to another worker.
+DEFAULT_DOWNLOAD_LEASE = 600
+# A video that fails this many times stays in the download queue for
+# inspection but will not be claimed again.
+DEFAULT_DOWNLOAD_MAX_ATTEMPTS = 5
+
+JOB_STATES = ['queued', 'running', 'done', 'failed']
+# Jobs run in order of priority, lowest first. Things the user is waiting for
+# in the browser jump ahead of the regular background refresh.
+JOB_PRIORITY_USER = 0
+JOB_PRIORITY_BACKGROUND = 10
+# Finished jobs are deleted after this many seconds.
+DEFAULT_JOB_RETENTION = 7 * 86400
+
+# Number of channels that refresh_all_channels refreshes between commits when
+# it's running in the background, so that a crash only loses the current chunk
+# and other writers get a turn at the write lock.
+DEFAULT_REFRESH_COMMIT_EVERY = 25
+
+# Upcoming premieres and live streams are re-checked according to their
+# scheduled start time instead of on every refresh. Seconds.
+# An upcoming video is checked this long before its scheduled start, and at
+# least this often in case it gets rescheduled to an earlier time.
+LIVE_CHECK_LEAD = 15 * 60
+LIVE_CHECK_MAX_WAIT = 86400
+# Once a video is live, or its start time has passed, the wait between checks
+# starts at this and doubles each time, up to the maximum.
+LIVE_CHECK_BACKOFF_MIN = 10 * 60
+LIVE_CHECK_BACKOFF_MAX = 6 * 3600
+
+# A channel whose RSS feed is a 404 this many refreshes in a row, without a
+# successful refresh in between, is quarantined: refresh_all_channels skips it
+# until it is refreshed successfully by hand.
+RSS_QUARANTINE_THRESHOLD = 3
+
+# SQLite's default limit on the number of bound variables in one statement,
+# before version 3.32 raised it to 32766.
+SQLITE_MAX_VARIABLES = 999
+
 DEFAULT_CONFIGURATION = {
+    # The Youtube client from ytapi.CLIENTS. "rest" doesn't need
+    # googleapiclient and can be shared between threads.
+    'api_client': 'googleapiclient',
+    'create_queuefiles': True,
     'download_directory': '.',
     'queuefile_extension': 'ytqueue',
+    'use_download_queue': False,
 }
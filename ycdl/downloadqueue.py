@@ -0,0 +1,183 @@
+'''
+This module provides the worker side of the download queue. A worker claims
+videos from the queue, runs the downloader command for each of them, keeps its
+leases alive with heartbeats, and reports the outcome.
+
+The queue can be reached directly through a YCDLDB on the same machine, or
+through the ycdl_flask server for workers on other machines.
+'''
+import os
+import socket
+import subprocess
+import time
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+from . import constants
+
+VIDEO_URL = 'https://www.youtube.com/watch?v={id}'
+
+# Seconds that a stopped downloader gets to exit before it is killed.
+TERMINATE_TIMEOUT = 10
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+class LocalQueue:
+    '''
+    Talks to the download queue of a YCDLDB on this machine. Every call is
+    committed right away so that other workers can see it.
+    '''
+    def __init__(self, ycdldb):
+        self.ycdldb = ycdldb
+
+    def claim(self, worker, count, lease):
+        with self.ycdldb.transaction:
+            return self.ycdldb.claim_downloads(worker, count=count, lease=lease)
+
+    def complete(self, worker, video_id):
+        with self.ycdldb.transaction:
+            self.ycdldb.complete_download(worker, video_id)
+
+    def fail(self, worker, video_id, error):
+        with self.ycdldb.transaction:
+            self.ycdldb.fail_download(worker, video_id, error)
+
+    def heartbeat(self, worker, video_ids, lease):
+        with self.ycdldb.transaction:
+            return self.ycdldb.heartbeat_downloads(worker, video_ids, lease=lease)
+
+class RemoteQueue:
+    '''
+    Talks to the download queue through the /download_queue endpoints of a
+    ycdl_flask server.
+    '''
+    def __init__(self, server):
+        # Imported here because local workers and the CLI don't need it.
+        import requests
+        self.server = server.rstrip('/')
+        self.session = requests.Session()
+
+    def _post(self, path, data):
+        response = self.session.post(self.server + path, data=data)
+        response.raise_for_status()
+        return response.json()
+
+    def claim(self, worker, count, lease):
+        data = {'worker': worker, 'count': count, 'lease': lease}
+        return self._post('/download_queue/claim', data)['items']
+
+    def complete(self, worker, video_id):
+        data = {'worker': worker, 'video_id': video_id}
+        self._post('/download_queue/complete', data)
+
+    def fail(self, worker, video_id, error):
+        data = {'worker': worker, 'video_id': video_id, 'error': error}
+        self._post('/download_queue/fail', data)
+
+    def heartbeat(self, worker, video_ids, lease):
+        data = {'worker': worker, 'video_ids': ','.join(video_ids), 'lease': lease}
+        return self._post('/download_queue/heartbeat', data)['video_ids']
+
+class DownloadWorker:
+    def __init__(
+            self,
+            queue,
+            *,
+            command,
+            count=1,
+            download_directory=None,
+            lease=constants.DEFAULT_DOWNLOAD_LEASE,
+            name=None,
+        ):
+        '''
+        command:
+            The downloader command. The video URL is appended to the end.
+
+        count:
+            The number of videos to claim and download at the same time.
+
+        download_directory:
+            By default, each video is downloaded into the directory that was
+            recorded when it was queued, or the current directory. You can pass
+            this argument to override that, which is useful for workers on other
+            machines.
+        '''
+        self.queue = queue
+        self.command = command
+        self.count = count
+        self.download_directory = download_directory
+        self.lease = lease
+        self.name = name or default_worker_name()
+        # {video_id: subprocess.Popen}
+        self.running = {}
+
+    def _start(self, item):
+        video_id = item['video_id']
+        directory = self.download_directory or item['download_directory'] or '.'
+        directory = pathclass.Path(directory)
+        directory.makedirs(exist_ok=True)
+
+        command = f'{self.command} {VIDEO_URL.format(id=video_id)}'
+        log.info('Downloading %s in %s.', video_id, directory.absolute_path)
+        self.running[video_id] = subprocess.Popen(command, shell=True, cwd=directory.absolute_path)
+
+    def _reap(self):
+        for (video_id, process) in list(self.running.items()):
+            exit_code = process.poll()
+            if exit_code is None:
+                continue
+
+            self.running.pop(video_id)
+            if exit_code == 0:
+                self.queue.complete(self.name, video_id)
+            else:
+                self.queue.fail(self.name, video_id, f'exit code {exit_code}')
+
+    def _heartbeat(self):
+        held = set(self.queue.heartbeat(self.name, list(self.running), self.lease))
+        for video_id in set(self.running).difference(held):
+            # Our lease expired and someone else has it now, so there is no
+            # point in finishing our copy.
+            log.warning('Lost the lease on %s, stopping.', video_id)
+            process = self.running.pop(video_id)
+            process.terminate()
+            # Wait for it so that it doesn't linger as a zombie.
+            try:
+                process.wait(timeout=TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def run(self, *, only_once=False, sleep=30):
+        '''
+        Claim and download videos until the queue is empty (only_once) or
+        forever, sleeping for `sleep` seconds whenever the queue is empty.
+        '''
+        log.info('Starting download worker %s.', self.name)
+        # Heartbeat well before the lease runs out.
+        heartbeat_rate = max(1, self.lease // 3)
+        last_heartbeat = time.monotonic()
+
+        while True:
+            self._reap()
+
+            available = self.count - len(self.running)
+            if available > 0:
+                for item in self.queue.claim(self.name, available, self.lease):
+                    self._start(item)
+
+            if not self.running:
+                if only_once:
+                    return
+                time.sleep(sleep)
+                continue
+
+            if time.monotonic() - last_heartbeat >= heartbeat_rate:
+                self._heartbeat()
+                last_heartbeat = time.monotonic()
+
+            time.sleep(1)
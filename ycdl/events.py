@@ -0,0 +1,196 @@
+'''
+This module is a small in-process publish / subscribe bus. YCDLDB publishes
+the progress of refresh_all_channels and the videos it ingests, and the
+ycdl_flask server streams them to the browser as server-sent events so the
+pages can update in place.
+
+Each subscriber has its own bounded queue. If a subscriber falls too far
+behind, its oldest events are dropped rather than letting the publisher block
+or the queue grow forever, and the subscriber is told that it missed some.
+
+By itself, an event only reaches subscribers in the same process as the
+publisher. When a WSGI server runs several processes, only the elected leader
+runs refreshes, but the browser's /events stream may be served by any of them.
+So each process starts a Relay, which also writes every event into a small
+sqlite file in the data directory and polls that file for the events of the
+other processes. The file is separate from the main database so that writing
+an event never waits for the refresh that is holding the write lock.
+'''
+import itertools
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+
+# Seconds between the relay's checks for the other processes' events.
+DEFAULT_RELAY_POLL_RATE = 1
+
+# Number of recent events that the relay file holds on to. A process that
+# falls further behind than this misses some and tells its subscribers.
+DEFAULT_RELAY_KEEP = 5000
+
+_subscribers = set()
+_lock = threading.Lock()
+_event_ids = itertools.count(1)
+_relay = None
+
+class Subscription:
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def _put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def get(self, timeout=None):
+        '''
+        Return the next event, or None if there wasn't one within the timeout.
+        '''
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+def subscribe(maxsize=DEFAULT_QUEUE_SIZE) -> Subscription:
+    subscription = Subscription(maxsize)
+    with _lock:
+        _subscribers.add(subscription)
+    return subscription
+
+def unsubscribe(subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+def subscriber_count() -> int:
+    with _lock:
+        return len(_subscribers)
+
+def _publish_local(event_type, data):
+    with _lock:
+        subscribers = list(_subscribers)
+    if not subscribers:
+        return
+    event = {'id': next(_event_ids), 'type': event_type, 'data': data}
+    log.loud('Publishing %s to %d subscribers.', event_type, len(subscribers))
+    for subscription in subscribers:
+        subscription._put(event)
+
+def publish(event_type, data=None):
+    '''
+    Send an event to every current subscriber, and to the other processes if
+    there is a relay. This never blocks on the subscribers.
+    '''
+    _publish_local(event_type, data)
+    relay = _relay
+    if relay is not None:
+        relay.write(event_type, data)
+
+class Relay:
+    '''
+    Passes events between the processes that share one relay file.
+    '''
+    def __init__(self, filepath, *, keep=DEFAULT_RELAY_KEEP, poll_rate=DEFAULT_RELAY_POLL_RATE):
+        self.filepath = pathclass.Path(filepath)
+        self.keep = keep
+        self.poll_rate = poll_rate
+        # Processes skip their own events when reading the file, since their
+        # subscribers already got them from publish.
+        self.origin = uuid.uuid4().hex
+        # sqlite connections can't be shared between the publishing threads.
+        self.local = threading.local()
+        self.thread = None
+
+        with self._connect() as sql:
+            sql.execute('PRAGMA journal_mode = WAL')
+            sql.execute('''
+            CREATE TABLE IF NOT EXISTS events(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT
+            )
+            ''')
+
+    def _connect(self):
+        # Autocommit, and wait for the other processes instead of failing.
+        sql = sqlite3.connect(self.filepath.absolute_path, isolation_level=None, timeout=10)
+        # The events are disposable, so they don't need to survive a power cut.
+        sql.execute('PRAGMA synchronous = NORMAL')
+        return sql
+
+    @property
+    def sql(self):
+        try:
+            return self.local.sql
+        except AttributeError:
+            self.local.sql = self._connect()
+            return self.local.sql
+
+    def write(self, event_type, data):
+        try:
+            cursor = self.sql.execute(
+                'INSERT INTO events(origin, type, data) VALUES(?, ?, ?)',
+                [self.origin, event_type, json.dumps(data)],
+            )
+            if cursor.lastrowid % 100 == 0:
+                self.sql.execute('DELETE FROM events WHERE id <= ?', [cursor.lastrowid - self.keep])
+        except sqlite3.Error as exc:
+            # The events are a convenience for the pages, so losing one must
+            # not break the refresh that published it.
+            log.warning('Could not relay %s event: %s', event_type, exc)
+
+    def run(self):
+        sql = self._connect()
+        last_id = sql.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        while True:
+            time.sleep(self.poll_rate)
+            try:
+                rows = sql.execute(
+                    'SELECT id, origin, type, data FROM events WHERE id > ? ORDER BY id',
+                    [last_id],
+                ).fetchall()
+            except sqlite3.Error as exc:
+                log.warning('Could not read relayed events: %s', exc)
+                continue
+            if not rows:
+                continue
+            if rows[0][0] > last_id + 1 and last_id > 0:
+                # Pruned before we got to them.
+                _publish_local('dropped', {'dropped': rows[0][0] - last_id - 1})
+            for (event_id, origin, event_type, data) in rows:
+                if origin != self.origin:
+                    _publish_local(event_type, json.loads(data))
+            last_id = rows[-1][0]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+def start_relay(filepath, **kwargs) -> Relay:
+    '''
+    Relay this process's events to the other processes using the same file,
+    and theirs to this process's subscribers.
+    '''
+    global _relay
+    _relay = Relay(filepath, **kwargs).start()
+    return _relay
@@ -48,6 +48,9 @@ class YCDLException(Exception, metaclass=ErrorTypeAdder):
 class NoSuchChannel(YCDLException):
     error_message = 'Channel {} does not exist.'
 
+class NoSuchJob(YCDLException):
+    error_message = 'Job {} does not exist.'
+
 class NoSuchVideo(YCDLException):
     error_message = 'Video {} does not exist.'
 
@@ -64,11 +67,24 @@ class ChannelRefreshFailed(YCDLException):
 class InvalidVideoState(YCDLException):
     error_message = '{} is not a valid state.'
 
+# JOB ERRORS #######################################################################################
+
+class InvalidJobKind(YCDLException):
+    error_message = '{} is not a known kind of job.'
+
 # RSS ERRORS #######################################################################################
 
 class RSSAssistFailed(YCDLException):
     error_message = '{}'
 
+class RSSFeedNotFound(RSSAssistFailed):
+    error_message = 'The RSS feed for {} does not exist.'
+
+# NETWORK ERRORS ###################################################################################
+
+class CircuitOpen(YCDLException):
+    error_message = '{host} has failed too often, not trying again for {wait:.0f} seconds.'
+
 # GENERAL ERRORS ###################################################################################
 
 class BadDataDirectory(YCDLException):
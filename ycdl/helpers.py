@@ -0,0 +1,37 @@
+import datetime
+import functools
+
+from . import constants
+
+@functools.lru_cache(maxsize=20_000)
+def _day_to_date_string(day) -> str:
+    date = datetime.datetime.utcfromtimestamp(day * 86400)
+    return date.strftime('%Y-%m-%d')
+
+def timestamp_to_date_string(timestamp) -> str:
+    '''
+    Return the UTC date of the timestamp as YYYY-MM-DD.
+
+    Video listings contain many videos from the same days, so the strings are
+    cached by day number and we only pay for datetime once per day.
+    '''
+    return _day_to_date_string(int(timestamp // 86400))
+
+def next_live_check(*, live_broadcast, scheduled_start, checks, now) -> int:
+    '''
+    Return the timestamp at which an upcoming or live video should be fetched
+    again to see if it has finished.
+
+    An upcoming video with a scheduled start is not checked again until shortly
+    before that time, though at least once per LIVE_CHECK_MAX_WAIT. A video
+    that is live, or overdue, is checked with exponential backoff based on how
+    many times it has already been checked.
+    '''
+    if live_broadcast == 'upcoming' and scheduled_start is not None:
+        wake = scheduled_start - constants.LIVE_CHECK_LEAD
+        if wake > now:
+            return int(min(wake, now + constants.LIVE_CHECK_MAX_WAIT))
+
+    backoff = constants.LIVE_CHECK_BACKOFF_MIN * (2 ** min(checks, 16))
+    backoff = min(backoff, constants.LIVE_CHECK_BACKOFF_MAX)
+    return int(now + backoff)
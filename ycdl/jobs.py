@@ -0,0 +1,163 @@
+'''
+This module runs the jobs from YCDLDB's job queue. Each kind of job is a
+function registered in JOB_KINDS, which receives the YCDLDB and the job's
+arguments, manages its own transactions, and returns a JSON-serializable result.
+
+Only one JobRunner should run per database. Its main thread runs one job at a
+time, so two background refreshes can never overlap, and enqueue_job's
+deduplication makes sure a refresh that's already queued or running isn't added
+again. A second thread only takes jobs with constants.JOB_PRIORITY_USER, so the
+things the user is waiting for don't sit behind a long refresh_all_channels.
+Their transactions take turns with the refresh's commit_every chunks.
+'''
+import os
+import socket
+import threading
+import time
+import traceback
+
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+from . import constants
+
+JOB_KINDS = {}
+
+def job_kind(name):
+    def wrapper(function):
+        JOB_KINDS[name] = function
+        return function
+    return wrapper
+
+# JOB KINDS ########################################################################################
+
+@job_kind('add_channel')
+def add_channel(ycdldb, *, channel, get_videos=True):
+    '''
+    channel may be a channel ID or a username, which costs an extra API call
+    to resolve.
+    '''
+    if not (len(channel) == 24 and channel.startswith('UC')):
+        channel = ycdldb.youtube.get_user_id(username=channel)
+
+    with ycdldb.transaction:
+        channel = ycdldb.add_channel(channel, get_videos=get_videos)
+    return channel.jsonify()
+
+@job_kind('refresh_channel')
+def refresh_channel(ycdldb, *, channel_id, force=False):
+    channel = ycdldb.get_channel(channel_id)
+    with ycdldb.transaction:
+        channel.refresh(force=force)
+    return channel.jsonify()
+
+@job_kind('refresh_all_channels')
+def refresh_all_channels(ycdldb, *, force=False):
+    excs = ycdldb.refresh_all_channels(
+        commit_every=constants.DEFAULT_REFRESH_COMMIT_EVERY,
+        force=force,
+        skip_failures=True,
+    )
+    return {'failures': [str(exc) for exc in excs]}
+
+####################################################################################################
+
+class JobRunner:
+    def __init__(self, ycdldb, *, name=None, poll_rate=30):
+        '''
+        poll_rate:
+            Seconds to sleep when the queue is empty, in case a job was added
+            by another process. Jobs added through this process wake the runner
+            right away with `notify`.
+        '''
+        self.ycdldb = ycdldb
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.user_name = f'{self.name}:user'
+        self.poll_rate = poll_rate
+        self.wake = threading.Event()
+        self.user_wake = threading.Event()
+        self.thread = None
+        self.user_thread = None
+
+    def notify(self):
+        self.wake.set()
+        self.user_wake.set()
+
+    def run_one(self, *, user_only=False) -> bool:
+        '''
+        Run the next job, if there is one. Returns False if the queue was empty.
+
+        user_only:
+            Only run jobs with constants.JOB_PRIORITY_USER. The claimed job is
+            recorded under self.user_name instead of self.name.
+        '''
+        if user_only:
+            (runner, max_priority) = (self.user_name, constants.JOB_PRIORITY_USER)
+        else:
+            (runner, max_priority) = (self.name, None)
+
+        with self.ycdldb.transaction:
+            job = self.ycdldb.claim_next_job(runner, max_priority=max_priority)
+
+        if job is None:
+            return False
+
+        log.info('Running job %s %s %s.', job['id'], job['kind'], job['arguments'])
+        function = JOB_KINDS.get(job['kind'])
+        try:
+            if function is None:
+                raise ValueError(f'Unknown job kind {job["kind"]}.')
+            result = function(self.ycdldb, **job['arguments'])
+        except Exception as exc:
+            log.warning(traceback.format_exc())
+            with self.ycdldb.transaction:
+                self.ycdldb.fail_job(job['id'], str(exc))
+            return True
+
+        with self.ycdldb.transaction:
+            self.ycdldb.complete_job(job['id'], result)
+        log.info('Finished job %s.', job['id'])
+        return True
+
+    def run(self):
+        with self.ycdldb.transaction:
+            self.ycdldb.requeue_interrupted_jobs()
+
+        # Started after the requeue so that it can't claim a job and then have
+        # it put back in the queue underneath it.
+        self.user_thread = threading.Thread(target=self.run_user_jobs, daemon=True)
+        self.user_thread.start()
+
+        last_prune = None
+        while True:
+            try:
+                if self.run_one():
+                    continue
+                if last_prune is None or time.monotonic() - last_prune > 3600:
+                    with self.ycdldb.transaction:
+                        self.ycdldb.prune_jobs()
+                    last_prune = time.monotonic()
+            except Exception:
+                # Most likely the database was locked. Keep the runner alive.
+                log.error(traceback.format_exc())
+
+            self.wake.wait(self.poll_rate)
+            self.wake.clear()
+
+    def run_user_jobs(self):
+        while True:
+            try:
+                if self.run_one(user_only=True):
+                    continue
+            except Exception:
+                log.error(traceback.format_exc())
+
+            self.user_wake.wait(self.poll_rate)
+            self.user_wake.clear()
+
+    def start(self):
+        log.info('Starting job runner %s.', self.name)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
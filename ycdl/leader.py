@@ -0,0 +1,111 @@
+'''
+This module elects one leader among the processes that share a data directory,
+so that the background work (the job runner, the refresher and the shorts
+checker) runs exactly once even when a WSGI server like gunicorn starts several
+workers.
+
+The leader holds an exclusive lock on a file in the data directory. The
+operating system releases the lock when the process dies, however that
+happens, and the other processes, which keep trying to take the lock, will
+take over within one retry interval.
+'''
+import os
+import threading
+import time
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+DEFAULT_RETRY_INTERVAL = 30
+
+class FileLock:
+    '''
+    A non-blocking, exclusive lock on a file, held for as long as the file is
+    open.
+    '''
+    def __init__(self, filepath):
+        self.filepath = pathclass.Path(filepath)
+        self.handle = None
+
+    @property
+    def is_held(self):
+        return self.handle is not None
+
+    def _lock(self, handle):
+        if os.name == 'nt':
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def acquire(self) -> bool:
+        '''
+        Return True if we got the lock, False if another process has it.
+        '''
+        if self.is_held:
+            return True
+
+        # Opening with 'a' so that we don't truncate the current holder's pid
+        # before we know that we have the lock.
+        handle = self.filepath.open('a+', encoding='utf-8')
+        try:
+            self._lock(handle)
+        except OSError:
+            handle.close()
+            return False
+
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self.handle = handle
+        return True
+
+    def release(self):
+        if not self.is_held:
+            return
+        # Closing the file releases the lock on every platform.
+        self.handle.close()
+        self.handle = None
+
+class LeaderElection:
+    def __init__(self, filepath, *, on_elected, retry_interval=DEFAULT_RETRY_INTERVAL):
+        '''
+        on_elected:
+            Called once, from the election thread, when this process becomes
+            the leader. The process stays the leader until it exits.
+
+        retry_interval:
+            Seconds between attempts to take the lock while another process
+            is the leader.
+        '''
+        self.lock = FileLock(filepath)
+        self.on_elected = on_elected
+        self.retry_interval = retry_interval
+        self.elected = threading.Event()
+        self.thread = None
+
+    @property
+    def is_leader(self):
+        return self.elected.is_set()
+
+    def run(self):
+        while not self.lock.acquire():
+            log.debug('Another process is the leader, trying again in %d seconds.', self.retry_interval)
+            time.sleep(self.retry_interval)
+
+        log.info('Process %d is the leader for %s.', os.getpid(), self.lock.filepath.absolute_path)
+        self.elected.set()
+        self.on_elected()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
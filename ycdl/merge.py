@@ -0,0 +1,268 @@
+'''
+This module merges the channels and videos of other YCDL databases into one.
+
+Rows that are missing from the target are inserted. Rows that exist in both are
+merged column by column, so running the same merge twice changes nothing:
+
+- Channels take the name, uploads playlist and last_refresh from whichever
+  database refreshed the channel more recently. The user's settings for the
+  channel (automark, autorefresh, directories, ignore_shorts) are kept from the
+  target.
+- Videos take their metadata from whichever copy has more views, since view
+  counts only go up and so the higher one was fetched more recently.
+- Video states are merged by priority, so a video that was downloaded or
+  ignored in either database does not go back to pending.
+- The monthly view count samples in video_stats_history are copied for the
+  months that the target doesn't have. A month that both databases sampled
+  keeps the target's samples.
+
+The download queue and the job queue belong to the running instance of each
+database, so they are not merged.
+
+The work is done with SQL in the target database, with the sources ATTACHed,
+one batch of source rows per transaction.
+'''
+import sqlite3
+import time
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+from . import constants
+from . import exceptions
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Higher wins.
+VIDEO_STATE_PRIORITY = {
+    'pending': 0,
+    'ignored': 1,
+    'downloaded': 2,
+}
+
+CHANNEL_METADATA_COLUMNS = ['name', 'uploads_playlist', 'last_refresh']
+
+VIDEO_METADATA_COLUMNS = [
+    'published',
+    'title',
+    'description',
+    'duration',
+    'views',
+    'thumbnail',
+    'live_broadcast',
+    'live_scheduled',
+    'live_next_check',
+    'live_checks',
+]
+
+def _state_rank(expression):
+    whens = ' '.join(f"WHEN '{state}' THEN {rank}" for (state, rank) in VIDEO_STATE_PRIORITY.items())
+    return f'(CASE {expression} {whens} ELSE -1 END)'
+
+def _insert_query(table):
+    columns = ', '.join(constants.SQL_COLUMNS[table])
+    source_columns = ', '.join(f'source_row.{column}' for column in constants.SQL_COLUMNS[table])
+    return f'''
+    INSERT INTO {table}({columns})
+    SELECT {source_columns} FROM source.{table} AS source_row
+    WHERE source_row.rowid > ? AND source_row.rowid <= ? {{channel_filter}}
+    AND NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.id == source_row.id)
+    '''
+
+def _stats_history_insert_query():
+    # video_stats_history is WITHOUT ROWID, so the batches go by the rowid of
+    # the source videos that the samples belong to.
+    return '''
+    INSERT OR IGNORE INTO video_stats_history(video_id, month, samples)
+    SELECT history.video_id, history.month, history.samples
+    FROM source.video_stats_history AS history
+    JOIN source.videos AS source_row ON source_row.id == history.video_id
+    WHERE source_row.rowid > ? AND source_row.rowid <= ? {channel_filter}
+    '''
+
+def _channels_update_query():
+    newer = 'COALESCE(source_row.last_refresh, -1) > COALESCE(channels.last_refresh, -1)'
+    sets = ',\n'.join(
+        f'{column} = COALESCE(source_row.{column}, channels.{column})'
+        for column in CHANNEL_METADATA_COLUMNS
+    )
+    return f'''
+    UPDATE channels SET
+    {sets}
+    FROM source.channels AS source_row
+    WHERE channels.id == source_row.id
+    AND source_row.rowid > ? AND source_row.rowid <= ? {{channel_filter}}
+    AND {newer}
+    '''
+
+def _videos_update_query():
+    newer = 'COALESCE(source_row.views, -1) > COALESCE(videos.views, -1)'
+    higher_state = f'{_state_rank("source_row.state")} > {_state_rank("videos.state")}'
+    sets = [
+        f'{column} = CASE WHEN {newer} THEN source_row.{column} ELSE videos.{column} END'
+        for column in VIDEO_METADATA_COLUMNS
+    ]
+    sets.append(f'state = CASE WHEN {higher_state} THEN source_row.state ELSE videos.state END')
+    sets.append('is_shorts = COALESCE(videos.is_shorts, source_row.is_shorts)')
+    sets = ',\n'.join(sets)
+    return f'''
+    UPDATE videos SET
+    {sets}
+    FROM source.videos AS source_row
+    WHERE videos.id == source_row.id
+    AND source_row.rowid > ? AND source_row.rowid <= ? {{channel_filter}}
+    AND (
+        {newer} OR
+        {higher_state} OR
+        (videos.is_shorts IS NULL AND source_row.is_shorts IS NOT NULL)
+    )
+    '''
+
+class Merger:
+    def __init__(self, target_path, *, batch_size=DEFAULT_BATCH_SIZE, channel_ids=None):
+        '''
+        channel_ids:
+            If given, only these channels and their videos are merged.
+        '''
+        self.target_path = pathclass.Path(target_path)
+        self.batch_size = batch_size
+        self.channel_ids = list(channel_ids) if channel_ids else None
+        # Transactions are managed by hand, one per batch.
+        self.sql = sqlite3.connect(self.target_path.absolute_path, isolation_level=None)
+        self.target_version = self._user_version('main')
+        if self.target_version != constants.DATABASE_VERSION:
+            raise exceptions.DatabaseOutOfDate(
+                existing=self.target_version,
+                new=constants.DATABASE_VERSION,
+                filepath=self.target_path.parent,
+            )
+
+        if self.channel_ids is not None:
+            # A temp table instead of bindings, because there can be more
+            # channels than SQLite allows variables in one statement.
+            self.sql.execute('CREATE TEMP TABLE merge_channels(id TEXT PRIMARY KEY)')
+            self.sql.executemany(
+                'INSERT OR IGNORE INTO temp.merge_channels(id) VALUES(?)',
+                [(channel_id,) for channel_id in self.channel_ids],
+            )
+
+    def _user_version(self, schema):
+        return self.sql.execute(f'PRAGMA {schema}.user_version').fetchone()[0]
+
+    def _channel_filter(self, column):
+        if self.channel_ids is None:
+            return ''
+        return f'AND source_row.{column} IN (SELECT id FROM temp.merge_channels)'
+
+    def _merge_table(
+            self,
+            source_name,
+            table,
+            *,
+            insert_query,
+            update_query=None,
+            filter_column,
+            batch_table=None,
+        ) -> dict:
+        '''
+        batch_table:
+            The source table whose rowids the queries are batched by, if it is
+            not the table itself.
+        '''
+        channel_filter = self._channel_filter(filter_column)
+        insert_query = insert_query.format(channel_filter=channel_filter)
+        if update_query is not None:
+            update_query = update_query.format(channel_filter=channel_filter)
+
+        batch_table = batch_table or table
+        (low, high) = self.sql.execute(f'SELECT MIN(rowid), MAX(rowid) FROM source.{batch_table}').fetchone()
+        stats = {'inserted': 0, 'updated': 0}
+        if low is None:
+            return stats
+
+        start = low - 1
+        while start < high:
+            end = start + self.batch_size
+            bindings = [start, end]
+            self.sql.execute('BEGIN IMMEDIATE')
+            try:
+                # Update before inserting so the new rows are not compared
+                # against themselves.
+                if update_query is not None:
+                    stats['updated'] += self.sql.execute(update_query, bindings).rowcount
+                stats['inserted'] += self.sql.execute(insert_query, bindings).rowcount
+            except Exception:
+                self.sql.execute('ROLLBACK')
+                raise
+            self.sql.execute('COMMIT')
+            start = end
+            done = min(end, high) - low + 1
+            log.info(
+                '%s %s: %d / %d rows, %d inserted, %d updated.',
+                source_name,
+                table,
+                done,
+                high - low + 1,
+                stats['inserted'],
+                stats['updated'],
+            )
+        return stats
+
+    def merge(self, source_path) -> dict:
+        source_path = pathclass.Path(source_path)
+        source_path.assert_is_file()
+        log.info('Merging %s into %s.', source_path.absolute_path, self.target_path.absolute_path)
+
+        self.sql.execute('ATTACH DATABASE ? AS source', [source_path.absolute_path])
+        try:
+            source_version = self._user_version('source')
+            if source_version != self.target_version:
+                raise exceptions.DatabaseOutOfDate(
+                    existing=source_version,
+                    new=self.target_version,
+                    filepath=source_path.parent,
+                )
+
+            start = time.perf_counter()
+            stats = {}
+            stats['channels'] = self._merge_table(
+                source_path.basename,
+                'channels',
+                insert_query=_insert_query('channels'),
+                update_query=_channels_update_query(),
+                filter_column='id',
+            )
+            stats['videos'] = self._merge_table(
+                source_path.basename,
+                'videos',
+                insert_query=_insert_query('videos'),
+                update_query=_videos_update_query(),
+                filter_column='author_id',
+            )
+            stats['video_stats_history'] = self._merge_table(
+                source_path.basename,
+                'video_stats_history',
+                insert_query=_stats_history_insert_query(),
+                filter_column='author_id',
+                batch_table='videos',
+            )
+            log.info('Merged %s in %.3f seconds.', source_path.basename, time.perf_counter() - start)
+        finally:
+            self.sql.execute('DETACH DATABASE source')
+        return stats
+
+    def close(self):
+        self.sql.close()
+
+def merge_databases(target_path, source_paths, **kwargs) -> dict:
+    '''
+    Merge each of the source databases into the target, in order. Returns
+    {source_path: {table: {'inserted': int, 'updated': int}}}.
+    '''
+    merger = Merger(target_path, **kwargs)
+    try:
+        return {source_path: merger.merge(source_path) for source_path in source_paths}
+    finally:
+        merger.close()
@@ -0,0 +1,238 @@
+'''
+This module keeps process-wide counters and histograms about refreshes, the
+Youtube API, the database, and the web server, and renders them in the
+Prometheus text exposition format.
+
+The ycdl_flask server exposes them at /metrics. The CLI can write them to a file
+after a refresh, which is the format expected by node_exporter's textfile
+collector.
+
+We don't depend on prometheus_client because we only need a small part of it.
+'''
+import contextlib
+import os
+import threading
+import time
+
+from voussoirkit import pathclass
+
+# Seconds. Covers everything from a cached page render to a forced refresh of
+# a channel with thousands of videos.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000, 5000)
+
+REGISTRY = []
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    labels = ','.join(f'{key}="{_escape_label(value)}"' for (key, value) in pairs)
+    return '{' + labels + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # {label_values_tuple: value}
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, not {tuple(labels)}.')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        with self.lock:
+            items = sorted(self.values.items())
+        for (key, value) in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        pairs = list(zip(self.labelnames, key))
+        yield f'{self.name}{_format_labels(pairs)} {_format_value(value)}'
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), *, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for (index, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, state):
+        pairs = list(zip(self.labelnames, key))
+        for (bound, count) in zip(self.buckets, state['buckets']):
+            labels = _format_labels(pairs + [('le', _format_value(float(bound)))])
+            yield f'{self.name}_bucket{labels} {count}'
+        yield f'{self.name}_sum{_format_labels(pairs)} {_format_value(state["sum"])}'
+        yield f'{self.name}_count{_format_labels(pairs)} {state["count"]}'
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def write_file(filepath):
+    '''
+    Write the metrics to a file atomically, so that a collector reading the
+    file never sees half of it.
+    '''
+    filepath = pathclass.Path(filepath)
+    temp = filepath.parent.with_child(filepath.basename + '.tmp')
+    with temp.open('w', encoding='utf-8') as handle:
+        handle.write(render())
+    os.replace(temp.absolute_path, filepath.absolute_path)
+
+# METRICS ##########################################################################################
+
+RSS_FETCH_SECONDS = Histogram(
+    'ycdl_rss_fetch_seconds',
+    'Time spent fetching and parsing channel RSS feeds.',
+    ['outcome'],
+)
+
+API_CALLS = Counter(
+    'ycdl_api_calls_total',
+    'Youtube Data API requests.',
+    ['endpoint', 'outcome'],
+)
+
+API_UNITS = Counter(
+    'ycdl_api_units_total',
+    'Youtube Data API quota units spent.',
+    ['endpoint'],
+)
+
+VIDEOS_INGESTED = Counter(
+    'ycdl_videos_ingested_total',
+    'Videos passed through ingest_video.',
+    ['new'],
+)
+
+REFRESH_NEW_VIDEOS = Histogram(
+    'ycdl_refresh_new_videos',
+    'Number of new videos found by each refresh_all_channels.',
+    ['mode'],
+    buckets=COUNT_BUCKETS,
+)
+
+REFRESH_SECONDS = Histogram(
+    'ycdl_refresh_seconds',
+    'Duration of refresh_all_channels.',
+    ['mode'],
+)
+
+REFRESH_FAILURES = Counter(
+    'ycdl_refresh_failures_total',
+    'Channels that failed to refresh.',
+)
+
+CHANNEL_REFRESH_SECONDS = Histogram(
+    'ycdl_channel_refresh_seconds',
+    'Duration of each Channel.refresh.',
+    ['mode'],
+)
+
+TRANSACTION_SECONDS = Histogram(
+    'ycdl_transaction_seconds',
+    'Time from the first write of a transaction until its commit or rollback, '
+    'during which other writers are locked out.',
+    ['outcome'],
+)
+
+CACHE_LOOKUPS = Counter(
+    'ycdl_cache_lookups_total',
+    'Object cache lookups.',
+    ['cache', 'result'],
+)
+
+NETWORK_RETRIES = Counter(
+    'ycdl_network_retries_total',
+    'Requests to Youtube that failed and were retried.',
+    ['host'],
+)
+
+CIRCUIT_BREAKER_OPENS = Counter(
+    'ycdl_circuit_breaker_opens_total',
+    'Times that calls to a host were paused after repeated failures.',
+    ['host'],
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'ycdl_http_request_seconds',
+    'Time spent handling each web request.',
+    ['route', 'method', 'status'],
+)
+
+# The real API charges more for searches than for the list endpoints.
+API_UNIT_COSTS = {
+    'search.list': 100,
+}
+
+def refresh_mode(force, rss_assisted):
+    if force:
+        return 'force'
+    if rss_assisted:
+        return 'rss'
+    return 'api'
+
+def record_api_call(endpoint, outcome):
+    API_CALLS.inc(endpoint=endpoint, outcome=outcome)
+    API_UNITS.inc(API_UNIT_COSTS.get(endpoint, 1), endpoint=endpoint)
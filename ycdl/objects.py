@@ -1,5 +1,4 @@
-import datetime
-import googleapiclient.errors
+import sys
 import typing
 
 from voussoirkit import pathclass
@@ -12,10 +11,19 @@ log = vlogging.getLogger(__name__)
 
 from . import constants
 from . import exceptions
+from . import helpers
+from . import metrics
 from . import ytapi
 from . import ytrss
 
 class ObjectBase(worms.Object):
+    # Tens of thousands of these objects live in the caches. worms.Object has
+    # no __slots__, so instances still have a __dict__, but it is only created
+    # when an attribute outside the slots is set. As long as every attribute
+    # is one of the slots, the values are stored in the object itself and no
+    # dict is ever allocated.
+    __slots__ = ('_worms_database', 'deleted', 'ycdldb')
+
     def __init__(self, ycdldb):
         super().__init__(ycdldb)
         self.ycdldb = ycdldb
@@ -23,6 +31,18 @@ class ObjectBase(worms.Object):
 class Channel(ObjectBase):
     table = 'channels'
     no_such_exception = exceptions.NoSuchChannel
+    __slots__ = (
+        'id',
+        'name',
+        'uploads_playlist',
+        'download_directory',
+        'queuefile_extension',
+        'automark',
+        'autorefresh',
+        'rss_failures',
+        'quarantined',
+        'ignore_shorts',
+    )
 
     def __init__(self, ycdldb, db_row):
         super().__init__(ycdldb)
@@ -37,6 +57,8 @@ class Channel(ObjectBase):
         self.queuefile_extension = self.normalize_queuefile_extension(db_row['queuefile_extension'])
         self.automark = db_row['automark'] or 'pending'
         self.autorefresh = stringtools.truthystring(db_row['autorefresh'])
+        self.rss_failures = db_row['rss_failures'] or 0
+        self.quarantined = db_row['quarantined']
         self.ignore_shorts = bool(db_row['ignore_shorts'])
 
     def __repr__(self):
@@ -140,6 +162,11 @@ class Channel(ObjectBase):
     def delete(self):
         log.info('Deleting %s.', self)
 
+        query = '''
+        DELETE FROM video_stats_history
+        WHERE video_id IN (SELECT id FROM videos WHERE author_id == ?)
+        '''
+        self.ycdldb.execute(query, [self.id])
         self.ycdldb.delete(table='videos', pairs={'author_id': self.id})
         self.ycdldb.delete(table=Channel, pairs={'id': self.id})
         self.deleted = True
@@ -173,9 +200,32 @@ class Channel(ObjectBase):
             'id': self.id,
             'name': self.name,
             'automark': self.automark,
+            'quarantined': self.quarantined,
         }
         return j
 
+    @worms.atomic
+    def record_rss_not_found(self) -> bool:
+        '''
+        Count another refresh in which the channel's RSS feed was a 404. Once
+        that has happened constants.RSS_QUARANTINE_THRESHOLD times without a
+        successful refresh in between, the channel is quarantined so that
+        refresh_all_channels stops trying it.
+
+        Return True if the channel is quarantined.
+        '''
+        self.rss_failures += 1
+        pairs = {
+            'id': self.id,
+            'rss_failures': self.rss_failures,
+        }
+        if self.quarantined is None and self.rss_failures >= constants.RSS_QUARANTINE_THRESHOLD:
+            log.warning('Quarantining %s because its RSS feed does not exist.', self)
+            self.quarantined = timetools.now().timestamp()
+            pairs['quarantined'] = self.quarantined
+        self.ycdldb.update(table=Channel, pairs=pairs, where_key='id')
+        return self.quarantined is not None
+
     @worms.atomic
     def refresh(self, *, force=False, rss_assisted=True):
         '''
@@ -193,6 +243,11 @@ class Channel(ObjectBase):
             If False, we will only use the tokened Youtube API.
             Has no effect when force=True.
         '''
+        mode = metrics.refresh_mode(force=force, rss_assisted=rss_assisted)
+        with metrics.CHANNEL_REFRESH_SECONDS.time(mode=mode):
+            self._refresh(force=force, rss_assisted=rss_assisted)
+
+    def _refresh(self, *, force, rss_assisted):
         log.info('Refreshing %s.', self)
 
         if force or (not self.uploads_playlist):
@@ -207,16 +262,23 @@ class Channel(ObjectBase):
                 log.debug('Caught %s.', exc)
                 video_generator = self.ycdldb.youtube.get_playlist_videos(self.uploads_playlist)
 
-        seen_ids = set()
+        if force:
+            # The ids returned by the playlist are kept in a temp table instead
+            # of a set, so the reconciliation below can be done with a join no
+            # matter how many videos the channel has. Temp tables belong to the
+            # connection, so this has to go through the write connection.
+            self.ycdldb.execute('CREATE TEMP TABLE IF NOT EXISTS refresh_seen_ids(id TEXT PRIMARY KEY)')
+            self.ycdldb.execute('DELETE FROM temp.refresh_seen_ids')
 
         try:
             for video in video_generator:
-                seen_ids.add(video.id)
+                if force:
+                    self.ycdldb.execute('INSERT OR IGNORE INTO temp.refresh_seen_ids VALUES(?)', [video.id])
                 status = self.ycdldb.ingest_video(video)
 
                 if (not status['new']) and (not force):
                     break
-        except googleapiclient.errors.HttpError as exc:
+        except ytapi.ApiError as exc:
             raise exceptions.ChannelRefreshFailed(channel=self.id, exc=exc)
 
         # Now we will refresh some other IDs that may not have been refreshed
@@ -224,19 +286,29 @@ class Channel(ObjectBase):
         refresh_ids = set()
 
         # 1. Videos which have become unlisted, therefore not returned by the
-        # get_playlist_videos call. Take the set of all known ids minus those
-        # refreshed by the earlier loop, the difference will be unlisted,
-        # private, or deleted videos. At this time we have no special handling
-        # for deleted videos, but they simply won't come back from ytapi.
+        # get_playlist_videos call. Take all known ids minus those refreshed by
+        # the earlier loop, the difference will be unlisted, private, or
+        # deleted videos. At this time we have no special handling for deleted
+        # videos, but they simply won't come back from ytapi.
         if force:
-            known_ids = {v.id for v in self.ycdldb.get_videos(channel_id=self.id)}
-            refresh_ids.update(known_ids.difference(seen_ids))
+            query = '''
+            SELECT videos.id FROM videos
+            LEFT JOIN temp.refresh_seen_ids AS seen ON seen.id == videos.id
+            WHERE videos.author_id == ? AND seen.id IS NULL
+            '''
+            missing_ids = [row[0] for row in self.ycdldb.execute(query, [self.id]).fetchall()]
+            log.debug('%d videos were not in the uploads playlist.', len(missing_ids))
+            refresh_ids.update(missing_ids)
+            self.ycdldb.execute('DELETE FROM temp.refresh_seen_ids')
 
         # 2. Premieres or live events which may now be over but were not
         # included in the requested batch of IDs because they are not the most
-        # recent.
-        query = 'SELECT id FROM videos WHERE author_id == ? AND live_broadcast IS NOT NULL'
-        bindings = [self.id]
+        # recent. They're only checked when their scheduled time comes up.
+        query = '''
+        SELECT id FROM videos
+        WHERE author_id == ? AND live_broadcast IS NOT NULL AND live_next_check <= ?
+        '''
+        bindings = [self.id, timetools.now().timestamp()]
         premiere_ids = self.ycdldb.select_column(query, bindings)
         refresh_ids.update(premiere_ids)
 
@@ -247,11 +319,17 @@ class Channel(ObjectBase):
             for video in self.ycdldb.youtube.get_videos(refresh_ids):
                 self.ycdldb.ingest_video(video)
 
+        # A successful refresh shows that the channel still exists, whatever
+        # its feed says.
         pairs = {
             'id': self.id,
             'last_refresh': timetools.now().timestamp(),
+            'rss_failures': 0,
+            'quarantined': None,
         }
         self.ycdldb.update(table=Channel, pairs=pairs, where_key='id')
+        self.rss_failures = 0
+        self.quarantined = None
 
     def reset_uploads_playlist_id(self):
         '''
@@ -344,25 +422,91 @@ class Channel(ObjectBase):
 class Video(ObjectBase):
     table = 'videos'
     no_such_exception = exceptions.NoSuchVideo
+    __slots__ = (
+        'id',
+        'published',
+        'author_id',
+        'title',
+        'description',
+        'duration',
+        'views',
+        'thumbnail',
+        'live_broadcast',
+        'live_scheduled',
+        'live_next_check',
+        'live_checks',
+        'state',
+        'is_shorts',
+    )
+    # Descriptions are often several kilobytes and are not shown in listings,
+    # so they are not kept by __init__ even if the row contains them. They are
+    # loaded by __getattr__ the first time they are accessed.
+    deferred_columns = {'description'}
 
     def __init__(self, ycdldb, db_row):
+        '''
+        db_row may contain only some of the columns, for example when it comes
+        from get_videos with a column projection. The missing columns will be
+        loaded from the database the first time they are accessed.
+        '''
         super().__init__(ycdldb)
 
+        # When __reinit__ calls this again, forget the deferred columns that
+        # were already loaded so that they are reloaded too.
+        for column in Video.deferred_columns:
+            try:
+                delattr(self, column)
+            except AttributeError:
+                pass
+
         self.id = db_row['id']
-        self.published = db_row['published']
-        self.author_id = db_row['author_id']
-        self.title = db_row['title']
-        self.description = db_row['description']
-        self.duration = db_row['duration']
-        self.views = db_row['views']
-        self.thumbnail = db_row['thumbnail']
-        self.live_broadcast = db_row['live_broadcast']
-        self.state = db_row['state']
-        self.is_shorts = None if db_row['is_shorts'] is None else bool(db_row['is_shorts'])
+        for column in db_row.keys():
+            if column == 'id' or column in Video.deferred_columns:
+                continue
+            # Rows from a JOIN may contain columns from other tables.
+            if column not in Video.__slots__:
+                continue
+            self._set_column(column, db_row[column])
+
+    def __getattr__(self, name):
+        # This is only called when the slot has not been filled yet.
+        if name not in Video.__slots__:
+            raise AttributeError(f'{type(self).__name__} object has no attribute {name}')
+
+        # While we're making the trip, we may as well pick up all the other
+        # columns that are missing, except for the big deferred ones.
+        columns = [name]
+        for column in Video.__slots__:
+            if column == name or column in Video.deferred_columns:
+                continue
+            try:
+                object.__getattribute__(self, column)
+            except AttributeError:
+                columns.append(column)
+
+        log.loud('Loading %s for %s.', columns, self)
+        query = f'SELECT {", ".join(columns)} FROM videos WHERE id == ?'
+        row = self.ycdldb.select_one(query, [self.id])
+        if row is None:
+            raise exceptions.NoSuchVideo(self.id)
+
+        for (column, value) in zip(columns, row):
+            self._set_column(column, value)
+
+        return object.__getattribute__(self, name)
 
     def __repr__(self):
         return f'Video:{self.id}'
 
+    def _set_column(self, column, value):
+        if column in ('author_id', 'state') and value is not None:
+            # Many videos share the same author and state, so there's no need
+            # for each of them to hold their own copy of the string.
+            value = sys.intern(value)
+        elif column == 'is_shorts' and value is not None:
+            value = bool(value)
+        setattr(self, column, value)
+
     @property
     def author(self):
         try:
@@ -382,21 +526,31 @@ class Video(ObjectBase):
     def delete(self):
         log.info('Deleting %s.', self)
 
+        self.ycdldb.delete(table='video_stats_history', pairs={'video_id': self.id})
         self.ycdldb.delete(table='videos', pairs={'id': self.id})
         self.deleted = True
 
-    def jsonify(self):
+    def get_view_history(self, *, since=None, until=None) -> list[tuple]:
+        return self.ycdldb.get_view_history(self.id, since=since, until=until)
+
+    def jsonify(self, *, include_deferred=True):
+        '''
+        include_deferred:
+            If False, the deferred columns are left out, which saves a query
+            when they haven't been loaded yet.
+        '''
         j = {
             'id': self.id,
             'published': self.published,
             'author_id': self.author_id,
             'title': self.title,
-            'description': self.description,
             'duration': self.duration,
             'views': self.views,
             'thumbnail': self.thumbnail,
             'state': self.state,
         }
+        if include_deferred:
+            j['description'] = self.description
         return j
 
     @worms.atomic
@@ -415,12 +569,9 @@ class Video(ObjectBase):
             'id': self.id,
             'state': state,
         }
-        self.state = state
+        self.state = sys.intern(state)
         self.ycdldb.update(table='videos', pairs=pairs, where_key='id')
 
     @property
     def published_string(self):
-        published = self.published
-        published = datetime.datetime.utcfromtimestamp(published)
-        published = published.strftime('%Y-%m-%d')
-        return published
+        return helpers.timestamp_to_date_string(self.published)
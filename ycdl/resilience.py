@@ -0,0 +1,172 @@
+'''
+This module is the shared error handling for everything that talks to
+Youtube over the network: the RSS feeds, the shorts check, and the Data API.
+
+- Every request has a connect and a read timeout, so one hung connection can't
+  stall a refresh forever.
+- Failures that are likely to be temporary (timeouts, dropped connections, 429
+  and 5xx responses) are retried with exponential backoff and full jitter.
+- Each host has a circuit breaker. After enough consecutive failures the
+  breaker opens, and calls to that host fail immediately with
+  exceptions.CircuitOpen until the reset timeout has passed. Then one trial
+  call is let through, and its outcome closes or re-opens the breaker.
+
+So when Youtube has a bad hour, a refresh spends a few seconds finding out and
+then moves quickly through the remaining channels, instead of waiting out
+every timeout and retry for each one.
+'''
+import random
+import threading
+import time
+import urllib.parse
+
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+from . import exceptions
+from . import metrics
+
+# Seconds.
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_TIMEOUT = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+# Retries after the first attempt. The wait before retry n is a random number
+# of seconds between 0 and min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n).
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 1
+DEFAULT_BACKOFF_MAX = 30
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+class CircuitBreaker:
+    def __init__(
+            self,
+            host,
+            *,
+            failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_timeout=DEFAULT_RESET_TIMEOUT,
+        ):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        '''
+        Raise exceptions.CircuitOpen if the call should not be made.
+        '''
+        with self.lock:
+            if self.opened_at is None:
+                return
+            wait = self.opened_at + self.reset_timeout - time.monotonic()
+            if wait > 0 or self.trial_running:
+                raise exceptions.CircuitOpen(host=self.host, wait=max(wait, 0))
+            log.info('Trying %s again after %d failures.', self.host, self.failures)
+            self.trial_running = True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                log.info('%s is responding again.', self.host)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or (self.opened_at is None and self.failures >= self.failure_threshold):
+                log.warning(
+                    '%s failed %d times in a row, pausing calls for %d seconds.',
+                    self.host,
+                    self.failures,
+                    self.reset_timeout,
+                )
+                metrics.CIRCUIT_BREAKER_OPENS.inc(host=self.host)
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+def get_breaker(host) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host)
+            _breakers[host] = breaker
+        return breaker
+
+def host_of(url) -> str:
+    return urllib.parse.urlsplit(url).netloc
+
+def backoff(attempt, *, base=DEFAULT_BACKOFF_BASE, maximum=DEFAULT_BACKOFF_MAX) -> float:
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+def is_retryable(exc) -> bool:
+    # requests' exceptions, httplib2's socket timeouts and the standard
+    # library's connection errors are all OSErrors.
+    if isinstance(exc, OSError):
+        return True
+    return getattr(exc, 'status', None) in RETRY_STATUSES
+
+def call(host, function, *, retries=DEFAULT_RETRIES, is_retryable=is_retryable):
+    '''
+    Call function() through the host's circuit breaker, retrying the failures
+    for which is_retryable(exc) is True. Other exceptions are raised right
+    away and don't count against the host, since they mean the host answered.
+
+    Raises exceptions.CircuitOpen if the host's breaker is open.
+    '''
+    breaker = get_breaker(host)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = function()
+        except Exception as exc:
+            if not is_retryable(exc):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= retries:
+                raise
+            wait = backoff(attempt)
+            log.debug('%s failed with %r, retrying in %.1f seconds.', host, exc, wait)
+            metrics.NETWORK_RETRIES.inc(host=host)
+            attempt += 1
+            time.sleep(wait)
+            continue
+        breaker.record_success()
+        return result
+
+class _RetryableResponse(Exception):
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+        self.status = response.status_code
+
+def request(session, method, url, *, retries=DEFAULT_RETRIES, timeout=DEFAULT_TIMEOUT, **kwargs):
+    '''
+    Make a request with the requests session, with the timeout, retries and
+    circuit breaker. If the retries run out on a 429 or 5xx status, the last
+    response is returned so the caller can handle its status as usual.
+    '''
+    def attempt():
+        response = session.request(method, url, timeout=timeout, **kwargs)
+        if response.status_code in RETRY_STATUSES:
+            raise _RetryableResponse(response)
+        return response
+
+    try:
+        return call(host_of(url), attempt, retries=retries)
+    except _RetryableResponse as exc:
+        return exc.response
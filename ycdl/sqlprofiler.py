@@ -0,0 +1,356 @@
+'''
+This module is an opt-in profiler for the SQL that YCDLDB runs. When enabled,
+the database connections are wrapped in proxies that record every statement's
+text, duration (execution plus fetching) and row count into the current
+Profile. A Profile usually covers one web request or one CLI command.
+
+When a Profile finishes, the query plans of its slow statements are captured
+with EXPLAIN QUERY PLAN, and statements that were executed many times with the
+same shape are flagged as possible N+1 patterns, like calling has_pending for
+every channel on the channels page.
+
+Profiling must be enabled before the YCDLDB is created:
+
+    ycdl.sqlprofiler.enable()
+    ycdldb = ycdl.ycdldb.YCDLDB()
+    with ycdl.sqlprofiler.profile('my task') as profile:
+        ...
+    print(profile.report())
+
+Or call ycdldb.enable_sql_profiler() on an existing instance.
+'''
+import contextlib
+import contextvars
+import re
+import sqlite3
+import time
+
+from voussoirkit import pathclass
+from voussoirkit import vlogging
+
+log = vlogging.getLogger(__name__)
+
+# Seconds.
+DEFAULT_SLOW_THRESHOLD = 0.05
+# Number of times a statement shape must be executed within one profile to be
+# reported as a possible N+1.
+DEFAULT_REPEAT_THRESHOLD = 10
+# Beyond this many statements, a profile only keeps the per-shape totals so
+# that a long CLI command does not run out of memory.
+MAX_STATEMENTS = 50_000
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_enabled = False
+_current = contextvars.ContextVar('ycdl_sql_profile', default=None)
+
+def enable():
+    '''
+    Make every YCDLDB created from now on profile its connections.
+    '''
+    global _enabled
+    _enabled = True
+
+def is_enabled():
+    return _enabled
+
+def current():
+    return _current.get()
+
+def start(name, **kwargs):
+    '''
+    Start a Profile in the current context and return a token for `stop`.
+    This is for places like Flask's before_request and after_request, where
+    a `with` block is not possible.
+    '''
+    return _current.set(Profile(name, **kwargs))
+
+def stop(token):
+    '''
+    Finish the Profile started by `start` and return it.
+    '''
+    profile = _current.get()
+    _current.reset(token)
+    profile.finish()
+    return profile
+
+@contextlib.contextmanager
+def profile(name, **kwargs):
+    token = start(name, **kwargs)
+    profile = _current.get()
+    try:
+        yield profile
+    finally:
+        stop(token)
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_QMARK_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+def statement_shape(query) -> str:
+    '''
+    Return the query with literals replaced by ? and IN lists collapsed, so
+    that statements which only differ by their parameters have the same shape.
+    '''
+    shape = _WHITESPACE.sub(' ', query).strip()
+    shape = _STRING.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _QMARK_LIST.sub('(?, ...)', shape)
+    return shape
+
+class ShapeStats:
+    __slots__ = ('shape', 'count', 'duration', 'rows')
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.duration = 0
+        self.rows = 0
+
+class Statement:
+    __slots__ = ('query', 'bindings', 'connection', 'connection_name', 'duration', 'rows', 'plan', 'stats')
+
+    def __init__(self, query, bindings, connection, connection_name, stats):
+        self.query = query
+        self.bindings = bindings
+        self.connection = connection
+        self.connection_name = connection_name
+        self.duration = 0
+        self.rows = 0
+        self.plan = None
+        self.stats = stats
+
+    def add(self, duration, rows=0):
+        self.duration += duration
+        self.rows += rows
+        self.stats.duration += duration
+        self.stats.rows += rows
+
+    def explain(self):
+        # Statements from executemany and executescript have no bindings to
+        # explain with.
+        if self.bindings is None:
+            return
+        if not self.query.lstrip().upper().startswith(EXPLAINABLE):
+            return
+        try:
+            # Using the raw connection, so this is not recorded.
+            rows = self.connection.execute('EXPLAIN QUERY PLAN ' + self.query, self.bindings).fetchall()
+            self.plan = [row[-1] for row in rows]
+        except sqlite3.Error as exc:
+            self.plan = [f'(could not explain: {exc})']
+
+class Profile:
+    def __init__(
+            self,
+            name,
+            *,
+            repeat_threshold=DEFAULT_REPEAT_THRESHOLD,
+            slow_threshold=DEFAULT_SLOW_THRESHOLD,
+        ):
+        self.name = name
+        self.repeat_threshold = repeat_threshold
+        self.slow_threshold = slow_threshold
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.statements = []
+        self.dropped = 0
+        # {shape: ShapeStats}
+        self.shapes = {}
+
+    def __repr__(self):
+        return f'Profile({self.name!r})'
+
+    def record(self, query, bindings, connection, connection_name) -> Statement:
+        shape = statement_shape(query)
+        stats = self.shapes.get(shape)
+        if stats is None:
+            stats = self.shapes[shape] = ShapeStats(shape)
+        stats.count += 1
+
+        statement = Statement(query, bindings, connection, connection_name, stats)
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append(statement)
+        else:
+            self.dropped += 1
+        return statement
+
+    def finish(self, explain_limit=10):
+        self.elapsed = time.perf_counter() - self.started
+        for statement in self.slow_statements()[:explain_limit]:
+            if statement.plan is None:
+                statement.explain()
+
+    @property
+    def count(self):
+        return sum(stats.count for stats in self.shapes.values())
+
+    @property
+    def duration(self):
+        return sum(stats.duration for stats in self.shapes.values())
+
+    @property
+    def rows(self):
+        return sum(stats.rows for stats in self.shapes.values())
+
+    def repeated_shapes(self) -> list:
+        '''
+        Return the ShapeStats of statements executed at least repeat_threshold
+        times, most frequent first. These are candidates for N+1 patterns where
+        one query per item should have been one query for all items.
+        '''
+        repeated = [stats for stats in self.shapes.values() if stats.count >= self.repeat_threshold]
+        repeated.sort(key=lambda stats: stats.count, reverse=True)
+        return repeated
+
+    def slow_statements(self) -> list:
+        slow = [s for s in self.statements if s.duration >= self.slow_threshold]
+        slow.sort(key=lambda s: s.duration, reverse=True)
+        return slow
+
+    def report(self, limit=10) -> str:
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        lines = [
+            f'SQL profile for {self.name}: {self.count} statements, '
+            f'{self.duration:.4f} s in SQL of {elapsed:.4f} s total, {self.rows} rows.'
+        ]
+        if self.dropped:
+            lines.append(f'({self.dropped} statements were only counted by shape.)')
+
+        slow = self.slow_statements()
+        if slow:
+            lines.append(f'Slow statements (>= {self.slow_threshold} s):')
+            for statement in slow[:limit]:
+                query = _WHITESPACE.sub(' ', statement.query).strip()
+                lines.append(f'  {statement.duration:.4f} s  {statement.rows} rows  [{statement.connection_name}]  {query}')
+                for detail in statement.plan or []:
+                    lines.append(f'      {detail}')
+
+        repeated = self.repeated_shapes()
+        if repeated:
+            lines.append(f'Repeated statements, possible N+1 (>= {self.repeat_threshold} times):')
+            for stats in repeated[:limit]:
+                lines.append(f'  {stats.count} x  {stats.duration:.4f} s  {stats.rows} rows  {stats.shape}')
+
+        return '\n'.join(lines)
+
+    def write_report(self, filepath):
+        '''
+        Append the report to a log file.
+        '''
+        filepath = pathclass.Path(filepath)
+        with filepath.open('a', encoding='utf-8') as handle:
+            handle.write(time.strftime('%Y-%m-%d %H:%M:%S') + ' ' + self.report() + '\n\n')
+
+# CONNECTION PROXIES ###############################################################################
+
+class ProfilingCursor:
+    '''
+    Wraps a sqlite3.Cursor so that its statements and fetches are recorded
+    into the current Profile. When there is no current Profile, the only cost
+    is one ContextVar lookup per execute.
+    '''
+    def __init__(self, cursor, connection, connection_name):
+        self.__dict__['_cursor'] = cursor
+        self.__dict__['_connection'] = connection
+        self.__dict__['_connection_name'] = connection_name
+        self.__dict__['_statement'] = None
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._cursor, attr, value)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._statement is None:
+            return next(self._cursor)
+        start = time.perf_counter()
+        try:
+            row = next(self._cursor)
+        except StopIteration:
+            self._statement.add(time.perf_counter() - start)
+            raise
+        self._statement.add(time.perf_counter() - start, 1)
+        return row
+
+    def _execute(self, method, query, args, bindings):
+        profile = _current.get()
+        if profile is None:
+            self.__dict__['_statement'] = None
+            method(query, *args)
+            return self
+
+        statement = profile.record(query, bindings, self._connection, self._connection_name)
+        self.__dict__['_statement'] = statement
+        start = time.perf_counter()
+        method(query, *args)
+        duration = time.perf_counter() - start
+        # Writes don't return rows, so count the rows they affected instead.
+        rows = max(self._cursor.rowcount, 0) if self._cursor.description is None else 0
+        statement.add(duration, rows)
+        return self
+
+    def execute(self, query, bindings=()):
+        return self._execute(self._cursor.execute, query, (bindings,), bindings)
+
+    def executemany(self, query, seq_of_bindings):
+        return self._execute(self._cursor.executemany, query, (seq_of_bindings,), None)
+
+    def executescript(self, script):
+        return self._execute(self._cursor.executescript, script, (), None)
+
+    def _fetch(self, method, args, count_rows):
+        if self._statement is None:
+            return method(*args)
+        start = time.perf_counter()
+        result = method(*args)
+        self._statement.add(time.perf_counter() - start, count_rows(result))
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone, (), lambda row: 0 if row is None else 1)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, args, len)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall, (), len)
+
+class ProfilingConnection:
+    '''
+    Wraps a sqlite3.Connection so that its cursors are ProfilingCursors.
+    Everything else is passed through to the real connection.
+    '''
+    def __init__(self, connection, name):
+        self.__dict__['_connection'] = connection
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+        return getattr(self._connection, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._connection, attr, value)
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._connection.__exit__(*args)
+
+    def cursor(self, *args):
+        return ProfilingCursor(self._connection.cursor(*args), self._connection, self._name)
+
+    def execute(self, query, bindings=()):
+        return self.cursor().execute(query, bindings)
+
+    def executemany(self, query, seq_of_bindings):
+        return self.cursor().executemany(query, seq_of_bindings)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
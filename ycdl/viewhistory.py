@@ -0,0 +1,93 @@
+'''
+This module encodes the view count history of videos for the
+video_stats_history table.
+
+A row per sample would make the database many times bigger, so each row of
+the table holds all of one video's samples from one calendar month (UTC), as
+a blob. The month is an integer like 202610. For each sample, the blob
+contains two varints:
+
+1. The seconds since the previous sample, or since the start of the month for
+   the first sample.
+2. The change in views since the previous sample, or the views themselves for
+   the first sample.
+
+Both are zigzag encoded so that they can be negative, which happens when
+Youtube removes fake views or the clock goes backwards. A typical sample is
+four or five bytes, and each month's blob can be read on its own.
+'''
+import calendar
+import datetime
+
+def month_of(timestamp) -> int:
+    date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return (date.year * 100) + date.month
+
+def month_start(month) -> int:
+    (year, month) = divmod(month, 100)
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+def _zigzag(number):
+    return (number << 1) if number >= 0 else ((-number << 1) - 1)
+
+def _unzigzag(number):
+    return (number >> 1) if not (number & 1) else -((number + 1) >> 1)
+
+def _write_varint(buffer, number):
+    number = _zigzag(number)
+    while number >= 0x80:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+def _read_varints(blob):
+    number = 0
+    shift = 0
+    for byte in blob:
+        number |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield _unzigzag(number)
+        number = 0
+        shift = 0
+
+def decode(blob, month) -> list:
+    '''
+    Return the [(timestamp, views), ...] stored in the month's blob.
+    '''
+    samples = []
+    timestamp = month_start(month)
+    views = 0
+    numbers = _read_varints(blob)
+    for (time_delta, views_delta) in zip(numbers, numbers):
+        timestamp += time_delta
+        views += views_delta
+        samples.append((timestamp, views))
+    return samples
+
+def encode(samples, month) -> bytes:
+    buffer = bytearray()
+    previous_timestamp = month_start(month)
+    previous_views = 0
+    for (timestamp, views) in samples:
+        _write_varint(buffer, int(timestamp) - previous_timestamp)
+        _write_varint(buffer, views - previous_views)
+        previous_timestamp = int(timestamp)
+        previous_views = views
+    return bytes(buffer)
+
+def append(blob, month, timestamp, views) -> bytes:
+    '''
+    Return the blob with one more sample at the end. The deltas are relative
+    to the last sample, so the blob has to be decoded to find it.
+    '''
+    samples = decode(blob, month) if blob else []
+    if samples:
+        (previous_timestamp, previous_views) = samples[-1]
+    else:
+        (previous_timestamp, previous_views) = (month_start(month), 0)
+    buffer = bytearray(blob or b'')
+    _write_varint(buffer, int(timestamp) - previous_timestamp)
+    _write_varint(buffer, views - previous_views)
+    return bytes(buffer)
@@ -1,8 +1,16 @@
+import contextlib
 import json
+import re
 import sqlite3
+import sys
+import threading
+import time
+import typing
+import uuid
 
 from voussoirkit import cacheclass
 from voussoirkit import configlayers
+from voussoirkit import gentools
 from voussoirkit import lazychain
 from voussoirkit import pathclass
 from voussoirkit import timetools
@@ -12,13 +20,17 @@ from voussoirkit import worms
 log = vlogging.getLogger(__name__)
 
 from . import constants
+from . import events
 from . import exceptions
+from . import helpers
+from . import jobs
+from . import metrics
 from . import objects
+from . import sqlprofiler
+from . import viewhistory
 from . import ytapi
 from . import ytrss
 
-import youtube_credentials
-
 class YCDLDBChannelMixin:
     def __init__(self):
         super().__init__()
@@ -68,6 +80,8 @@ class YCDLDBChannelMixin:
             'queuefile_extension': queuefile_extension,
             'automark': automark,
             'autorefresh': True,
+            'rss_failures': 0,
+            'quarantined': None,
             'ignore_shorts': int(bool(ignore_shorts)),
         }
         self.insert(table='channels', pairs=data)
@@ -91,8 +105,25 @@ class YCDLDBChannelMixin:
     def get_channels_by_sql(self, query, bindings=None):
         return self.get_objects_by_sql(objects.Channel, query, bindings)
 
+    def get_channel_names(self, channel_ids) -> dict:
+        '''
+        Return {channel_id: name} for these channels in a single pass, without
+        constructing Channel objects. This is used by video listings which
+        only need the author names. Unknown channels are not included.
+        '''
+        channel_ids = list(set(channel_ids))
+        names = {}
+        size = constants.SQLITE_MAX_VARIABLES
+        for index in range(0, len(channel_ids), size):
+            chunk = channel_ids[index:index + size]
+            qmarks = ', '.join('?' * len(chunk))
+            query = f'SELECT id, name FROM channels WHERE id IN ({qmarks})'
+            for (channel_id, name) in self.select(query, chunk):
+                names[channel_id] = name or channel_id
+        return names
+
     @worms.atomic
-    def _rss_assisted_refresh(self, channels, skip_failures=False):
+    def _rss_assisted_refresh(self, channels, skip_failures=False, on_channel_done=None):
         '''
         Youtube provides RSS feeds for every channel. These feeds do not
         require the API token and seem to have generous ratelimits, or
@@ -128,6 +159,8 @@ class YCDLDBChannelMixin:
                     excs.append(exc)
                 else:
                     raise
+            if on_channel_done:
+                on_channel_done(channel)
 
         def assisted(channel):
             try:
@@ -136,9 +169,19 @@ class YCDLDBChannelMixin:
                 pairs = {
                     'id': channel.id,
                     'last_refresh': timetools.now().timestamp(),
+                    'rss_failures': 0,
                 }
                 self.update(table='channels', pairs=pairs, where_key='id')
-                yield from new_ids
+                channel.rss_failures = 0
+            except exceptions.RSSFeedNotFound:
+                # If the channel is really gone, the traditional refresh will
+                # fail too and the count keeps going up until the quarantine.
+                if channel.record_rss_not_found():
+                    if on_channel_done:
+                        on_channel_done(channel)
+                    return
+                need_traditional.append(channel)
+                return
             except (exceptions.NoVideos, exceptions.RSSAssistFailed) as exc:
                 log.debug(
                     'RSS assist for %s failed "%s", adding to traditional queue.',
@@ -146,20 +189,18 @@ class YCDLDBChannelMixin:
                     exc.error_message
                 )
                 need_traditional.append(channel)
+                return
+            # The new videos are ingested in batches with other channels, so
+            # this counts the channel as done once its feed has been read.
+            if on_channel_done:
+                on_channel_done(channel)
+            yield from new_ids
 
         video_ids = lazychain.LazyChain()
 
         for channel in channels:
             video_ids.extend(assisted(channel))
 
-        # Premieres or live events which may now be over but were not
-        # included in the requested batch of IDs because they are not the
-        # most recent.
-        query = 'SELECT id FROM videos WHERE live_broadcast IS NOT NULL'
-        premiere_ids = set(self.select_column(query))
-        log.debug('Refreshing %d ids separately.', len(premiere_ids))
-        video_ids.extend(premiere_ids)
-
         for video in self.youtube.get_videos(video_ids):
             self.ingest_video(video)
 
@@ -170,23 +211,35 @@ class YCDLDBChannelMixin:
         return excs
 
     @worms.atomic
-    def refresh_all_channels(
-            self,
-            *,
-            force=False,
-            rss_assisted=True,
-            skip_failures=False,
-        ):
-        log.info('Refreshing all channels.')
-
-        channels = self.get_channels_by_sql('SELECT * FROM channels WHERE autorefresh == 1')
+    def _refresh_live_videos(self):
+        '''
+        Premieres or live events which may now be over but were not included
+        in the RSS-assisted refresh because they are not the most recent.
+        Only the videos whose next check is due are fetched, see
+        helpers.next_live_check.
+        '''
+        # This uses the partial index, which only contains live videos.
+        query = 'SELECT id FROM videos WHERE live_broadcast IS NOT NULL AND live_next_check <= ?'
+        bindings = [timetools.now().timestamp()]
+        premiere_ids = list(self.select_column(query, bindings))
+        log.debug('Refreshing %d ids separately.', len(premiere_ids))
+        for video in self.youtube.get_videos(premiere_ids):
+            self.ingest_video(video)
 
+    @worms.atomic
+    def _refresh_channels(self, channels, *, force, rss_assisted, skip_failures, on_channel_done=None):
         if rss_assisted and not force:
-            return self._rss_assisted_refresh(channels, skip_failures=skip_failures)
+            return self._rss_assisted_refresh(
+                channels,
+                skip_failures=skip_failures,
+                on_channel_done=on_channel_done,
+            )
 
         excs = []
         for channel in channels:
             try:
+                # Channel.refresh is atomic, so a failed channel is rolled back
+                # to its savepoint without losing the others.
                 channel.refresh(force=force)
             except Exception as exc:
                 if skip_failures:
@@ -194,8 +247,387 @@ class YCDLDBChannelMixin:
                     excs.append(exc)
                 else:
                     raise
+            if on_channel_done:
+                on_channel_done(channel)
+        return excs
+
+    def refresh_all_channels(
+            self,
+            *,
+            commit_every=None,
+            force=False,
+            rss_assisted=True,
+            skip_failures=False,
+        ):
+        '''
+        commit_every:
+            If None, the whole refresh is one transaction, or part of the
+            caller's transaction.
+            If an integer, each chunk of that many channels gets its own
+            transaction, so progress survives a crash and other writers get
+            the write lock in between. If the caller is already holding a
+            transaction, the chunks are savepoints inside it instead and
+            nothing is committed until the caller commits.
+
+        Channels are refreshed in order of their last refresh, so after a crash
+        the channels that missed out are the first ones to go next time.
+        Quarantined channels are skipped, see Channel.record_rss_not_found.
+
+        The progress is published to ycdl.events as refresh_started,
+        refresh_progress and refresh_finished events.
+        '''
+        log.info('Refreshing all channels.')
+        mode = metrics.refresh_mode(force=force, rss_assisted=rss_assisted)
+        new_before = metrics.VIDEOS_INGESTED.get(new=True)
+        start = time.perf_counter()
+
+        query = '''
+        SELECT * FROM channels
+        WHERE autorefresh == 1 AND quarantined IS NULL
+        ORDER BY last_refresh ASC
+        '''
+        channels = list(self.get_channels_by_sql(query))
+
+        if commit_every is None:
+            chunks = [channels]
+        else:
+            chunks = gentools.chunk_generator(channels, commit_every)
+
+        total = len(channels)
+        events.publish('refresh_started', {'total': total, 'force': force})
+        done = 0
+
+        def on_channel_done(channel):
+            nonlocal done
+            done += 1
+            events.publish('refresh_progress', {
+                'channel_id': channel.id,
+                'done': done,
+                'remaining': total - done,
+                'total': total,
+            })
+
+        # _refresh_channels and _refresh_live_videos are atomic, so inside the
+        # caller's transaction they only make savepoints.
+        if self.in_transaction():
+            transaction = contextlib.nullcontext()
+        else:
+            transaction = self.transaction
+
+        excs = []
+        for chunk in chunks:
+            with transaction:
+                excs.extend(self._refresh_channels(
+                    chunk,
+                    force=force,
+                    rss_assisted=rss_assisted,
+                    skip_failures=skip_failures,
+                    on_channel_done=on_channel_done,
+                ))
+            if commit_every is not None:
+                log.info('Refreshed %d / %d channels.', done, total)
+
+        if rss_assisted and not force:
+            with transaction:
+                self._refresh_live_videos()
+
+        metrics.REFRESH_SECONDS.observe(time.perf_counter() - start, mode=mode)
+        # If another thread is ingesting at the same time, its videos will be
+        # counted here too, which is acceptable for a histogram.
+        new_videos = metrics.VIDEOS_INGESTED.get(new=True) - new_before
+        metrics.REFRESH_NEW_VIDEOS.observe(new_videos, mode=mode)
+        metrics.REFRESH_FAILURES.inc(len(excs))
+        events.publish('refresh_finished', {
+            'failures': [str(exc) for exc in excs],
+            'new_videos': new_videos,
+            'total': total,
+        })
         return excs
 
+class YCDLDBDownloadQueueMixin:
+    '''
+    The download queue is an alternative to queuefiles for setups where several
+    download workers, possibly on different machines, share one YCDL. Workers
+    claim videos for a limited time (the lease) and must send heartbeats to
+    keep them. If a worker dies, its lease expires and the video is given to
+    another worker.
+    '''
+    def __init__(self):
+        super().__init__()
+
+    @worms.atomic
+    def claim_downloads(
+            self,
+            worker,
+            *,
+            count=1,
+            lease=constants.DEFAULT_DOWNLOAD_LEASE,
+            max_attempts=constants.DEFAULT_DOWNLOAD_MAX_ATTEMPTS,
+        ) -> list[dict]:
+        '''
+        Claim up to `count` videos from the front of the queue for this worker,
+        returning their queue rows. Videos whose lease has expired are
+        available to be claimed again.
+
+        The claim is made in a single UPDATE statement so that two workers can
+        never receive the same video.
+        '''
+        now = int(timetools.now().timestamp())
+        claim = uuid.uuid4().hex
+        query = '''
+        UPDATE download_queue
+        SET worker = ?, claim = ?, lease_expires = ?, attempts = attempts + 1
+        WHERE video_id IN (
+            SELECT video_id FROM download_queue
+            WHERE (lease_expires IS NULL OR lease_expires <= ?) AND attempts < ?
+            ORDER BY queued ASC
+            LIMIT ?
+        )
+        '''
+        bindings = [worker, claim, now + lease, now, max_attempts, count]
+        self.execute(query, bindings)
+
+        # We read back through the write connection because the claim has not
+        # been committed yet.
+        query = 'SELECT * FROM download_queue WHERE claim == ? ORDER BY queued ASC'
+        cur = self.execute(query, [claim])
+        columns = [description[0] for description in cur.description]
+        items = [dict(zip(columns, row)) for row in cur.fetchall()]
+        if items:
+            log.info('%s claimed %d downloads.', worker, len(items))
+        return items
+
+    @worms.atomic
+    def complete_download(self, worker, video_id):
+        '''
+        Remove the video from the queue because the worker has finished it.
+        If the worker's lease expired and another worker has claimed the video
+        since, the row belongs to that worker and is left alone.
+        '''
+        log.info('%s completed download of %s.', worker, video_id)
+        query = 'DELETE FROM download_queue WHERE video_id == ? AND worker == ?'
+        self.execute(query, [video_id, worker])
+
+    @worms.atomic
+    def enqueue_download(self, video_id, *, download_directory=None):
+        '''
+        Add the video to the download queue. If it is already in the queue, its
+        attempts are reset so that it may be tried again.
+        '''
+        if isinstance(download_directory, pathclass.Path):
+            download_directory = download_directory.absolute_path
+
+        log.debug('Adding %s to the download queue.', video_id)
+        query = '''
+        INSERT OR REPLACE INTO download_queue
+        (video_id, download_directory, queued, worker, claim, lease_expires, attempts, last_error)
+        VALUES(?, ?, ?, NULL, NULL, NULL, 0, NULL)
+        '''
+        bindings = [video_id, download_directory, timetools.now().timestamp()]
+        self.execute(query, bindings)
+
+    @worms.atomic
+    def fail_download(self, worker, video_id, error=None, *, retry_delay=60):
+        '''
+        Release the worker's claim on the video so that it can be tried again
+        later. The delay before the next attempt grows with each failure.
+        '''
+        log.warning('%s failed to download %s: %s', worker, video_id, error)
+        now = int(timetools.now().timestamp())
+        query = '''
+        UPDATE download_queue
+        SET worker = NULL, claim = NULL, lease_expires = ? + (? * attempts), last_error = ?
+        WHERE video_id == ? AND worker == ?
+        '''
+        bindings = [now, retry_delay, error, video_id, worker]
+        self.execute(query, bindings)
+
+    def get_download_queue(self) -> list[dict]:
+        query = 'SELECT * FROM download_queue ORDER BY queued ASC'
+        columns = self.COLUMNS['download_queue']
+        return [dict(zip(columns, row)) for row in self.select(query)]
+
+    @worms.atomic
+    def heartbeat_downloads(
+            self,
+            worker,
+            video_ids,
+            *,
+            lease=constants.DEFAULT_DOWNLOAD_LEASE,
+        ) -> list[str]:
+        '''
+        Extend the worker's lease on these videos. Returns the IDs that the
+        worker still holds. Any ID missing from the return value has been
+        completed or claimed by another worker after the lease expired.
+        '''
+        video_ids = list(video_ids)
+        if not video_ids:
+            return []
+
+        now = int(timetools.now().timestamp())
+        qmarks = ', '.join('?' * len(video_ids))
+        query = f'''
+        UPDATE download_queue SET lease_expires = ?
+        WHERE worker == ? AND video_id IN ({qmarks})
+        '''
+        self.execute(query, [now + lease, worker, *video_ids])
+
+        query = f'SELECT video_id FROM download_queue WHERE worker == ? AND video_id IN ({qmarks})'
+        held = [row[0] for row in self.execute(query, [worker, *video_ids]).fetchall()]
+        return held
+
+class YCDLDBJobMixin:
+    '''
+    Jobs are slow tasks, like refreshes, which the web interface hands to a
+    jobs.JobRunner instead of doing them inside the request. They are stored in
+    the database so that their status can be polled and so that queued jobs
+    survive a restart.
+    '''
+    def __init__(self):
+        super().__init__()
+
+    def _fetch_jobs(self, query, bindings) -> list[dict]:
+        # We read through the write connection so that uncommitted changes from
+        # the current transaction are visible.
+        cur = self.execute(query, bindings)
+        columns = [description[0] for description in cur.description]
+        return [self._job_from_row(dict(zip(columns, row))) for row in cur.fetchall()]
+
+    @staticmethod
+    def _job_from_row(job):
+        job['arguments'] = json.loads(job['arguments'])
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    @worms.atomic
+    def claim_next_job(self, runner, *, max_priority=None) -> typing.Optional[dict]:
+        '''
+        Mark the queued job with the best priority as running under this
+        runner and return it, or None if the queue is empty.
+
+        max_priority:
+            If given, only jobs with this priority or better are claimed.
+        '''
+        if max_priority is None:
+            max_priority = float('inf')
+        query = '''
+        UPDATE jobs SET status = "running", runner = ?, started = ?
+        WHERE id IN (
+            SELECT id FROM jobs WHERE status == "queued" AND priority <= ?
+            ORDER BY priority ASC, created ASC
+            LIMIT 1
+        )
+        '''
+        self.execute(query, [runner, timetools.now().timestamp(), max_priority])
+        query = 'SELECT * FROM jobs WHERE status == "running" AND runner == ? ORDER BY started DESC LIMIT 1'
+        claimed = self._fetch_jobs(query, [runner])
+        return claimed[0] if claimed else None
+
+    @worms.atomic
+    def complete_job(self, job_id, result=None):
+        pairs = {
+            'id': job_id,
+            'status': 'done',
+            'finished': timetools.now().timestamp(),
+            'result': json.dumps(result),
+        }
+        self.update(table='jobs', pairs=pairs, where_key='id')
+
+    @worms.atomic
+    def enqueue_job(self, kind, arguments=None, *, priority=constants.JOB_PRIORITY_BACKGROUND) -> dict:
+        '''
+        Add a job to the queue and return it.
+
+        If an identical job (same kind and arguments) is already queued or
+        running, that job is returned instead of adding a duplicate. If it is
+        still queued with a worse priority, it gets promoted to this one, so
+        the user clicking refresh moves the background refresh to the front.
+        '''
+        if kind not in jobs.JOB_KINDS:
+            raise exceptions.InvalidJobKind(kind)
+
+        arguments = json.dumps(arguments or {}, sort_keys=True)
+        dedupe_key = f'{kind}:{arguments}'
+
+        query = 'SELECT * FROM jobs WHERE dedupe_key == ? AND status IN ("queued", "running")'
+        existing = self._fetch_jobs(query, [dedupe_key])
+        if existing:
+            job = existing[0]
+            if job['status'] == 'queued' and priority < job['priority']:
+                pairs = {'id': job['id'], 'priority': priority}
+                self.update(table='jobs', pairs=pairs, where_key='id')
+                job['priority'] = priority
+            log.debug('Job %s is already %s.', dedupe_key, job['status'])
+            return job
+
+        log.info('Adding job %s.', dedupe_key)
+        data = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'arguments': arguments,
+            'dedupe_key': dedupe_key,
+            'priority': priority,
+            'status': 'queued',
+            'runner': None,
+            'created': timetools.now().timestamp(),
+            'started': None,
+            'finished': None,
+            'result': None,
+            'error': None,
+        }
+        self.insert(table='jobs', pairs=data)
+        return self._job_from_row(data)
+
+    @worms.atomic
+    def fail_job(self, job_id, error):
+        pairs = {
+            'id': job_id,
+            'status': 'failed',
+            'finished': timetools.now().timestamp(),
+            'error': error,
+        }
+        self.update(table='jobs', pairs=pairs, where_key='id')
+
+    def get_job(self, job_id) -> dict:
+        found = self.get_jobs_by_sql('SELECT * FROM jobs WHERE id == ?', [job_id])
+        if not found:
+            raise exceptions.NoSuchJob(job_id)
+        return found[0]
+
+    def get_jobs(self, *, status=None, limit=100) -> list[dict]:
+        if status is None:
+            query = 'SELECT * FROM jobs ORDER BY created DESC LIMIT ?'
+            return self.get_jobs_by_sql(query, [limit])
+        query = 'SELECT * FROM jobs WHERE status == ? ORDER BY created DESC LIMIT ?'
+        return self.get_jobs_by_sql(query, [status, limit])
+
+    def get_jobs_by_sql(self, query, bindings=None) -> list[dict]:
+        '''
+        The query should select all columns of jobs, in order.
+        '''
+        columns = self.COLUMNS['jobs']
+        return [self._job_from_row(dict(zip(columns, row))) for row in self.select(query, bindings)]
+
+    @worms.atomic
+    def prune_jobs(self, *, older_than=constants.DEFAULT_JOB_RETENTION):
+        '''
+        Delete finished jobs whose result is older than `older_than` seconds.
+        '''
+        cutoff = timetools.now().timestamp() - older_than
+        query = 'DELETE FROM jobs WHERE status IN ("done", "failed") AND finished < ?'
+        self.execute(query, [cutoff])
+
+    @worms.atomic
+    def requeue_interrupted_jobs(self):
+        '''
+        Put jobs that were running when the process died back in the queue.
+        Call this when starting the only runner, before any of its threads
+        claim anything.
+        '''
+        query = 'UPDATE jobs SET status = "queued", runner = NULL, started = NULL WHERE status == "running"'
+        self.execute(query)
+
 class YCDLDBVideoMixin:
     def __init__(self):
         super().__init__()
@@ -213,6 +645,10 @@ class YCDLDBVideoMixin:
         Create the queuefile within the channel's associated directory, or
         the default directory from the config file.
 
+        If the config's use_download_queue is enabled, the video is also added
+        to the download queue, see claim_downloads. Queuefiles can be turned
+        off with the config's create_queuefiles.
+
         download_directory:
             By default, the queuefile will be placed in the channel's
             download_directory if it has one, or the download_directory in the
@@ -246,8 +682,36 @@ class YCDLDBVideoMixin:
         except exceptions.NoSuchChannel:
             channel = None
 
+        (download_directory, queuefile_extension) = self._download_target(
+            channel,
+            download_directory=download_directory,
+            queuefile_extension=queuefile_extension,
+        )
+        queuefile = download_directory.with_child(video.id).replace_extension(queuefile_extension)
+
+        def create_queuefile():
+            log.info('Creating %s.', queuefile.absolute_path)
+
+            download_directory.makedirs(exist_ok=True)
+            queuefile.touch()
+
+        if self.config['create_queuefiles']:
+            self.on_commit_queue.append({'action': create_queuefile})
+
+        if self.config['use_download_queue']:
+            self.enqueue_download(video.id, download_directory=download_directory)
+
+        video.mark_state('downloaded')
+        return queuefile
+
+    def _download_target(self, channel, *, download_directory, queuefile_extension) -> tuple:
+        '''
+        Return the (download_directory, queuefile_extension) for a video of
+        this channel, which may be None, where the arguments override the
+        channel's settings and the channel's settings override the config.
+        '''
         if download_directory is not None:
-            download_directory = pathclass.Path(download_directory)
+            pass
         elif channel is not None:
             download_directory = channel.download_directory or self.config['download_directory']
         else:
@@ -260,18 +724,82 @@ class YCDLDBVideoMixin:
         else:
             queuefile_extension = self.config['queuefile_extension']
 
-        download_directory = pathclass.Path(download_directory)
-        queuefile = download_directory.with_child(video.id).replace_extension(queuefile_extension)
+        return (pathclass.Path(download_directory), queuefile_extension)
 
-        def create_queuefile():
-            log.info('Creating %s.', queuefile.absolute_path)
+    @worms.atomic
+    def download_videos(
+            self,
+            videos,
+            *,
+            download_directory=None,
+            force=False,
+            queuefile_extension=None,
+        ) -> dict:
+        '''
+        Like download_video for many videos, which may be Video objects or ids.
 
-            download_directory.makedirs(exist_ok=True)
-            queuefile.touch()
+        The videos are grouped by their target directory. Each directory is
+        created once and its queuefiles are written together after the
+        commit, the states are changed with mark_videos_state, and the
+        channels are looked up once each.
 
-        self.on_commit_queue.append({'action': create_queuefile})
-        video.mark_state('downloaded')
-        return queuefile
+        Return {download_directory absolute path: number of videos}. Videos
+        that are already downloaded, when not forced, are not counted.
+
+        Raises exceptions.NoSuchVideo if any of the ids is not in the
+        database.
+        '''
+        video_ids = [video for video in videos if isinstance(video, str)]
+        videos = [video for video in videos if not isinstance(video, str)]
+        videos.extend(self.get_videos_by_id(video_ids))
+        for video in videos:
+            if not isinstance(video, objects.Video):
+                raise TypeError(video)
+
+        if not force:
+            videos = [video for video in videos if video.state == 'pending']
+        if not videos:
+            return {}
+
+        author_ids = {video.author_id for video in videos}
+        channels = {channel.id: channel for channel in self.get_objects_by_id(objects.Channel, author_ids)}
+
+        # {(directory, extension): [video ids]}
+        groups = {}
+        targets = {}
+        for video in videos:
+            if video.author_id not in targets:
+                targets[video.author_id] = self._download_target(
+                    channels.get(video.author_id),
+                    download_directory=download_directory,
+                    queuefile_extension=queuefile_extension,
+                )
+            (directory, extension) = targets[video.author_id]
+            groups.setdefault((directory.absolute_path, extension), []).append(video.id)
+
+        def create_queuefiles(directory, extension, video_ids):
+            directory = pathclass.Path(directory)
+            log.info('Creating %d queuefiles in %s.', len(video_ids), directory.absolute_path)
+            directory.makedirs(exist_ok=True)
+            for video_id in video_ids:
+                directory.with_child(video_id).replace_extension(extension).touch()
+
+        counts = {}
+        for ((directory, extension), group_ids) in groups.items():
+            counts[directory] = counts.get(directory, 0) + len(group_ids)
+
+            if self.config['create_queuefiles']:
+                self.on_commit_queue.append({
+                    'action': create_queuefiles,
+                    'args': [directory, extension, group_ids],
+                })
+
+            if self.config['use_download_queue']:
+                for video_id in group_ids:
+                    self.enqueue_download(video_id, download_directory=directory)
+
+        self.mark_videos_state([video.id for video in videos], 'downloaded')
+        return counts
 
     def get_video(self, video_id):
         return self.get_object_by_id(objects.Video, video_id)
@@ -279,7 +807,52 @@ class YCDLDBVideoMixin:
     def get_videos_by_id(self, video_ids):
         return self.get_objects_by_id(objects.Video, video_ids, raise_for_missing=True)
 
-    def get_videos(self, channel_id=None, *, state=None, orderby=None):
+    def get_videos(self, channel_id=None, *, columns=None, state=None, orderby=None):
+        '''
+        columns:
+            A list of column names to select. The returned Video objects will
+            load the other columns on demand when they are accessed, so you
+            should ask for the columns that you are definitely going to use.
+            By default, all columns except the deferred ones (description) are
+            selected. The id is always selected.
+        '''
+        columns = self.normalize_video_columns(columns)
+        (query, bindings) = self._videos_query(
+            columns,
+            channel_id=channel_id,
+            orderby=orderby,
+            state=state,
+        )
+        rows = self.select(query, bindings)
+        for row in rows:
+            yield self.get_cached_instance(objects.Video, row)
+
+    def get_video_rows(self, columns, channel_id=None, *, state=None, orderby=None, limit=None):
+        '''
+        Like get_videos, but return an iterator of plain tuples of the
+        requested columns, in that order, straight from the cursor. No Video
+        objects are made and nothing goes into the cache, so this is the way
+        to export a lot of videos.
+
+        Raises ValueError for names that are not columns of videos.
+        '''
+        for column in columns:
+            if column not in self.COLUMNS['videos']:
+                raise ValueError(f'{column} is not a column of videos.')
+
+        (query, bindings) = self._videos_query(
+            columns,
+            channel_id=channel_id,
+            limit=limit,
+            orderby=orderby,
+            state=state,
+        )
+        cursor = self.execute_read(query, bindings)
+        # sqlite3.Row is convenient for objects, but tuples are much cheaper.
+        cursor.row_factory = None
+        return cursor
+
+    def _videos_query(self, columns, *, channel_id=None, limit=None, orderby=None, state=None):
         wheres = []
         orderbys = []
 
@@ -312,19 +885,35 @@ class YCDLDBVideoMixin:
             orderbys = ', '.join(orderbys)
             orderbys = ' ORDER BY ' + orderbys
 
-        query = 'SELECT * FROM videos' + wheres + orderbys
+        query = f'SELECT {", ".join(columns)} FROM videos' + wheres + orderbys
 
-        # log.debug('%s %s', query, bindings)
-        # explain = self.execute('EXPLAIN QUERY PLAN ' + query, bindings)
-        # log.debug('\n'.join(str(x) for x in explain.fetchall()))
+        if limit is not None:
+            query += ' LIMIT ?'
+            bindings.append(limit)
 
-        rows = self.select(query, bindings)
-        for row in rows:
-            yield self.get_cached_instance(objects.Video, row)
+        return (query, bindings)
 
     def get_videos_by_sql(self, query, bindings=None):
         return self.get_objects_by_sql(objects.Video, query, bindings)
 
+    def normalize_video_columns(self, columns):
+        '''
+        Return the list of columns to select for a video query, with the id
+        first. Raises ValueError for names that are not columns of videos.
+        '''
+        all_columns = self.COLUMNS['videos']
+        if columns is None:
+            columns = [c for c in all_columns if c not in objects.Video.deferred_columns]
+
+        columns = ['id'] + [column for column in columns if column != 'id']
+        for column in columns:
+            if column not in all_columns:
+                raise ValueError(f'{column} is not a column of videos.')
+
+        # Preserve order but remove duplicates.
+        columns = list(dict.fromkeys(columns))
+        return columns
+
     @worms.atomic
     def insert_playlist(self, playlist_id):
         video_generator = self.youtube.get_playlist_videos(playlist_id)
@@ -339,6 +928,7 @@ class YCDLDBVideoMixin:
         mark this video's state.
         '''
         status = self.insert_video(video)
+        metrics.VIDEOS_INGESTED.inc(new=status['new'])
 
         if not status['new']:
             return status
@@ -346,6 +936,17 @@ class YCDLDBVideoMixin:
         video = status['video']
         author = video.author
 
+        # Announce the video once it is committed, with the state it ended up
+        # in after the automark below, so that rolled back videos are never
+        # shown.
+        def publish_new_video():
+            data = video.jsonify(include_deferred=False)
+            data['author_name'] = author.name if author else None
+            data['is_shorts'] = video.is_shorts
+            data['live_broadcast'] = video.live_broadcast
+            events.publish('new_video', data)
+        self.on_commit_queue.append({'action': publish_new_video})
+
         if not author:
             return status
 
@@ -390,6 +991,40 @@ class YCDLDBVideoMixin:
             existing_live_broadcast = None
             download_status = 'pending'
 
+        if video.live_broadcast is None:
+            live_next_check = None
+            live_checks = None
+        else:
+            now = timetools.now().timestamp()
+            if existing_live_broadcast is not None:
+                previous_checks = existing.live_checks or 0
+                # The video may also come up in a refresh before its check is
+                # due, for example as one of the newest videos. That doesn't
+                # count as a check.
+                scheduled_check = existing.live_next_check is None or existing.live_next_check <= now
+            else:
+                previous_checks = 0
+                scheduled_check = True
+            live_next_check = helpers.next_live_check(
+                live_broadcast=video.live_broadcast,
+                scheduled_start=video.scheduled_start,
+                checks=previous_checks,
+                now=now,
+            )
+            # The backoff only grows while the video is live or overdue. If it
+            # was rescheduled to a later time, start over.
+            waiting_for_schedule = (
+                video.live_broadcast == 'upcoming' and
+                video.scheduled_start is not None and
+                video.scheduled_start - constants.LIVE_CHECK_LEAD > now
+            )
+            if waiting_for_schedule:
+                live_checks = 0
+            elif scheduled_check:
+                live_checks = previous_checks + 1
+            else:
+                live_checks = previous_checks
+
         data = {
             'id': video.id,
             'published': video.published,
@@ -400,17 +1035,25 @@ class YCDLDBVideoMixin:
             'views': video.views,
             'thumbnail': video.thumbnail['url'],
             'live_broadcast': video.live_broadcast,
+            'live_scheduled': video.scheduled_start,
+            'live_next_check': live_next_check,
+            'live_checks': live_checks,
             'state': download_status,
             'is_shorts': None,
         }
 
         if existing:
             log.loud('Updating Video %s.', video)
+            previous_views = existing.views
             self.update(objects.Video, pairs=data, where_key='id')
         else:
             log.loud('Inserting Video %s.', video)
+            previous_views = None
             self.insert(objects.Video, pairs=data)
 
+        if video.views is not None and video.views != previous_views:
+            self.record_video_views(video.id, video.views)
+
         # Override the cached copy with the new copy so that the cache contains
         # updated information (view counts etc.).
         video = objects.Video(self, data)
@@ -427,9 +1070,183 @@ class YCDLDBVideoMixin:
         )
         return {'new': is_new, 'video': video}
 
+    @worms.atomic
+    def mark_videos_state(self, video_ids, state) -> int:
+        '''
+        Set the state of many videos with one UPDATE per chunk of ids, instead
+        of calling Video.mark_state for each one. Cached Video objects are
+        updated in place. Return the number of videos whose state changed.
+
+        Like mark_state, this does not create queuefiles. See download_video.
+
+        Raises exceptions.InvalidVideoState if the state is not valid.
+        Raises exceptions.NoSuchVideo if any of the ids is not in the
+        database, before anything is changed.
+        '''
+        self.assert_valid_state(state)
+        state = sys.intern(state)
+        video_ids = list(dict.fromkeys(video_ids))
+        # The UPDATE binds the state twice besides the ids.
+        size = constants.SQLITE_MAX_VARIABLES - 2
+        chunks = [video_ids[index:index + size] for index in range(0, len(video_ids), size)]
+
+        for chunk in chunks:
+            qmarks = ', '.join('?' * len(chunk))
+            query = f'SELECT id FROM videos WHERE id IN ({qmarks})'
+            found = set(self.select_column(query, chunk))
+            if len(found) < len(chunk):
+                missing = next(video_id for video_id in chunk if video_id not in found)
+                raise exceptions.NoSuchVideo(missing)
+
+        log.info('Marking %d videos as %s.', len(video_ids), state)
+        changed = 0
+        cache = self.caches[objects.Video]
+        for chunk in chunks:
+            qmarks = ', '.join('?' * len(chunk))
+            query = f'UPDATE videos SET state = ? WHERE id IN ({qmarks}) AND state IS NOT ?'
+            changed += self.execute(query, [state, *chunk, state]).rowcount
+            for video_id in chunk:
+                video = cache.get(video_id)
+                if video is not None:
+                    video.state = state
+
+        return changed
+
+class YCDLDBViewHistoryMixin:
+    '''
+    The view counts of videos are sampled into video_stats_history whenever
+    a refresh sees that they have changed. See viewhistory for the format.
+    '''
+    def __init__(self):
+        super().__init__()
+
+    def get_top_movers(self, *, since, until=None, limit=20) -> list[dict]:
+        '''
+        Return the videos that gained the most views between the two
+        timestamps, as dicts of video_id, views_before, views_after and
+        growth, with the biggest growth first.
+
+        views_before is the last sample before `since`, or the first sample
+        after it for videos that weren't known yet.
+        '''
+        if until is None:
+            until = timetools.now().timestamp()
+        first_month = viewhistory.month_of(since)
+        last_month = viewhistory.month_of(until)
+
+        # The months in the range, plus the latest month before the range for
+        # each of those videos, which holds the starting point.
+        query = '''
+        SELECT video_id, month, samples FROM video_stats_history
+        WHERE month BETWEEN ? AND ?
+        UNION ALL
+        SELECT history.video_id, history.month, history.samples
+        FROM video_stats_history AS history
+        WHERE history.video_id IN (
+            SELECT video_id FROM video_stats_history WHERE month BETWEEN ? AND ?
+        )
+        AND history.month == (
+            SELECT MAX(month) FROM video_stats_history AS previous
+            WHERE previous.video_id == history.video_id AND previous.month < ?
+        )
+        ORDER BY video_id, month
+        '''
+        bindings = [first_month, last_month, first_month, last_month, first_month]
+
+        movers = []
+        def add_mover(video_id, samples):
+            before = None
+            after = None
+            for (timestamp, views) in samples:
+                if timestamp < since:
+                    before = views
+                elif timestamp <= until:
+                    if before is None:
+                        before = views
+                    after = views
+            if after is not None:
+                movers.append({
+                    'video_id': video_id,
+                    'views_before': before,
+                    'views_after': after,
+                    'growth': after - before,
+                })
+
+        current_id = None
+        samples = []
+        for (video_id, month, blob) in self.select(query, bindings):
+            if video_id != current_id:
+                if current_id is not None:
+                    add_mover(current_id, samples)
+                current_id = video_id
+                samples = []
+            samples.extend(viewhistory.decode(blob, month))
+        if current_id is not None:
+            add_mover(current_id, samples)
+
+        movers.sort(key=lambda mover: mover['growth'], reverse=True)
+        return movers[:limit]
+
+    def get_view_history(self, video_id, *, since=None, until=None) -> list[tuple]:
+        '''
+        Return the [(timestamp, views), ...] samples of the video, oldest
+        first, optionally limited to the time range.
+        '''
+        wheres = ['video_id == ?']
+        bindings = [video_id]
+        if since is not None:
+            wheres.append('month >= ?')
+            bindings.append(viewhistory.month_of(since))
+        if until is not None:
+            wheres.append('month <= ?')
+            bindings.append(viewhistory.month_of(until))
+        query = f'SELECT month, samples FROM video_stats_history WHERE {" AND ".join(wheres)} ORDER BY month'
+
+        history = []
+        for (month, blob) in self.select(query, bindings):
+            for (timestamp, views) in viewhistory.decode(blob, month):
+                if since is not None and timestamp < since:
+                    continue
+                if until is not None and timestamp > until:
+                    continue
+                history.append((timestamp, views))
+        return history
+
+    @worms.atomic
+    def record_video_views(self, video_id, views, timestamp=None):
+        '''
+        Add a sample to the video's history. insert_video calls this when the
+        views have changed, so you usually don't need to.
+        '''
+        if timestamp is None:
+            timestamp = timetools.now().timestamp()
+        month = viewhistory.month_of(timestamp)
+
+        query = 'SELECT samples FROM video_stats_history WHERE video_id == ? AND month == ?'
+        blob = self.select_one_value(query, [video_id, month])
+        blob = viewhistory.append(blob, month, timestamp, views)
+
+        query = '''
+        INSERT INTO video_stats_history(video_id, month, samples) VALUES(?, ?, ?)
+        ON CONFLICT(video_id, month) DO UPDATE SET samples = excluded.samples
+        '''
+        self.execute(query, [video_id, month, blob])
+
+# Statements that change the database, for the transaction hold time metric.
+# Reads, BEGIN and savepoints don't count.
+_WRITE_STATEMENT = re.compile(r'\s*(?:INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+# The YCDLDB instances shared by everything in this process that asks for one,
+# keyed by the absolute path of their data directory. See YCDLDB.get_shared.
+_shared_instances = {}
+_shared_instances_lock = threading.Lock()
+
 class YCDLDB(
         YCDLDBChannelMixin,
+        YCDLDBDownloadQueueMixin,
+        YCDLDBJobMixin,
         YCDLDBVideoMixin,
+        YCDLDBViewHistoryMixin,
         worms.DatabaseWithCaching,
     ):
     def __init__(
@@ -441,9 +1258,13 @@ class YCDLDB(
             skip_version_check=False,
         ):
         super().__init__()
-        if youtube is None:
-            youtube = ytapi.Youtube(youtube_credentials.get_youtube_key())
-        self.youtube = youtube
+        # perf_counter of the first write in the current transaction, for the
+        # transaction hold time metric.
+        self._write_started = None
+
+        # When None, the client is built the first time it's used, so that
+        # read-only work doesn't need credentials or googleapiclient.
+        self._youtube = youtube
 
         # DATA DIR PREP
         if data_directory is None:
@@ -482,7 +1303,7 @@ class YCDLDB(
     def _init_caches(self):
         self.caches = {
             objects.Channel: cacheclass.Cache(maxlen=20_000),
-            objects.Video: cacheclass.Cache(maxlen=50_000),
+            objects.Video: cacheclass.Cache(maxlen=500_000),
         }
 
     def _init_column_index(self):
@@ -499,6 +1320,8 @@ class YCDLDB(
         self.data_directory.makedirs(exist_ok=True)
         self.sql_read = self._make_sqlite_read_connection(self.database_filepath)
         self.sql_write = self._make_sqlite_write_connection(self.database_filepath)
+        if sqlprofiler.is_enabled():
+            self.enable_sql_profiler()
 
         if existing_database:
             if not skip_version_check:
@@ -519,12 +1342,22 @@ class YCDLDB(
         log.debug('Reloading pragmas.')
         self.pragma_write('cache_size', 10000)
 
+    def _observe_transaction(self, outcome):
+        if self._write_started is None:
+            return
+        metrics.TRANSACTION_SECONDS.observe(time.perf_counter() - self._write_started, outcome=outcome)
+        self._write_started = None
+
     @classmethod
-    def closest_ycdldb(cls, youtube=None, path='.', *args, **kwargs):
+    def closest_ycdldb(cls, youtube=None, path='.', *args, shared=False, **kwargs):
         '''
         Starting from the given path and climbing upwards towards the filesystem
         root, look for an existing YCDL data directory and return the
         YCDLDB object. If none exists, raise exceptions.NoClosestYCDLDB.
+
+        shared:
+            If True, return the process's shared instance for that data
+            directory, see get_shared.
         '''
         path = pathclass.Path(path)
         starting = path
@@ -539,6 +1372,10 @@ class YCDLDB(
             path = parent
 
         path = possible
+        log.debug('Found closest YCDLDB at %s.', path.absolute_path)
+        if shared:
+            return cls.get_shared(path, youtube=youtube, *args, **kwargs)
+
         ycdldb = cls(
             youtube=youtube,
             data_directory=path,
@@ -546,7 +1383,25 @@ class YCDLDB(
             *args,
             **kwargs,
         )
-        log.debug('Found closest YCDLDB at %s.', path.absolute_path)
+        return ycdldb
+
+    @classmethod
+    def get_shared(cls, data_directory, *args, **kwargs):
+        '''
+        Return the YCDLDB for this data directory that is shared by the whole
+        process, creating it the first time. Callers that share an instance
+        also share its object cache, and the database, config and API client
+        are only set up once.
+
+        The other arguments are only used when the instance is created.
+        '''
+        key = pathclass.Path(data_directory).absolute_path
+        with _shared_instances_lock:
+            ycdldb = _shared_instances.get(key)
+            if ycdldb is None:
+                kwargs.setdefault('create', False)
+                ycdldb = cls(data_directory=data_directory, *args, **kwargs)
+                _shared_instances[key] = ycdldb
         return ycdldb
 
     @staticmethod
@@ -554,6 +1409,36 @@ class YCDLDB(
         if state not in constants.VIDEO_STATES:
             raise exceptions.InvalidVideoState(state)
 
+    def close(self):
+        with _shared_instances_lock:
+            if _shared_instances.get(self.data_directory.absolute_path) is self:
+                del _shared_instances[self.data_directory.absolute_path]
+        return super().close()
+
+    def commit(self, *args, **kwargs):
+        result = super().commit(*args, **kwargs)
+        self._observe_transaction('commit')
+        return result
+
+    def enable_sql_profiler(self):
+        '''
+        Wrap the database connections so that statements are recorded into the
+        current sqlprofiler.Profile, if there is one.
+        '''
+        if isinstance(self.sql_read, sqlprofiler.ProfilingConnection):
+            return
+        self.sql_read = sqlprofiler.ProfilingConnection(self.sql_read, 'read')
+        self.sql_write = sqlprofiler.ProfilingConnection(self.sql_write, 'write')
+
+    def execute(self, query, bindings=[]):
+        # Check first, so that a statement outside of a transaction doesn't
+        # start a clock that no commit or rollback would ever stop.
+        self.assert_transaction_active()
+        # The hold time counts from the first write of the transaction.
+        if self._write_started is None and _WRITE_STATEMENT.match(query):
+            self._write_started = time.perf_counter()
+        return super().execute(query, bindings)
+
     def get_all_states(self):
         '''
         Get a list of all the different states that are currently in use in
@@ -566,6 +1451,42 @@ class YCDLDB(
         states = self.select_column(query)
         return sorted(states)
 
+    def get_cached_instance(self, object_class, db_row):
+        result = 'hit' if db_row['id'] in self.caches[object_class] else 'miss'
+        metrics.CACHE_LOOKUPS.inc(cache=object_class.__name__, result=result)
+        return super().get_cached_instance(object_class, db_row)
+
+    def get_object_by_id(self, object_class, object_id):
+        result = 'hit' if object_id in self.caches[object_class] else 'miss'
+        metrics.CACHE_LOOKUPS.inc(cache=object_class.__name__, result=result)
+        return super().get_object_by_id(object_class, object_id)
+
+    def in_transaction(self) -> bool:
+        '''
+        Return True if this thread is already inside a transaction. Then work
+        should be done in savepoints, and committing is up to whoever opened
+        the transaction.
+        '''
+        try:
+            self.assert_transaction_active()
+        except worms.NoTransaction:
+            return False
+        return True
+
+    @property
+    def youtube(self):
+        if self._youtube is None:
+            import youtube_credentials
+            client = ytapi.CLIENTS.get(self.config['api_client'])
+            if client is None:
+                raise ValueError(f'api_client must be one of {list(ytapi.CLIENTS)}, not {self.config["api_client"]}.')
+            self._youtube = client(youtube_credentials.get_youtube_key())
+        return self._youtube
+
+    @youtube.setter
+    def youtube(self, youtube):
+        self._youtube = youtube
+
     def load_config(self):
         (config, needs_rewrite) = configlayers.load_file(
             filepath=self.config_filepath,
@@ -576,6 +1497,13 @@ class YCDLDB(
         if needs_rewrite:
             self.save_config()
 
+    def rollback(self, *args, **kwargs):
+        result = super().rollback(*args, **kwargs)
+        # Rolling back to a savepoint does not end the transaction.
+        if not args and not kwargs:
+            self._observe_transaction('rollback')
+        return result
+
     def save_config(self):
         with self.config_filepath.open('w', encoding='utf-8') as handle:
             handle.write(json.dumps(self.config, indent=4, sort_keys=True))
@@ -1,21 +1,41 @@
-import googleapiclient.discovery
-import isodate
-import requests
 import typing
 
 from voussoirkit import gentools
-from voussoirkit import httperrors
 from voussoirkit import vlogging
 
 log = vlogging.getLogger(__name__)
 
-session = requests.Session()
+from . import metrics
+from . import resilience
+
+# Created by get_session the first time it's needed, so that commands which
+# never go online don't pay for importing requests.
+session = None
+
+def get_session():
+    global session
+    if session is None:
+        import requests
+        session = requests.Session()
+    return session
+
+# This can be pointed at a stand-in server for testing and benchmarks.
+SHORTS_URL = 'https://www.youtube.com/shorts/{video_id}'
 
 def int_none(x):
     if x is None:
         return None
     return int(x)
 
+class ApiError(Exception):
+    '''
+    Raised by every Youtube client when the API returns an error, so callers
+    don't have to know which client they have.
+    '''
+    def __init__(self, status, message):
+        super().__init__(f'{status} {message}')
+        self.status = status
+
 class ChannelNotFound(Exception):
     pass
 
@@ -24,6 +44,7 @@ class VideoNotFound(Exception):
 
 class Video:
     def __init__(self, data):
+        import isodate
         self.id = data['id']
 
         snippet = data['snippet']
@@ -41,6 +62,12 @@ class Video:
         self.live_broadcast = snippet['liveBroadcastContent']
         if self.live_broadcast == 'none':
             self.live_broadcast = None
+
+        # Only present for premieres and live streams.
+        live_details = data.get('liveStreamingDetails', {})
+        self.scheduled_start = live_details.get('scheduledStartTime', None)
+        if self.scheduled_start is not None:
+            self.scheduled_start = isodate.parse_datetime(self.scheduled_start).timestamp()
         self.tags = snippet.get('tags', [])
 
         if 'duration' in content_details:
@@ -62,23 +89,67 @@ class Video:
         return 'Video:%s' % self.id
 
 class Youtube:
-    def __init__(self, key):
+    DEFAULT_API_ENDPOINT = 'https://www.googleapis.com/'
+
+    def __init__(self, key, *, api_endpoint=None):
+        '''
+        api_endpoint:
+            By default, requests go to the real Youtube API. You can pass a URL
+            like "http://localhost:8080" to use a stand-in server
+            instead, such as utilities/fake_youtube.py.
+        '''
+        # googleapiclient takes a long time to import, so it waits until
+        # something actually needs the API.
+        import googleapiclient.discovery
+        import httplib2
+        client_options = {'api_endpoint': api_endpoint} if api_endpoint else None
+        self.host = resilience.host_of(api_endpoint or self.DEFAULT_API_ENDPOINT)
         self.youtube = googleapiclient.discovery.build(
             cache_discovery=False,
+            client_options=client_options,
             developerKey=key,
+            # httplib2 has one timeout for connecting and reading.
+            http=httplib2.Http(timeout=resilience.DEFAULT_READ_TIMEOUT),
             serviceName='youtube',
             version='v3',
         )
 
+    def _request(self, endpoint, params):
+        import googleapiclient.errors
+        (resource, method) = endpoint.split('.')
+        request = getattr(getattr(self.youtube, resource)(), method)(**params)
+        try:
+            return request.execute()
+        except googleapiclient.errors.HttpError as exc:
+            raise ApiError(exc.resp.status, getattr(exc, 'reason', str(exc))) from exc
+
+    def _list(self, endpoint, **params):
+        '''
+        Call the endpoint, a name like "videos.list", through the API host's
+        circuit breaker with retries, and count each attempt in the metrics.
+        Subclasses only need to override _request.
+        '''
+        def attempt():
+            try:
+                response = self._request(endpoint, params)
+            except Exception:
+                metrics.record_api_call(endpoint, 'error')
+                raise
+            metrics.record_api_call(endpoint, 'ok')
+            return response
+
+        return resilience.call(self.host, attempt)
+
     def _playlist_paginator(self, playlist_id):
         page_token = None
         while True:
-            response = self.youtube.playlistItems().list(
+            response = self._list(
+                'playlistItems.list',
                 maxResults=50,
                 pageToken=page_token,
                 part='contentDetails',
                 playlistId=playlist_id,
-            ).execute()
+            )
 
             yield from response['items']
 
@@ -96,31 +167,32 @@ class Youtube:
         if isinstance(video_id, Video):
             video_id = video_id.id
 
-        results = self.youtube.search().list(
+        results = self._list(
+            'search.list',
             part='id',
             relatedToVideoId=video_id,
             type='video',
             maxResults=count,
-        ).execute()
+        )
 
         related = [rel['id']['videoId'] for rel in results['items']]
         videos = self.get_videos(related)
         return videos
 
     def get_user_id(self, username) -> str:
-        user = self.youtube.channels().list(part='snippet', forUsername=username).execute()
+        user = self._list('channels.list', part='snippet', forUsername=username)
         if not user.get('items'):
             raise ChannelNotFound(f'username: {username}')
         return user['items'][0]['id']
 
     def get_user_name(self, uid) -> str:
-        user = self.youtube.channels().list(part='snippet', id=uid).execute()
+        user = self._list('channels.list', part='snippet', id=uid)
         if not user.get('items'):
             raise ChannelNotFound(f'uid: {uid}')
         return user['items'][0]['snippet']['title']
 
     def get_user_uploads_playlist_id(self, uid) -> str:
-        user = self.youtube.channels().list(part='contentDetails', id=uid).execute()
+        user = self._list('channels.list', part='contentDetails', id=uid)
         if not user.get('items'):
             raise ChannelNotFound(f'uid: {uid}')
         return user['items'][0]['contentDetails']['relatedPlaylists']['uploads']
@@ -142,10 +214,11 @@ class Youtube:
             log.debug('Requesting batch of %d video ids.', len(chunk))
             log.loud(chunk)
             chunk = ','.join(chunk)
-            data = self.youtube.videos().list(
-                part='id,contentDetails,snippet,statistics',
+            data = self._list(
+                'videos.list',
+                part='id,contentDetails,liveStreamingDetails,snippet,statistics',
                 id=chunk,
-            ).execute()
+            )
             snippets = data['items']
             log.debug('Got batch of %d snippets.', len(snippets))
             total_snippets += len(snippets)
@@ -159,10 +232,55 @@ class Youtube:
                     log.warning(f'KEYERROR: {exc} not in {snippet}')
         log.debug('Finished getting a total of %d snippets.', total_snippets)
 
+class RestYoutube(Youtube):
+    '''
+    A client for the same endpoints that talks to the REST API directly over a
+    pooled requests session, instead of going through googleapiclient. It
+    doesn't need googleapiclient or httplib2 to be installed, and one instance
+    can be shared by many threads, whereas googleapiclient's httplib2
+    connections can't. It is not faster, see benchmark.py api.
+    '''
+    def __init__(self, key, *, api_endpoint=None, pool_size=16):
+        import requests
+        import requests.adapters
+        self.key = key
+        self.host = resilience.host_of(api_endpoint or self.DEFAULT_API_ENDPOINT)
+        self.base_url = (api_endpoint or self.DEFAULT_API_ENDPOINT).rstrip('/') + '/youtube/v3/'
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Google only compresses responses for user agents that mention gzip.
+        self.session.headers['User-Agent'] = 'ycdl (gzip)'
+        self.session.headers['Accept-Encoding'] = 'gzip'
+
+    def _request(self, endpoint, params):
+        (resource, method) = endpoint.split('.')
+        params = {key: value for (key, value) in params.items() if value is not None}
+        params['key'] = self.key
+        response = self.session.get(self.base_url + resource, params=params, timeout=resilience.DEFAULT_TIMEOUT)
+        if response.status_code >= 400:
+            try:
+                message = response.json()['error']['message']
+            except Exception:
+                message = response.text
+            raise ApiError(response.status_code, message)
+        return response.json()
+
+# The names used by the api_client config option.
+CLIENTS = {
+    'googleapiclient': Youtube,
+    'rest': RestYoutube,
+}
+
 def video_is_shorts(video_id) -> bool:
-    url = f'https://www.youtube.com/shorts/{video_id}'
+    # httperrors imports requests.
+    from voussoirkit import httperrors
+    url = SHORTS_URL.format(video_id=video_id)
     log.loud('Checking if %s is shorts.', video_id)
-    response = session.head(url)
+    # Regular videos answer 303. Session.request would follow that to the
+    # watch page and get a 200, so redirects must not be followed.
+    response = resilience.request(get_session(), 'HEAD', url, allow_redirects=False)
     httperrors.raise_for_status(response)
 
     if response.status_code == 200:
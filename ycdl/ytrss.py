@@ -1,22 +1,35 @@
-import bs4
-# Importing so that if lxml is not installed, you get an ImportError right
-# away instead of when bs4 tries to parse.
-import lxml
-import requests
+import time
 import traceback
 
 from voussoirkit import vlogging
 
 from . import exceptions
+from . import metrics
+from . import resilience
 
 log = vlogging.getLogger(__name__)
 
-session = requests.Session()
+# Created by get_session the first time a feed is fetched, so that commands
+# which never go online don't pay for importing requests.
+session = None
+
+def get_session():
+    global session
+    if session is None:
+        import requests
+        session = requests.Session()
+    return session
+
+# This can be pointed at a stand-in server for testing and benchmarks.
+FEED_URL = 'https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}'
 
 def _get_user_videos(channel_id):
+    import bs4
     log.info(f'Fetching RSS for {channel_id}.')
-    url = f'https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}'
-    response = session.get(url)
+    url = FEED_URL.format(channel_id=channel_id)
+    response = resilience.request(get_session(), 'GET', url)
+    if response.status_code == 404:
+        raise exceptions.RSSFeedNotFound(channel_id)
     response.raise_for_status()
     soup = bs4.BeautifulSoup(response.text, 'lxml')
     # find_all does not work on namespaced tags unless you add a limit paramter.
@@ -28,12 +41,28 @@ def get_user_videos(channel_id) -> list[str]:
     '''
     Return the list of video ids from the channel.
     Expect a maximum of 15 results.
+
+    Raises exceptions.RSSFeedNotFound if the feed is a 404, which usually means
+    the channel has been deleted, or exceptions.RSSAssistFailed for any other
+    problem.
     '''
+    # These are slow to import and only needed for refreshes. They are
+    # imported outside of the try so that if lxml is not installed, you get an
+    # ImportError instead of a failed RSS assist.
+    import bs4
+    import lxml
+    start = time.perf_counter()
     try:
-        return _get_user_videos(channel_id)
+        video_ids = _get_user_videos(channel_id)
+    except exceptions.RSSFeedNotFound:
+        metrics.RSS_FETCH_SECONDS.observe(time.perf_counter() - start, outcome='not_found')
+        raise
     except Exception as exc:
+        metrics.RSS_FETCH_SECONDS.observe(time.perf_counter() - start, outcome='error')
         log.warning(traceback.format_exc())
         raise exceptions.RSSAssistFailed(f'Failed to fetch RSS videos ({exc}).') from exc
+    metrics.RSS_FETCH_SECONDS.observe(time.perf_counter() - start, outcome='ok')
+    return video_ids
 
 def get_user_videos_since(channel_id, video_id) -> list[str]:
     '''